@@ -0,0 +1,188 @@
+import asyncio
+import json
+import logging
+
+from starlette.responses import StreamingResponse
+from backend.api.chat import ChatApi
+from backend.config import environment
+from backend.config.models import ChatRequest
+from backend.services.clients import ClientRegistry
+
+
+async def run(chunks, clients: ClientRegistry = None, max_concurrency: int = None,
+              include_followups: bool = True, persist_history: bool = True, body_read: asyncio.Event = None):
+    """
+    Executes the main logic of the 'chat/batch' API endpoint, streaming the results as JSON Lines.
+
+    The chat requests are answered as the request body is received (chunks), without reading it in memory first.
+    """
+    try:
+        batch_api = ChatBatchApi(clients, include_followups, persist_history)
+        async for result in batch_api.main(read_lines(chunks, body_read), max_concurrency):
+            yield json.dumps(result) + '\n'
+
+    except Exception as e:
+        logging.error(f"Error in batch.run: {e}", exc_info=True)
+        yield json.dumps({'error': f"Error in batch.run: {e}"}) + '\n'
+
+
+async def read_lines(chunks, body_read: asyncio.Event = None, max_bytes: int = environment.CHAT_BATCH_MAX_BYTES):
+    """
+    Split a stream of bytes into lines, as the bytes are received.
+
+    Args:
+        chunks (AsyncIterator): The chunks of bytes.
+        body_read (asyncio.Event, optional): The event set once all the chunks are received (or failed).
+        max_bytes (int, optional): The maximum number of bytes (0 for no limit).
+
+    Yields:
+        str: The lines.
+    """
+    try:
+        size = 0
+        buffer = b''
+        async for chunk in chunks:
+            size += len(chunk)
+            if max_bytes > 0 and size > max_bytes:
+                raise Exception(f"The batch exceeds the maximum size of {max_bytes} bytes")
+
+            *lines, buffer = (buffer + chunk).split(b'\n')
+            for line in lines:
+                yield line.decode('utf-8')
+
+        if buffer:
+            yield buffer.decode('utf-8')
+
+    finally:
+        if body_read:
+            body_read.set()
+
+
+class ChatBatchResponse(StreamingResponse):
+    """
+    A streaming response sent while the request body is still being received.
+
+    The client disconnection is only listened for once the request body is read, since both are received
+    on the same channel (ASGI servers before spec version 2.4).
+    """
+
+    def __init__(self, content, body_read: asyncio.Event, **kwargs):
+        super().__init__(content, **kwargs)
+        self.body_read = body_read
+
+
+    async def listen_for_disconnect(self, receive) -> None:
+        await self.body_read.wait()
+        await super().listen_for_disconnect(receive)
+
+
+class ChatBatchApi():
+    """
+    A class that provides the main logic for the 'chat/batch' API endpoint, used by offline and evaluation workloads.
+
+    The chat requests are answered concurrently (bounded by max_concurrency), sharing the clients and
+    caches of the application, and the turns of a session are answered in order. The results are
+    returned in completion order, with the index of their request (its line number, blank lines
+    excepted). A failed request does not prevent the others from being answered. Without history
+    persistence, the turns of each session are kept in memory for the duration of the batch, so that
+    the later turns of a session see the earlier ones.
+    """
+
+    def __init__(self, clients: ClientRegistry = None, include_followups: bool = True, persist_history: bool = True):
+        self.clients = clients
+        self.include_followups = include_followups
+        self.persist_history = persist_history
+        self.chat_histories = {}
+
+
+    async def main(self, lines, max_concurrency: int = None):
+        """
+        Answer the chat requests of JSON Lines, as they are read.
+
+        Args:
+            lines (AsyncIterator): The lines (a ChatRequest in JSON each).
+            max_concurrency (int, optional): The number of requests answered at a time, up to CHAT_BATCH_MAX_CONCURRENCY.
+
+        Yields:
+            dict: The result of each request: its index, and its response or error.
+        """
+        max_concurrency = min(max(max_concurrency or environment.CHAT_BATCH_MAX_CONCURRENCY, 1), environment.CHAT_BATCH_MAX_CONCURRENCY)
+        semaphore = asyncio.Semaphore(max_concurrency)
+        results = asyncio.Queue()
+        tasks = set()
+        sessions = {}
+
+        async def read():
+            try:
+                index = 0
+                async for line in lines:
+                    if not line.strip():
+                        continue
+
+                    try:
+                        request = ChatRequest.model_validate_json(line)
+                    except Exception as e:
+                        results.put_nowait({'index': index, 'error': f"Invalid chat request: {e}"})
+                        index += 1
+                        continue
+
+                    # Wait for a free slot before starting the next request (the next lines are not read meanwhile)
+                    await semaphore.acquire()
+
+                    task = asyncio.create_task(self.answer(index, request, sessions.get(request.session_id), results))
+                    sessions[request.session_id] = task
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: semaphore.release())
+                    task.add_done_callback(lambda task, session_id=request.session_id: sessions.pop(session_id) if sessions.get(session_id) is task else None)
+                    index += 1
+
+            finally:
+                # The requests already started are answered, even if the body could not be read to the end
+                if tasks:
+                    await asyncio.wait(set(tasks))
+                results.put_nowait(None)
+
+        reader = asyncio.create_task(read())
+        try:
+            while True:
+                result = await results.get()
+                if result is None:
+                    break
+                yield result
+
+            await reader
+
+        finally:
+            reader.cancel()
+            for task in tasks:
+                task.cancel()
+
+
+    async def answer(self, index: int, request: ChatRequest, previous_turn: asyncio.Task, results: asyncio.Queue) -> None:
+        """
+        Answer a chat request, after the previous turn of its session in the batch.
+
+        Args:
+            index (int): The index of the request.
+            request (ChatRequest): The chat request.
+            previous_turn (asyncio.Task): The task answering the previous turn of the session, if any.
+            results (asyncio.Queue): The queue the result is added to.
+        """
+        if previous_turn:
+            await asyncio.wait({previous_turn})
+
+        try:
+            if not self.include_followups:
+                request = request.model_copy(update={'include_followups': False})
+
+            chat_history = None if self.persist_history else self.chat_histories.setdefault(request.session_id, [])
+            chat_api = ChatApi(self.clients, persist_history=self.persist_history, chat_history=chat_history)
+            response = await chat_api.main(request)
+            result = {'index': index, 'response': response.model_dump()}
+
+        except Exception as e:
+            logging.error(f"Error in batch request {index}: {e}")
+            result = {'index': index, 'error': f"{e}"}
+
+        results.put_nowait(result)
@@ -1,21 +1,38 @@
+import asyncio
 import json
+import logging
+import time
+import uuid
 
 from azure.cosmos import exceptions
-from backend.services.search import CognitiveSearch
-from backend.services.database import ChatHistoryDatabase
-from backend.services.gpt import GptModel
+from backend.services.search import AsyncCognitiveSearch
+from backend.services.database import AsyncChatHistoryDatabase
+from backend.services.gpt import AsyncGptModel
+from backend.services.ratelimit import Priority
 from backend.services.message import MessageBuilder
+from backend.services.clients import ClientRegistry
+from backend.services.telemetry import telemetry
 from backend.config import prompts
-from backend.config.models import ChatRequest, ChatResponse, SearchRequest
+from backend.config import environment
+from backend.config.models import ChatRequest, ChatResponse, SearchRequest, GptModelResponse
 
 
-def run(request: ChatRequest) -> ChatResponse:
+async def run(request: ChatRequest, clients: ClientRegistry = None, idempotency_key: str = None) -> ChatResponse:
     """
     Executes the main logic of the 'chat' API endpoint.
+
+    Identical turns in flight run once, and a request retried with the same idempotency key gets the stored response.
     """
     try:
-        chat_api = ChatApi()
-        return chat_api.main(request)
+        chat_coalescer = clients.chat_coalescer if clients else None
+        if not chat_coalescer:
+            return await ChatApi(clients).main(request)
+
+        return await chat_coalescer.run(
+            request,
+            lambda: ChatApi(clients).main(request),
+            idempotency_key
+        )
 
     except exceptions.CosmosHttpResponseError as e:
         raise Exception(f"Database error in chat.run: {e.reason} ({e.status_code})")
@@ -24,19 +41,66 @@ def run(request: ChatRequest) -> ChatResponse:
         raise Exception(f"Error in chat.run: {e}")
 
 
+async def stream(request: ChatRequest, clients: ClientRegistry = None):
+    """
+    Executes the main logic of the 'chat' API endpoint, streaming the response as server-sent events.
+    """
+    try:
+        chat_api = ChatApi(clients)
+        async for event, data in chat_api.stream(request):
+            yield format_event(event, data)
+
+    except exceptions.CosmosHttpResponseError as e:
+        logging.error(f"Database error in chat.stream: {e.reason} ({e.status_code})", exc_info=True)
+        yield format_event('error', {'reason': f"Database error in chat.stream: {e.reason} ({e.status_code})"})
+
+    except Exception as e:
+        logging.error(f"Error in chat.stream: {e}", exc_info=True)
+        yield format_event('error', {'reason': f"Error in chat.stream: {e}"})
+
+
+def format_event(event: str, data: dict) -> str:
+    """
+    Formats a server-sent event.
+
+    Args:
+        event (str): The event name.
+        data (dict): The event data, serialized as JSON.
+
+    Returns:
+        str: The server-sent event message.
+    """
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 class ChatApi():
     """
     A class that provides the main logic for the 'chat' API endpoint.
+
+    The chat history is loaded from and written to the chat history database, or kept in memory by the
+    caller (chat_history, the turns of the session, oldest first), e.g. for batches without persistence.
     """
 
-    def __init__(self):
-        self.chat_history_db = ChatHistoryDatabase()
-        self.gpt_model = GptModel()
-        self.cognitive_search = CognitiveSearch()
+    def __init__(self, clients: ClientRegistry = None, persist_history: bool = True, chat_history: list = None):
+        self.chat_history_db = AsyncChatHistoryDatabase(clients)
+        self.persist_history = persist_history
+        self.chat_history = chat_history
+        self.gpt_model = AsyncGptModel(clients = clients)
+        self.cognitive_search = AsyncCognitiveSearch(clients, self.gpt_model)
+        self.followup_store = clients.followup_store if clients else None
+        self.semantic_cache = clients.semantic_cache if clients else None
+        self.tool_payload_compactor = clients.tool_payload_compactor if clients else None
+        self.summary_scheduler = clients.summary_scheduler if clients else None
+        self.tool_router = clients.tool_router if clients else None
         self.messages = MessageBuilder()
         self.total_tokens = 0
+        self.cached_tokens = 0
+        self.chat_history_length = 0
+        self.prompt_embedding = None
+        self.citations = []
+        self.speculative_query = None
 
-    def main(self, request: ChatRequest) -> ChatResponse:
+    async def main(self, request: ChatRequest) -> ChatResponse:
         """
         Executes the main logic of the 'chat' API endpoint.
 
@@ -46,40 +110,392 @@ class ChatApi():
         Returns:
             ChatResponse: The response object containing the assistant's response.
         """
+        # Set system prompt, chat history and current user prompt
+        with telemetry.span('history', session_id=request.session_id):
+            await self.set_prompts(request)
+
+        # Serve the response from the semantic cache, if a similar first question was answered before
+        with telemetry.span('semantic_cache'):
+            response = await self.get_cached_response(request)
+        if response:
+            return response
+
+        if self.tool_router and self.tool_router.should_route():
+
+            # Search right away when retrieval is needed, skipping the tool-selection call
+            await self.route_tools(request)
+
+            # Call GPT model to generate a response based on the search results
+            with telemetry.span('answer_gpt'):
+                model_response = await self.gpt_model.call_gpt_model(self.get_prompts(), tools=True)
+            self.total_tokens += model_response['total_tokens']
+            self.cached_tokens += model_response['cached_tokens']
+
+        else:
+
+            # Call GPT model to generate tool call(s), searching speculatively in the meantime when enabled
+            speculative_search = self.start_speculative_search(request)
+            start_time = time.perf_counter()
+            with telemetry.span('tools_gpt'):
+                model_response = await self.gpt_model.call_gpt_model_tools(self.get_prompts())
+            self.record_tool_call_latency(start_time)
+            self.total_tokens += model_response['total_tokens']
+            self.cached_tokens += model_response['cached_tokens']
+
+            if len(model_response['tool_calls']) > 0:
+
+                # Process tool calls
+                with telemetry.span('tools', tool_calls=len(model_response['tool_calls'])):
+                    await self.process_tool_calls(request.session_id, model_response['tool_calls'], speculative_search)
+
+                # Call GPT model to generate a response based on the tool results
+                with telemetry.span('answer_gpt'):
+                    model_response = await self.gpt_model.call_gpt_model(self.get_prompts(), tools=True)
+                self.total_tokens += model_response['total_tokens']
+                self.cached_tokens += model_response['cached_tokens']
+
+            elif speculative_search:
+                speculative_search.cancel()
+
+        # Generate follow-up questions, unless they are disabled or generated in the background
+        with telemetry.span('followups'):
+            followup_questions, followup_pending = await self.set_followup_questions(request, model_response)
+
+        # Write user prompt and assistant response to the chat history database
+        with telemetry.span('history_write'):
+            await self.write_chat_history(request, model_response)
+
+        # Generate the follow-up questions in the background once the chat history item is written (their tokens are added to it)
+        if followup_pending:
+            await self.followup_store.schedule(
+                model_response['id'],
+                self.generate_background_followup_questions(request, model_response)
+            )
+
+        # Set the response object
+        response = ChatResponse(
+            assistant_response = model_response['content'],
+            response_id = model_response['id'],
+            followup_questions = followup_questions,
+            total_tokens=self.total_tokens,
+            cached_tokens=self.cached_tokens,
+            model=model_response['model'],
+            followup_pending=followup_pending,
+            citations=self.citations
+        )
+
+        # Add the response to the semantic cache
+        await self.set_cached_response(request, response)
+
+        return response
+
+
+    async def stream(self, request: ChatRequest):
+        """
+        Executes the main logic of the 'chat' API endpoint, streaming the assistant's response as it is generated.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Yields:
+            tuple: An (event, data) tuple for each assistant token ('token'), followed by the response ID
+            and usage totals ('usage') and the follow-up questions ('followups'), unless they are disabled.
+        """
+        # Set system prompt, chat history and current user prompt
+        with telemetry.span('history', session_id=request.session_id):
+            await self.set_prompts(request)
+
+        # Serve the response from the semantic cache, if a similar first question was answered before
+        with telemetry.span('semantic_cache'):
+            response = await self.get_cached_response(request)
+        if response:
+            yield 'token', {'content': response.assistant_response}
+            yield 'usage', {
+                'response_id': response.response_id,
+                'total_tokens': response.total_tokens,
+                'cached_tokens': response.cached_tokens,
+                'model': response.model,
+                'citations': response.citations,
+                'cache_hit': True
+            }
+            if response.followup_questions:
+                yield 'followups', {
+                    'followup_questions': response.followup_questions,
+                    'total_tokens': response.total_tokens
+                }
+            return
+
+        if self.tool_router and self.tool_router.should_route():
+
+            # Search right away when retrieval is needed, skipping the tool-selection call
+            await self.route_tools(request)
+            model_response = None
+
+        else:
+
+            # Call GPT model to generate tool call(s) or a direct response, searching speculatively in the meantime when enabled
+            speculative_search = self.start_speculative_search(request)
+            start_time = time.perf_counter()
+            with telemetry.span('tools_gpt', current=False):
+                async for event, data in self.gpt_model.stream_gpt_model(self.get_prompts(), tools=True):
+                    if event == 'token':
+                        yield 'token', {'content': data}
+                    else:
+                        model_response = data
+            self.record_tool_call_latency(start_time)
+            self.total_tokens += model_response['total_tokens']
+            self.cached_tokens += model_response['cached_tokens']
+
+            if len(model_response['tool_calls']) > 0:
+
+                # Process tool calls
+                with telemetry.span('tools', tool_calls=len(model_response['tool_calls'])):
+                    await self.process_tool_calls(request.session_id, model_response['tool_calls'], speculative_search)
+                model_response = None
+
+            elif speculative_search:
+                speculative_search.cancel()
+
+        if model_response is None:
+
+            # Call GPT model to generate a response based on the tool results
+            with telemetry.span('answer_gpt', current=False):
+                async for event, data in self.gpt_model.stream_gpt_model(self.get_prompts(), tools=True, tool_choice="none"):
+                    if event == 'token':
+                        yield 'token', {'content': data}
+                    else:
+                        model_response = data
+            self.total_tokens += model_response['total_tokens']
+            self.cached_tokens += model_response['cached_tokens']
+
+        # Write user prompt and assistant response to the chat history database
+        with telemetry.span('history_write'):
+            await self.write_chat_history(request, model_response)
+
+        yield 'usage', {
+            'response_id': model_response['id'],
+            'total_tokens': self.total_tokens,
+            'cached_tokens': self.cached_tokens,
+            'model': model_response['model'],
+            'citations': self.citations,
+            'cache_hit': False
+        }
+
+        # Generate follow-up questions after the response is complete, over the same stream
+        followup_questions = {}
+        if request.include_followups and environment.FOLLOWUP_MODE != 'disabled':
+            with telemetry.span('followups'):
+                followup_questions, model_response_followup = await self.generate_followup_questions(model_response['content'])
+            self.total_tokens += model_response_followup['total_tokens']
+            self.cached_tokens += model_response_followup['cached_tokens']
+
+            # The chat history item is written before the follow-up questions are generated
+            await self.update_chat_history_tokens(request, model_response)
+
+            yield 'followups', {
+                'followup_questions': followup_questions,
+                'total_tokens': self.total_tokens,
+                'cached_tokens': self.cached_tokens
+            }
+
+        # Add the response to the semantic cache
+        await self.set_cached_response(request, ChatResponse(
+            assistant_response = model_response['content'],
+            response_id = model_response['id'],
+            followup_questions = followup_questions,
+            total_tokens = self.total_tokens,
+            cached_tokens = self.cached_tokens,
+            model = model_response['model'],
+            citations = self.citations
+        ))
+
+
+    def get_prompts(self) -> list:
+        """
+        Get the prompts to send to the GPT model, fitted into the prompt token budget.
+
+        Returns:
+            list: The list of prompts.
+        """
+        if not environment.PROMPT_TOKEN_BUDGET and not environment.PROMPT_DOCUMENT_MAX_TOKENS:
+            return self.messages.get_prompts()
+
+        prompts = self.messages.get_prompts_with_budget(environment.PROMPT_TOKEN_BUDGET, environment.PROMPT_DOCUMENT_MAX_TOKENS)
+        logging.debug(f"Prompt tokens: {self.messages.get_token_report()}")
+
+        return prompts
+
+
+    async def set_prompts(self, request: ChatRequest) -> None:
+        """
+        Set the system prompt, the chat history and the current user prompt.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Returns:
+            None
+        """
         # Set user ID
         self.gpt_model.user_id = request.user_id
 
-        # Set system prompt
-        self.messages.add_system_prompt(prompts.get_system_prompt_text(request.user_name))
+        # Set system prompt, the same for all users so that it is served from the prompt cache, and then the user's name
+        self.messages.add_system_prompt(prompts.get_system_prompt_text())
+        if request.user_name:
+            self.messages.add_prompt('system', prompts.get_user_prompt_text(request.user_name), 'system')
 
         # Load chat history
-        self.load_chat_history(request.session_id, 10)
+        await self.load_chat_history(request.session_id, 10)
 
         # Set current user prompt
         self.messages.add_prompt('user', request.user_prompt)
 
-        # Call GPT model to generate tool call(s)
-        model_response = self.gpt_model.call_gpt_model_tools(self.messages.get_prompts())
-        self.total_tokens += model_response['total_tokens']
 
-        if len(model_response['tool_calls']) > 0:
-            
-            # Process tool calls
-            self.process_tool_calls(request.session_id, model_response['tool_calls'])
+    async def get_cached_response(self, request: ChatRequest) -> ChatResponse:
+        """
+        Get a response from the semantic cache for the first question of a session.
 
-            # Call GPT model to generate a response based on the tool results
-            model_response = self.gpt_model.call_gpt_model(self.messages.get_prompts())
-            self.total_tokens += model_response['total_tokens']
+        On a cache hit, the cached response is returned with a new response ID and is written to the
+        chat history, so that the session continues from the cached answer.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Returns:
+            ChatResponse: The cached response, or None if the cache is disabled or there is no similar question.
+        """
+        if not self.semantic_cache or self.chat_history_length > 0:
+            return None
+
+        self.prompt_embedding = await self.gpt_model.generate_embeddings(request.user_prompt)
+
+        cached_response = await self.semantic_cache.get(self.get_cache_scope(request), self.prompt_embedding)
+        if cached_response is None:
+            return None
+
+        response = cached_response.model_copy(update={
+            'response_id': str(uuid.uuid4()),
+            'followup_questions': cached_response.followup_questions if request.include_followups else {},
+            'total_tokens': 0,
+            'cached_tokens': 0,
+            'followup_pending': False,
+            'cache_hit': True
+        })
+
+        if self.chat_history is not None:
+            self.chat_history.append({'id': response.response_id, 'user_prompt': request.user_prompt, 'assistant_response': response.assistant_response})
+
+        if self.persist_history:
+            await self.chat_history_db.write_chat_history(
+                id = response.response_id,
+                session_id = request.session_id,
+                user_prompt = request.user_prompt,
+                assistant_response = response.assistant_response,
+                total_tokens = response.total_tokens
+            )
+
+        return response
+
+
+    async def set_cached_response(self, request: ChatRequest, response: ChatResponse) -> None:
+        """
+        Add the response to the first question of a session to the semantic cache.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+            response (ChatResponse): The response object containing the assistant's response.
+
+        Returns:
+            None
+        """
+        if self.semantic_cache and self.prompt_embedding is not None:
+            await self.semantic_cache.set(self.get_cache_scope(request), self.prompt_embedding, response)
+
+
+    def get_cache_scope(self, request: ChatRequest) -> str:
+        """
+        Get the semantic cache scope of a request. Responses are only shared between users with the
+        same name, since the name is part of the prompts and may appear in the answer.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Returns:
+            str: The semantic cache scope.
+        """
+        return (request.user_name or '').strip().lower()
+
+
+    async def set_followup_questions(self, request: ChatRequest, model_response: GptModelResponse) -> tuple:
+        """
+        Generate the follow-up questions according to the follow-up mode ('sync', 'background' or 'disabled').
 
-        # Set assistant response
-        self.messages.add_prompt('assistant', model_response['content'])
+        In background mode, the follow-up questions are scheduled once the chat history is written, generated
+        after the response is returned, and can be fetched from the follow-up store using the response ID.
 
-        # Set system prompt for follow-up questions
-        self.messages.add_system_prompt(prompts.get_system_prompt_text_followup())
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+            model_response (GptModelResponse): The model response containing the assistant's response.
 
-        # Call GPT model to generate follow-up questions
-        model_response_followup = self.gpt_model.call_gpt_model(self.messages.get_prompts())
+        Returns:
+            tuple: The follow-up questions and whether they are still being generated in the background.
+        """
+        if not request.include_followups or environment.FOLLOWUP_MODE == 'disabled':
+            return {}, False
+
+        if environment.FOLLOWUP_MODE == 'background' and self.followup_store:
+            return {}, True
+
+        followup_questions, model_response_followup = await self.generate_followup_questions(model_response['content'])
         self.total_tokens += model_response_followup['total_tokens']
+        self.cached_tokens += model_response_followup['cached_tokens']
+
+        return followup_questions, False
+
+
+    async def generate_background_followup_questions(self, request: ChatRequest, model_response: GptModelResponse) -> dict:
+        """
+        Generate the follow-up questions after the response is returned, and add their tokens to the chat history item.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+            model_response (GptModelResponse): The model response containing the assistant's response.
+
+        Returns:
+            dict: The follow-up questions, or an empty dictionary if none could be parsed.
+        """
+        followup_questions, model_response_followup = await self.generate_followup_questions(model_response['content'])
+        await self.update_chat_history_tokens(request, model_response, self.total_tokens + model_response_followup['total_tokens'])
+
+        return followup_questions
+
+
+    async def generate_followup_questions(self, assistant_response: str) -> tuple:
+        """
+        Generate follow-up questions based on the conversation and the assistant's response.
+
+        The messages and token counters of the chat turn are not modified, since the follow-up questions may
+        be generated in the background after the response is returned.
+
+        Args:
+            assistant_response (str): The assistant's response to the current user prompt.
+
+        Returns:
+            tuple: The follow-up questions (an empty dictionary if none could be parsed), and the GPT model response.
+        """
+        # Set assistant response, then the instruction for follow-up questions after the conversation, keeping the prompt prefix of the previous calls
+        followup_prompts = self.get_prompts() + [
+            {'role': 'assistant', 'content': assistant_response},
+            {'role': 'system', 'content': prompts.get_system_prompt_text_followup()}
+        ]
+
+        # Call GPT model to generate follow-up questions (with the tools functions, which are part of the prefix, when the deployment is the same)
+        model_response_followup = await self.gpt_model.call_gpt_model(
+            followup_prompts,
+            self.gpt_model.model_followup,
+            Priority.FOLLOWUP,
+            tools = self.gpt_model.model_followup == self.gpt_model.model_chat
+        )
 
         try:
             # Parse the follow-up questions into a JSON object
@@ -88,8 +504,28 @@ class ChatApi():
         except json.JSONDecodeError:
             followup_questions = {}
 
-        # Write user prompt and assistant response to the chat history database
-        self.chat_history_db.write_chat_history(
+        return followup_questions, model_response_followup
+
+
+    async def write_chat_history(self, request: ChatRequest, model_response: GptModelResponse) -> None:
+        """
+        Write the user prompt and the assistant response to the in-memory chat history, if any, and to the chat
+        history database (unless history persistence is disabled, for evaluation runs).
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+            model_response (GptModelResponse): The model response containing the assistant's response.
+
+        Returns:
+            None
+        """
+        if self.chat_history is not None:
+            self.chat_history.append({'id': model_response['id'], 'user_prompt': request.user_prompt, 'assistant_response': model_response['content']})
+
+        if not self.persist_history:
+            return
+
+        await self.chat_history_db.write_chat_history(
             id = model_response['id'],
             session_id = request.session_id,
             user_prompt = request.user_prompt,
@@ -97,19 +533,30 @@ class ChatApi():
             total_tokens = self.total_tokens
         )
 
-        # Set the response object
-        response = ChatResponse(
-            assistant_response = model_response['content'],
-            response_id = model_response['id'],
-            followup_questions = followup_questions,
-            total_tokens=self.total_tokens,
-            model=model_response['model']
-        )
 
-        return response
+    async def update_chat_history_tokens(self, request: ChatRequest, model_response: GptModelResponse, total_tokens: int = None) -> None:
+        """
+        Update the total number of tokens of the chat history item, with the tokens used after it was written (follow-up questions).
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+            model_response (GptModelResponse): The model response containing the assistant's response.
+            total_tokens (int, optional): The total number of tokens of the chat turn. Defaults to the tokens counted so far.
+
+        Returns:
+            None
+        """
+        if not self.persist_history:
+            return
+
+        await self.chat_history_db.update_total_tokens(
+            session_id = request.session_id,
+            id = model_response['id'],
+            total_tokens = self.total_tokens if total_tokens is None else total_tokens
+        )
 
 
-    def load_chat_history(self, session_id: str, max_results: int) -> None:
+    async def load_chat_history(self, session_id: str, max_results: int) -> None:
         """
         Load chat history for a given session ID.
 
@@ -120,23 +567,98 @@ class ChatApi():
         Returns:
             None
         """
-        # Load chat history
-        chat_history_records = self.chat_history_db.load_chat_history(session_id, max_results)
+        # Load chat history (from memory, without conversation summary, when it is kept by the caller)
+        if self.chat_history is not None:
+            chat_history_records = self.chat_history[-max_results:]
+        else:
+            chat_history_records = await self.chat_history_db.load_chat_history(session_id, max_results)
+
+        self.chat_history_length = len(chat_history_records)
+
+        # Replace the turns folded into the conversation summary with the summary
+        if self.summary_scheduler and chat_history_records and self.chat_history is None:
+            chat_history_records = await self.load_chat_summary(session_id, chat_history_records)
 
         # Set chat history prompts
         if chat_history_records:
             for record in chat_history_records:
-                self.messages.add_prompt('user', record['user_prompt'])
-                self.messages.add_prompt('assistant', record['assistant_response'])
+                self.messages.add_prompt('user', record['user_prompt'], 'history')
+                self.messages.add_prompt('assistant', record['assistant_response'], 'history')
+
+
+    async def load_chat_summary(self, session_id: str, chat_history_records: list) -> list:
+        """
+        Add the conversation summary of a session to the messages, and schedule the update of the
+        summary in the background when more than SUMMARY_RAW_TURNS turns are not yet summarized.
+
+        The turns not yet summarized are all sent until the summary is updated, so that no turn
+        is missing from the prompts while the update is running.
+
+        Args:
+            session_id (str): The ID of the session.
+            chat_history_records (list): The most recent chat history records, oldest first.
+
+        Returns:
+            list: The chat history records not yet folded into the summary.
+        """
+        chat_summary = await self.chat_history_db.load_chat_summary(session_id)
+
+        if chat_summary:
+            self.messages.add_prompt('system', prompts.get_summary_prompt_text(chat_summary['summary']), 'summary')
+
+            turn_ids = [record['id'] for record in chat_history_records]
+            if chat_summary['last_turn_id'] in turn_ids:
+                chat_history_records = chat_history_records[turn_ids.index(chat_summary['last_turn_id']) + 1:]
+
+        if len(chat_history_records) > environment.SUMMARY_RAW_TURNS:
+            records = chat_history_records[:len(chat_history_records) - environment.SUMMARY_RAW_TURNS]
+            self.summary_scheduler.schedule(
+                session_id,
+                lambda: self.update_chat_summary(session_id, chat_summary, records)
+            )
+
+        return chat_history_records
+
+
+    async def update_chat_summary(self, session_id: str, chat_summary: dict, chat_history_records: list) -> None:
+        """
+        Fold chat history records into the conversation summary of a session.
 
+        Args:
+            session_id (str): The ID of the session.
+            chat_summary (dict): The current chat summary item, or None if the session has no summary.
+            chat_history_records (list): The chat history records to fold into the summary, oldest first.
+
+        Returns:
+            None
+        """
+        turns = '\n'.join(
+            f"User: {record['user_prompt']}\nAssistant: {record['assistant_response']}"
+            for record in chat_history_records
+        )
+
+        messages = MessageBuilder()
+        messages.add_system_prompt(prompts.get_system_prompt_text_summary())
+        messages.add_prompt('user', f"Current summary: {chat_summary['summary'] if chat_summary else '(none)'}\n\nConversation turns:\n{turns}")
+
+        model_response = await self.gpt_model.call_gpt_model(messages.get_prompts(), self.gpt_model.model_summary, Priority.SUMMARY)
 
-    def process_tool_calls(self, session_id: str, tool_calls: list) -> None:
+        await self.chat_history_db.write_chat_summary(
+            session_id = session_id,
+            summary = model_response['content'],
+            last_turn_id = chat_history_records[-1]['id'],
+            total_tokens = (chat_summary['total_tokens'] if chat_summary else 0) + model_response['total_tokens']
+        )
+
+
+    async def process_tool_calls(self, session_id: str, tool_calls: list, speculative_search: asyncio.Task = None) -> None:
         """
         Process the tool calls and add the results to the messages.
 
         Args:
             session_id (str): The session ID.
             tool_calls (list): A list of tool calls.
+            speculative_search (asyncio.Task, optional): The search started on the user prompt, answering the search tool call with the same query.
 
         Returns:
             None
@@ -144,22 +666,212 @@ class ChatApi():
         # Add tool calls to the messages
         self.messages.add_tool_calls(tool_calls)
 
-        for tool in tool_calls:
+        search_tools = [tool for tool in tool_calls if tool.function.name == 'sample_search']
+
+        if not search_tools:
+            if speculative_search:
+                speculative_search.cancel()
+            return
+
+        results = await self.search_tool_calls(session_id, search_tools, speculative_search)
+        self.add_tool_results(search_tools, results)
+
+
+    async def search_tool_calls(self, session_id: str, search_tools: list, speculative_search: asyncio.Task = None) -> list:
+        """
+        Run the searches of the search tool calls.
+
+        The embeddings of all search queries without cached results are generated in a single batch
+        request, and the searches run concurrently (bounded by TOOL_CALLS_MAX_CONCURRENCY).
 
-            if tool.function.name == 'sample_search':
+        Args:
+            session_id (str): The session ID.
+            search_tools (list): The search tool calls.
+            speculative_search (asyncio.Task, optional): The search started on the user prompt, answering the search tool call with the same query.
+
+        Returns:
+            list: The records found for each tool call, in the same order as the tool calls.
+        """
+        # Load function arguments
+        search_requests = []
+        for tool in search_tools:
+            arguments_json = json.loads(tool.function.arguments)
+            search_requests.append(SearchRequest(
+                search_query = arguments_json['search_query'] if 'search_query' in arguments_json else "",
+                session_id = session_id,
+                max_results = 5
+            ))
+
+        # Use the speculative search for the first tool call with the same search query, discarding it if there is none
+        speculative_index = None
+        if speculative_search:
+            speculative_index = next((
+                index for index, search_request in enumerate(search_requests)
+                if self.tool_router.matches_search_query(self.speculative_query, search_request.search_query)
+            ), None)
+            if speculative_index is None:
+                speculative_search.cancel()
+                self.tool_router.record_speculation_miss()
+
+        # Generate the embeddings of all search queries without cached results at once
+        search_queries = list(dict.fromkeys(
+            search_request.search_query for index, search_request in enumerate(search_requests)
+            if not self.cognitive_search.is_cached(search_request) and index != speculative_index
+        ))
+        embeddings = dict(zip(search_queries, await self.gpt_model.generate_embeddings_batch(search_queries)))
+
+        # Fetch records from index database
+        semaphore = asyncio.Semaphore(environment.TOOL_CALLS_MAX_CONCURRENCY)
+        return await asyncio.gather(*[
+            self.get_speculative_search_results(speculative_search, semaphore, search_request)
+            if index == speculative_index else
+            self.search_index(semaphore, search_request, embeddings.get(search_request.search_query))
+            for index, search_request in enumerate(search_requests)
+        ])
+
+
+    def add_tool_results(self, search_tools: list, results: list) -> None:
+        """
+        Add the search results to the messages, keeping only the fields needed by the model, and to the citations.
+
+        Args:
+            search_tools (list): The search tool calls.
+            results (list): The records found for each tool call.
+
+        Returns:
+            None
+        """
+        for tool, records in zip(search_tools, results):
+            payload = self.tool_payload_compactor.compact(records) if self.tool_payload_compactor else records
+            self.messages.add_tool_response(tool.id, tool.function.name, json.dumps(payload), payload)
+            for record in records:
+                if record.get('id') not in [citation['id'] for citation in self.citations]:
+                    self.citations.append({'id': record.get('id'), 'title': record.get('title'), 'url': record.get('url')})
+
+
+    async def route_tools(self, request: ChatRequest) -> None:
+        """
+        Search the index on the user prompt when the tool router decides that retrieval is needed, and add
+        the results to the messages as a search tool call, without calling the GPT model to select tools.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Returns:
+            None
+        """
+        if self.tool_router.needs_retrieval(request.user_prompt):
+            tool_calls = [self.tool_router.get_tool_call(self.get_search_query(request))]
+
+            with telemetry.span('tools', tool_calls=1):
+                results = await self.search_tool_calls(request.session_id, tool_calls)
+
+            if self.tool_router.is_relevant(results[0]):
+                self.messages.add_tool_calls(tool_calls)
+                self.add_tool_results(tool_calls, results)
+
+        # The latency saved is the (estimated) latency of the skipped tool-selection call
+        self.tool_router.record_saving('router')
+
+
+    def start_speculative_search(self, request: ChatRequest) -> asyncio.Task:
+        """
+        Start the search on the user prompt, in parallel with the tool-selection call, when the speculative mode is enabled.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Returns:
+            asyncio.Task: The search task, returning the records and the duration of the search, or None.
+        """
+        if not self.tool_router or not self.tool_router.should_speculate():
+            return None
+
+        self.speculative_query = self.get_search_query(request)
+
+        async def search():
+            start_time = time.perf_counter()
+            records = await self.cognitive_search.search_index(SearchRequest(
+                search_query = self.speculative_query,
+                session_id = request.session_id,
+                max_results = 5
+            ))
+            return records, time.perf_counter() - start_time
 
-                # Load function arguments
-                arguments_json = json.loads(tool.function.arguments)
+        task = asyncio.create_task(search())
+        # The results are discarded when the model answers without tools, errors included
+        task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        return task
 
-                # Fetch records from index database
-                records = list(
-                    self.cognitive_search.search_index(SearchRequest(
-                        search_query = arguments_json['search_query'] if 'search_query' in arguments_json else "",
-                        session_id = session_id,
-                        max_results = 5
-                    ))
-                )
 
-                # Add tool results to the messages
-                self.messages.add_tool_response(tool.id, tool.function.name, json.dumps(records))     
-    
\ No newline at end of file
+    async def get_speculative_search_results(self, speculative_search: asyncio.Task, semaphore: asyncio.Semaphore, search_request: SearchRequest) -> list:
+        """
+        Get the results of the speculative search, and record the latency saved (the part of the search
+        that ran during the tool-selection call). The search is run again if the speculative search failed.
+
+        Args:
+            speculative_search (asyncio.Task): The speculative search task.
+            semaphore (asyncio.Semaphore): The semaphore bounding the number of concurrent searches.
+            search_request (SearchRequest): The search request of the tool call, run if the speculative search failed.
+
+        Returns:
+            list: The records found in the index.
+        """
+        start_time = time.perf_counter()
+
+        try:
+            records, duration = await speculative_search
+        except Exception as e:
+            logging.warning(f"Speculative search failed, searching again: {e}")
+            return await self.search_index(semaphore, search_request)
+
+        self.tool_router.record_saving('speculative', max(0, duration - (time.perf_counter() - start_time)))
+
+        return records
+
+
+    def get_search_query(self, request: ChatRequest) -> str:
+        """
+        Get the search query of a routed or speculative search, from the user prompt and the previous user prompt of the session.
+
+        Args:
+            request (ChatRequest): The request object containing user input an related metadata.
+
+        Returns:
+            str: The search query.
+        """
+        history_prompts = [
+            prompt['content'] for prompt, section in zip(self.messages.prompts, self.messages.sections)
+            if section == 'history' and prompt['role'] == 'user'
+        ]
+        return self.tool_router.get_search_query(request.user_prompt, history_prompts[-1] if history_prompts else None)
+
+
+    def record_tool_call_latency(self, start_time: float) -> None:
+        """
+        Record the latency of a tool-selection call, used to estimate the latency saved by the routed turns.
+
+        Args:
+            start_time (float): The start time of the call (performance counter).
+
+        Returns:
+            None
+        """
+        if self.tool_router:
+            self.tool_router.record_tool_call_latency(time.perf_counter() - start_time)
+
+
+    async def search_index(self, semaphore: asyncio.Semaphore, search_request: SearchRequest, embedding: list = None) -> list:
+        """
+        Search the index for a tool call, limiting the number of concurrent searches.
+
+        Args:
+            semaphore (asyncio.Semaphore): The semaphore bounding the number of concurrent searches.
+            search_request (SearchRequest): The search request.
+            embedding (list, optional): The embeddings of the search query.
+
+        Returns:
+            list: The records found in the index.
+        """
+        async with semaphore:
+            return await self.cognitive_search.search_index(search_request, embedding)
@@ -1,21 +1,37 @@
+import asyncio
+
 from azure.cosmos import exceptions
-from backend.config.models import FeedbackRequest, FeedbackResponse
-from backend.services.database import ChatHistoryDatabase
+from backend.config import environment
+from backend.config.models import FeedbackRequest, FeedbackResponse, FeedbackBulkRequest, FeedbackBulkResponse
+from backend.services.database import AsyncChatHistoryDatabase
+from backend.services.clients import ClientRegistry
 
 
-def run(request: FeedbackRequest) -> FeedbackResponse:
+async def run(request: FeedbackRequest, clients: ClientRegistry = None) -> FeedbackResponse:
     """
     Executes the main logic of the 'feedback' API endpoint.
     """
     try:
-        feedback_api = FeedbackApi()
-        return feedback_api.main(request)
+        feedback_api = FeedbackApi(clients)
+        return await feedback_api.main(request)
 
     except exceptions.CosmosHttpResponseError as e:
         raise Exception(f"Database error in feedback.run: {e.reason} ({e.status_code})")
 
     except Exception as e:
         raise Exception(f"Error in feedback.run: {e}")
+
+
+async def run_bulk(request: FeedbackBulkRequest, clients: ClientRegistry = None) -> FeedbackBulkResponse:
+    """
+    Executes the main logic of the 'feedback/bulk' API endpoint.
+    """
+    try:
+        feedback_api = FeedbackApi(clients)
+        return await feedback_api.bulk(request)
+
+    except Exception as e:
+        raise Exception(f"Error in feedback.run_bulk: {e}")
     
 
 class FeedbackApi():
@@ -23,11 +39,11 @@ class FeedbackApi():
     A class that provides the main logic for the 'feedback' API endpoint.
     """
 
-    def __init__(self):
-        self.chat_history_db = ChatHistoryDatabase()
+    def __init__(self, clients: ClientRegistry = None):
+        self.chat_history_db = AsyncChatHistoryDatabase(clients)
 
 
-    def main(self, request: FeedbackRequest) -> FeedbackResponse:
+    async def main(self, request: FeedbackRequest) -> FeedbackResponse:
         """
         Runs the feedback processing logic.
 
@@ -37,5 +53,56 @@ class FeedbackApi():
         Returns:
             FeedbackResponse: The response object containing the result of the feedback processing.
         """
-        response = self.chat_history_db.update_feedback(request)
+        response = await self.chat_history_db.update_feedback(request)
         return response
+
+
+    async def bulk(self, request: FeedbackBulkRequest) -> FeedbackBulkResponse:
+        """
+        Runs the feedback processing logic for several feedback requests, concurrently (bounded by
+        FEEDBACK_BULK_MAX_CONCURRENCY). A failed request does not prevent the others from being processed.
+
+        Args:
+            request (FeedbackBulkRequest): The bulk feedback request object.
+
+        Returns:
+            FeedbackBulkResponse: The response object containing the number of updated items and the failed requests.
+        """
+        semaphore = asyncio.Semaphore(environment.FEEDBACK_BULK_MAX_CONCURRENCY)
+        errors = await asyncio.gather(*[self.update_feedback(semaphore, item) for item in request.items])
+
+        failed = [
+            {'id': item.id, 'session_id': item.session_id, 'reason': error}
+            for item, error in zip(request.items, errors) if error
+        ]
+
+        response = FeedbackBulkResponse(
+            status = "Feedback updated successfully" if not failed else "Feedback partially updated",
+            updated = len(request.items) - len(failed),
+            failed = failed
+        )
+
+        return response
+
+
+    async def update_feedback(self, semaphore: asyncio.Semaphore, request: FeedbackRequest) -> str:
+        """
+        Update the feedback rating of a chat history item, limiting the number of concurrent updates.
+
+        Args:
+            semaphore (asyncio.Semaphore): The semaphore bounding the number of concurrent updates.
+            request (FeedbackRequest): The feedback request object.
+
+        Returns:
+            str: The reason of the failure, or None if the item was updated.
+        """
+        async with semaphore:
+            try:
+                await self.chat_history_db.update_feedback(request)
+                return None
+
+            except exceptions.CosmosHttpResponseError as e:
+                return f"Database error: {e.reason} ({e.status_code})"
+
+            except Exception as e:
+                return f"{e}"
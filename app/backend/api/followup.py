@@ -0,0 +1,55 @@
+from backend.config import environment
+from backend.config.models import FollowupResponse
+from backend.services.clients import ClientRegistry
+
+
+async def run(response_id: str, clients: ClientRegistry, wait: bool = False) -> FollowupResponse:
+    """
+    Executes the main logic of the 'followups' API endpoint.
+
+    Returns:
+        FollowupResponse: The follow-up questions, or None if the response ID is unknown or expired.
+    """
+    try:
+        followup_api = FollowupApi(clients)
+        return await followup_api.main(response_id, wait)
+
+    except Exception as e:
+        raise Exception(f"Error in followup.run: {e}")
+
+
+class FollowupApi():
+    """
+    A class that provides the main logic for the 'followups' API endpoint.
+    """
+
+    def __init__(self, clients: ClientRegistry):
+        self.followup_store = clients.followup_store
+
+
+    async def main(self, response_id: str, wait: bool = False) -> FollowupResponse:
+        """
+        Gets the follow-up questions generated in the background for a response.
+
+        Args:
+            response_id (str): The ID of the response.
+            wait (bool, optional): Whether to wait for pending follow-up questions. Defaults to False.
+
+        Returns:
+            FollowupResponse: The follow-up questions, or None if the response ID is unknown or expired.
+        """
+        found, pending, followup_questions = await self.followup_store.get(
+            response_id,
+            environment.FOLLOWUP_WAIT_TIMEOUT if wait else 0
+        )
+
+        if not found:
+            return None
+
+        response = FollowupResponse(
+            response_id = response_id,
+            followup_questions = followup_questions,
+            pending = pending
+        )
+
+        return response
@@ -1,4 +1,5 @@
 import os
+import json
 from dotenv import load_dotenv
 
 try:
@@ -11,6 +12,28 @@ try:
     AZURE_OPENAI_API_KEY = os.environ.get('AZURE_OPENAI_API_KEY')
     AZURE_OPENAI_API_MODEL_CHAT = os.environ.get('AZURE_OPENAI_API_MODEL_CHAT')
     AZURE_OPENAI_API_MODEL_EMBEDDING = os.environ.get('AZURE_OPENAI_API_MODEL_EMBEDDING')
+    AZURE_OPENAI_API_MODEL_FOLLOWUP = os.environ.get('AZURE_OPENAI_API_MODEL_FOLLOWUP', AZURE_OPENAI_API_MODEL_CHAT)
+    AZURE_OPENAI_API_MODEL_SUMMARY = os.environ.get('AZURE_OPENAI_API_MODEL_SUMMARY', AZURE_OPENAI_API_MODEL_CHAT)
+
+    # Azure OpenAI backend pool settings (JSON list of {"name", "endpoint", "api_key", "api_version", "weight", "deployments",
+    # "tokens_per_minute", "requests_per_minute"}, "deployments" mapping the deployment names above to the names on the endpoint,
+    # the quotas defaulting to OPENAI_RATE_LIMIT_TPM and OPENAI_RATE_LIMIT_RPM for each deployment; empty to only use the endpoint above)
+    AZURE_OPENAI_BACKENDS = json.loads(os.environ.get('AZURE_OPENAI_BACKENDS') or '[]')
+    OPENAI_BACKEND_ROUTING = os.environ.get('OPENAI_BACKEND_ROUTING', 'least_tokens')
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('OPENAI_CIRCUIT_FAILURE_THRESHOLD', 5))
+    OPENAI_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('OPENAI_CIRCUIT_RESET_TIMEOUT', 30))
+
+    # Azure OpenAI rate limit scheduler settings (quota of each model deployment, 0 for no limit; retries of a request, by the scheduler or the backend pool)
+    OPENAI_SCHEDULER_ENABLED = os.environ.get('OPENAI_SCHEDULER_ENABLED', 'true').lower() == 'true'
+    OPENAI_RATE_LIMIT_TPM = int(os.environ.get('OPENAI_RATE_LIMIT_TPM', 0))
+    OPENAI_RATE_LIMIT_RPM = int(os.environ.get('OPENAI_RATE_LIMIT_RPM', 0))
+    OPENAI_RATE_LIMIT_MAX_RETRIES = int(os.environ.get('OPENAI_RATE_LIMIT_MAX_RETRIES', 3))
+
+    # Follow-up questions settings (mode: 'sync', 'background' or 'disabled')
+    FOLLOWUP_MODE = os.environ.get('FOLLOWUP_MODE', 'sync')
+    FOLLOWUP_MAX_ENTRIES = int(os.environ.get('FOLLOWUP_MAX_ENTRIES', 1000))
+    FOLLOWUP_TTL = float(os.environ.get('FOLLOWUP_TTL', 300))
+    FOLLOWUP_WAIT_TIMEOUT = float(os.environ.get('FOLLOWUP_WAIT_TIMEOUT', 10))
 
     # Azure Search settings
     AZURE_SEARCH_ENDPOINT = os.environ.get('AZURE_SEARCH_ENDPOINT')
@@ -18,15 +41,119 @@ try:
     AZURE_SEARCH_API_KEY = os.environ.get('AZURE_SEARCH_API_KEY')
     AZURE_SEARCH_INDEX_NAME = os.environ.get('AZURE_SEARCH_INDEX_NAME')
     AZURE_SEARCH_ADMIN_KEY = os.environ.get('AZURE_SEARCH_ADMIN_KEY')
+    # Search backend settings ('azure', or 'local' for an in-process index saved to LOCAL_SEARCH_INDEX_PATH;
+    # hybrid queries fuse the LOCAL_SEARCH_TEXT_RESULTS best text results with the vector results by reciprocal rank)
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'azure')
+    LOCAL_SEARCH_INDEX_PATH = os.environ.get('LOCAL_SEARCH_INDEX_PATH')
+    LOCAL_SEARCH_TEXT_RESULTS = int(os.environ.get('LOCAL_SEARCH_TEXT_RESULTS', 50))
+    LOCAL_SEARCH_RRF_K = int(os.environ.get('LOCAL_SEARCH_RRF_K', 60))
+    AZURE_SEARCH_INDEX_VERSION = os.environ.get('AZURE_SEARCH_INDEX_VERSION', '1')
+    INDEX_VERSION_REFRESH_INTERVAL = float(os.environ.get('INDEX_VERSION_REFRESH_INTERVAL', 30))
+    TOOL_CALLS_MAX_CONCURRENCY = int(os.environ.get('TOOL_CALLS_MAX_CONCURRENCY', 4))
+
+    # Tool routing settings (mode: 'model' for the tool-selection call, 'router' to decide on retrieval up front,
+    # or 'speculative' to search in parallel with the tool-selection call; router strategy: 'heuristic' or 'relevance')
+    TOOL_ROUTING_MODE = os.environ.get('TOOL_ROUTING_MODE', 'model')
+    TOOL_ROUTER_STRATEGY = os.environ.get('TOOL_ROUTER_STRATEGY', 'heuristic')
+    TOOL_ROUTER_MIN_RERANKER_SCORE = float(os.environ.get('TOOL_ROUTER_MIN_RERANKER_SCORE', 1.5))
+    TOOL_ROUTER_SAMPLE_RATE = float(os.environ.get('TOOL_ROUTER_SAMPLE_RATE', 0.05))
     
     # Azure Storage settings
     AZURE_STORAGE_CONNECTION_STRING = os.environ.get('AZURE_STORAGE_CONNECTION_STRING')  
 
+    # Document ingestion settings (chunk size in tokens, upload batches bounded in documents and bytes, state saved at most every INGESTION_CHECKPOINT_INTERVAL seconds)
+    INGESTION_FILE_EXTENSIONS = [extension.strip() for extension in os.environ.get('INGESTION_FILE_EXTENSIONS', '.txt,.md,.html,.htm').split(',') if extension.strip()]
+    INGESTION_CHUNK_TOKENS = int(os.environ.get('INGESTION_CHUNK_TOKENS', 500))
+    INGESTION_EMBEDDING_BATCH_SIZE = int(os.environ.get('INGESTION_EMBEDDING_BATCH_SIZE', 16))
+    INGESTION_UPLOAD_BATCH_SIZE = int(os.environ.get('INGESTION_UPLOAD_BATCH_SIZE', 100))
+    INGESTION_UPLOAD_MAX_BYTES = int(os.environ.get('INGESTION_UPLOAD_MAX_BYTES', 8000000))
+    INGESTION_MAX_CONCURRENCY = int(os.environ.get('INGESTION_MAX_CONCURRENCY', 4))
+    INGESTION_CHECKPOINT_INTERVAL = float(os.environ.get('INGESTION_CHECKPOINT_INTERVAL', 30))
+
     # Azure Cosmos DB settings
     AZURE_COSMOS_ENDPOINT = os.environ.get('AZURE_COSMOS_ENDPOINT')
     AZURE_COSMOS_KEY = os.environ.get('AZURE_COSMOS_KEY')
     AZURE_COSMOS_DATABASE = os.environ.get('AZURE_COSMOS_DATABASE')
     AZURE_COSMOS_CONTAINER = os.environ.get('AZURE_COSMOS_CONTAINER')
 
+    # Chat history persistence settings (store: 'cosmos', or 'local' for an in-memory stand-in container)
+    CHAT_HISTORY_STORE = os.environ.get('CHAT_HISTORY_STORE', 'cosmos')
+    HISTORY_WRITE_BEHIND_ENABLED = os.environ.get('HISTORY_WRITE_BEHIND_ENABLED', 'false').lower() == 'true'
+    HISTORY_WRITE_QUEUE_MAX_ITEMS = int(os.environ.get('HISTORY_WRITE_QUEUE_MAX_ITEMS', 10000))
+    HISTORY_WRITE_BATCH_SIZE = int(os.environ.get('HISTORY_WRITE_BATCH_SIZE', 100))
+    HISTORY_WRITE_FLUSH_INTERVAL = float(os.environ.get('HISTORY_WRITE_FLUSH_INTERVAL', 0.05))
+    HISTORY_WRITE_MAX_RETRIES = int(os.environ.get('HISTORY_WRITE_MAX_RETRIES', 5))
+    HISTORY_WRITE_DRAIN_TIMEOUT = float(os.environ.get('HISTORY_WRITE_DRAIN_TIMEOUT', 10))
+    HISTORY_WRITE_DEAD_LETTER_PATH = os.environ.get('HISTORY_WRITE_DEAD_LETTER_PATH')
+
+    # Batch chat settings (maximum number of requests of a batch answered at a time, maximum size of a batch in bytes)
+    CHAT_BATCH_MAX_CONCURRENCY = int(os.environ.get('CHAT_BATCH_MAX_CONCURRENCY', 8))
+    CHAT_BATCH_MAX_BYTES = int(os.environ.get('CHAT_BATCH_MAX_BYTES', 50 * 1024 * 1024))
+
+    # Feedback settings (bulk feedback requests)
+    FEEDBACK_BULK_MAX_ITEMS = int(os.environ.get('FEEDBACK_BULK_MAX_ITEMS', 1000))
+    FEEDBACK_BULK_MAX_CONCURRENCY = int(os.environ.get('FEEDBACK_BULK_MAX_CONCURRENCY', 10))
+
+    # Cache settings (shared tier: 'none', 'local' or 'redis')
+    CACHE_SHARED_TIER = os.environ.get('CACHE_SHARED_TIER', 'none')
+    CACHE_SHARED_MAX_ENTRIES = int(os.environ.get('CACHE_SHARED_MAX_ENTRIES', 10000))
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 5000))
+    EMBEDDING_CACHE_TTL = float(os.environ.get('EMBEDDING_CACHE_TTL', 86400))
+
+    # Admin endpoint settings (key expected in the X-Admin-Key header; the admin endpoints are disabled when it is not set)
+    ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY')
+
+    # Session history cache settings (idle sessions are evicted after HISTORY_CACHE_IDLE_TTL seconds)
+    # Enabled by default with the redis shared tier only: an in-process cache serves stale history when the turns of a session land on several instances
+    HISTORY_CACHE_ENABLED = os.environ.get('HISTORY_CACHE_ENABLED', 'true' if CACHE_SHARED_TIER == 'redis' else 'false').lower() == 'true'
+    HISTORY_CACHE_MAX_SESSIONS = int(os.environ.get('HISTORY_CACHE_MAX_SESSIONS', 10000))
+    HISTORY_CACHE_MAX_TURNS = int(os.environ.get('HISTORY_CACHE_MAX_TURNS', 10))
+    HISTORY_CACHE_IDLE_TTL = float(os.environ.get('HISTORY_CACHE_IDLE_TTL', 1800))
+
+    # Chat request coalescing settings (concurrent identical turns run once, responses are stored by idempotency key for CHAT_IDEMPOTENCY_TTL seconds)
+    CHAT_COALESCING_ENABLED = os.environ.get('CHAT_COALESCING_ENABLED', 'true').lower() == 'true'
+    CHAT_IDEMPOTENCY_MAX_ENTRIES = int(os.environ.get('CHAT_IDEMPOTENCY_MAX_ENTRIES', 10000))
+    CHAT_IDEMPOTENCY_TTL = float(os.environ.get('CHAT_IDEMPOTENCY_TTL', 3600))
+
+    # Conversation summary settings (older turns are folded into a rolling summary, the last SUMMARY_RAW_TURNS turns are sent as they are)
+    SUMMARY_ENABLED = os.environ.get('SUMMARY_ENABLED', 'false').lower() == 'true'
+    SUMMARY_RAW_TURNS = int(os.environ.get('SUMMARY_RAW_TURNS', 3))
+
+    # Semantic response cache settings (only first turns of a session are cached)
+    SEMANTIC_CACHE_ENABLED = os.environ.get('SEMANTIC_CACHE_ENABLED', 'false').lower() == 'true'
+    SEMANTIC_CACHE_THRESHOLD = float(os.environ.get('SEMANTIC_CACHE_THRESHOLD', 0.95))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get('SEMANTIC_CACHE_MAX_ENTRIES', 1000))
+    SEMANTIC_CACHE_TTL = float(os.environ.get('SEMANTIC_CACHE_TTL', 3600))
+
+    # Search result cache settings
+    SEARCH_CACHE_ENABLED = os.environ.get('SEARCH_CACHE_ENABLED', 'true').lower() == 'true'
+    SEARCH_CACHE_MAX_ENTRIES = int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 1000))
+    SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', 300))
+
+    # Tool payload compaction settings (fields sent to the model, maximum size of the content of each result)
+    TOOL_PAYLOAD_COMPACTION_ENABLED = os.environ.get('TOOL_PAYLOAD_COMPACTION_ENABLED', 'true').lower() == 'true'
+    TOOL_PAYLOAD_FIELDS = [field.strip() for field in os.environ.get('TOOL_PAYLOAD_FIELDS', 'title,content,url').split(',') if field.strip()]
+    TOOL_PAYLOAD_USE_CAPTIONS = os.environ.get('TOOL_PAYLOAD_USE_CAPTIONS', 'true').lower() == 'true'
+    TOOL_PAYLOAD_MAX_BYTES = int(os.environ.get('TOOL_PAYLOAD_MAX_BYTES', 2000))
+    TOOL_PAYLOAD_DEDUPE_THRESHOLD = float(os.environ.get('TOOL_PAYLOAD_DEDUPE_THRESHOLD', 0.9))
+
+    # Prompt token budget settings (0 for no limit)
+    PROMPT_TOKEN_BUDGET = int(os.environ.get('PROMPT_TOKEN_BUDGET', 0))
+    PROMPT_DOCUMENT_MAX_TOKENS = int(os.environ.get('PROMPT_DOCUMENT_MAX_TOKENS', 0))
+    TOKENIZER_ENCODING = os.environ.get('TOKENIZER_ENCODING', 'o200k_base')
+
+    # Telemetry settings (spans are exported through the OpenTelemetry API, if installed and configured)
+    TELEMETRY_TRACING_ENABLED = os.environ.get('TELEMETRY_TRACING_ENABLED', 'true').lower() == 'true'
+
+    # Startup settings (timeout of each warm-up check, in seconds)
+    STARTUP_CHECK_TIMEOUT = float(os.environ.get('STARTUP_CHECK_TIMEOUT', 20))
+
+    # Shared HTTP connection pool settings
+    HTTP_POOL_MAX_CONNECTIONS = int(os.environ.get('HTTP_POOL_MAX_CONNECTIONS', 100))
+    HTTP_POOL_MAX_KEEPALIVE = int(os.environ.get('HTTP_POOL_MAX_KEEPALIVE', 20))
+    HTTP_POOL_KEEPALIVE_EXPIRY = float(os.environ.get('HTTP_POOL_KEEPALIVE_EXPIRY', 30))
+    HTTP_TIMEOUT = float(os.environ.get('HTTP_TIMEOUT', 60))
+
 except Exception as e:
     raise Exception(f"Error loading environment settings: {e}")
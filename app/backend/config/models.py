@@ -1,5 +1,6 @@
-from pydantic import BaseModel
-from typing import Dict, Optional
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+from backend.config import environment
 
 
 class ChatRequest(BaseModel):
@@ -11,11 +12,13 @@ class ChatRequest(BaseModel):
         user_id (str): The ID of the user.
         user_name (Optional[str]): The name of the user (optional).
         user_prompt (str): The prompt provided by the user.
+        include_followups (Optional[bool]): Whether follow-up questions should be generated (optional).
     """
     session_id: str
     user_id: str
     user_name: Optional[str] = None
     user_prompt: str
+    include_followups: Optional[bool] = True
 
 
 class ChatResponse(BaseModel):
@@ -28,12 +31,34 @@ class ChatResponse(BaseModel):
         followup_questions (Optional[Dict[str, str]]): Any follow-up questions from the assistant (optional).
         total_tokens (int): The total number of tokens used in the response.
         model (str): The model used to generate the response.
+        followup_pending (Optional[bool]): Whether the follow-up questions are being generated in the background (optional).
+        citations (Optional[List[Dict[str, Any]]]): The index documents (id, title and url) used to generate the response (optional).
+        cache_hit (Optional[bool]): Whether the response was served from the semantic response cache (optional).
+        cached_tokens (Optional[int]): The number of prompt tokens served from the prompt cache of the GPT model (optional).
     """
     assistant_response: str
     response_id: str
     followup_questions: Optional[Dict[str, str]] = {}
     total_tokens: int
     model: str
+    followup_pending: Optional[bool] = False
+    citations: Optional[List[Dict[str, Any]]] = []
+    cache_hit: Optional[bool] = False
+    cached_tokens: Optional[int] = 0
+
+
+class FollowupResponse(BaseModel):
+    """
+    Represents the follow-up questions generated in the background for a response.
+
+    Attributes:
+        response_id (str): The ID of the response.
+        followup_questions (Optional[Dict[str, str]]): The follow-up questions (optional).
+        pending (bool): Whether the follow-up questions are still being generated.
+    """
+    response_id: str
+    followup_questions: Optional[Dict[str, str]] = {}
+    pending: bool
 
 
 class FeedbackRequest(BaseModel):
@@ -60,6 +85,30 @@ class FeedbackResponse(BaseModel):
     status: str
 
 
+class FeedbackBulkRequest(BaseModel):
+    """
+    Represents a request to update the feedback rating of several chat history items.
+
+    Attributes:
+        items (List[FeedbackRequest]): The feedback requests (at most FEEDBACK_BULK_MAX_ITEMS).
+    """
+    items: List[FeedbackRequest] = Field(max_length=environment.FEEDBACK_BULK_MAX_ITEMS)
+
+
+class FeedbackBulkResponse(BaseModel):
+    """
+    Represents a response to a bulk feedback request.
+
+    Attributes:
+        status (str): The status of the bulk feedback response.
+        updated (int): The number of chat history items updated.
+        failed (Optional[List[Dict[str, Any]]]): The feedback requests that failed (id, session_id and reason).
+    """
+    status: str
+    updated: int
+    failed: Optional[List[Dict[str, Any]]] = []
+
+
 class SearchRequest(BaseModel):
     """
     Represents a request to search the index.
@@ -74,6 +123,22 @@ class SearchRequest(BaseModel):
     max_results: Optional[int] = 5
 
 
+class SourceDocument(BaseModel):
+    """
+    Represents a document to load into the index.
+
+    Attributes:
+        key (str): The unique key of the document in its source (relative path or blob name).
+        title (str): The title of the document.
+        url (str): The URL of the document.
+        text (str): The text of the document.
+    """
+    key: str
+    title: str
+    url: str
+    text: str
+
+
 class ChatHistoryItem(Dict[str, str]):
     """
     Represents a single chat history item.
@@ -92,6 +157,26 @@ class ChatHistoryItem(Dict[str, str]):
     total_tokens: int
 
 
+class ChatSummaryItem(Dict[str, str]):
+    """
+    Represents the rolling conversation summary of a session.
+
+    Attributes:
+        id (str): The unique identifier for the chat summary item.
+        session_id (str): The session ID associated with the chat summary item.
+        type (str): The type of the item ('summary'), used to exclude it from the chat history.
+        summary (str): The summary of the conversation turns folded so far.
+        last_turn_id (str): The ID of the most recent chat history item folded into the summary.
+        total_tokens (int): The total number of tokens used to generate the summary.
+    """
+    id: str
+    session_id: str
+    type: str
+    summary: str
+    last_turn_id: str
+    total_tokens: int
+
+
 class GptModelResponse(Dict[str, str]):
     """
     Represents a response from the GPT model.
@@ -104,6 +189,7 @@ class GptModelResponse(Dict[str, str]):
         completion_tokens (int): The number of completion tokens used.
         prompt_tokens (int): The number of prompt tokens used.
         total_tokens (int): The total number of tokens used.
+        cached_tokens (int): The number of prompt tokens served from the prompt cache.
     """
     id: str
     model: str
@@ -111,4 +197,5 @@ class GptModelResponse(Dict[str, str]):
     tool_calls: list
     completion_tokens: int
     prompt_tokens: int
-    total_tokens: int
\ No newline at end of file
+    total_tokens: int
+    cached_tokens: int
\ No newline at end of file
@@ -2,40 +2,69 @@
 A collection of methods to generate system prompts for the GPT model.
 """
 
-def get_system_prompt_text(user_name: str):
+def get_system_prompt_text():
     """
-    Returns the system prompt text based on the user's name.
+    Returns the system prompt text, the same for all users and calls so that it can be served from the prompt cache.
+
+    Returns:
+        str: The system prompt text.
+    """
+    return f'You are a helpful assistant. You help users to find information about general topics. ' \
+            'If you are unsure of an answer, ask the user to be more specific. If asking a clarifying question to the user would help, ask the question. ' \
+            'Be concise in your answers. Do not use lists, unless you are asked to do so. '
+
+
+def get_user_prompt_text(user_name: str):
+    """
+    Returns the text of the message with the user's name, sent after the system prompt.
 
     Args:
         user_name (str): The name of the user.
 
     Returns:
-        str: The system prompt text.
+        str: The user message text.
     """
-    if not user_name:
-        return f'You are a helpful assistant. You help users to find information about general topics. ' \
-                'If you are unsure of an answer, ask the user to be more specific. If asking a clarifying question to the user would help, ask the question. ' \
-                'Be concise in your answers. Do not use lists, unless you are asked to do so. '
-    else:
-        return f'You are talking to a person named {user_name}. You are his/her personal assistant and will help him/her to find information about general topics. ' \
-                'If you are unsure of an answer, ask the user to be more specific. If asking a clarifying question to the user would help, ask the question. ' \
-                'Be concise in your answers. Do not use lists, unless you are asked to do so. '
+    return f'You are talking to a person named {user_name}. You are their personal assistant.'
 
 
 def get_system_prompt_text_followup():
     """
-    Returns the system prompt text for generating next user questions.
+    Returns the text of the instruction for generating next user questions, sent after the conversation.
 
     Returns:
-        str: The system prompt text.
+        str: The instruction text.
     """
-    return f'You are a helpful assistant. You help users to find information about general topics. Below is a history of the conversation so far. ' \
-            'Based on the previous line of questioning and the last response from the assistant, you will predict the next questions from the user and generate 3 very brief follow-up questions using the user voice. ' \
+    return f'Now, based on the previous line of questioning and the last response from the assistant, predict the next questions from the user and generate 3 very brief follow-up questions using the user voice. ' \
             'Do no repeat questions that have already been asked. ' \
             'Output the response ONLY as a JSON object, for example: { "q1": "What are the best movies directed by Stanley Kubrick?", "q2": "What is the best place to travel in Australia?", "q3": "Can I use pineapple in my pizza?" }. ' \
             'If you are unsure of an answer, DO NOT ask more questions and respond using only an empty JSON object, for example: { }'
 
 
+def get_system_prompt_text_summary():
+    """
+    Returns the system prompt text for updating the conversation summary.
+
+    Returns:
+        str: The system prompt text.
+    """
+    return f'You summarize conversations between a user and an assistant. You receive the current summary of the conversation, if any, and the conversation turns that followed. ' \
+            'Write an updated summary that includes the information of both, keeping the facts, names, numbers, decisions and user preferences that may be needed to continue the conversation. ' \
+            'Write in the third person, as a single paragraph of at most 200 words. Output ONLY the summary.'
+
+
+def get_summary_prompt_text(summary: str):
+    """
+    Returns the text of the message with the summary of the earlier conversation.
+
+    Args:
+        summary (str): The conversation summary.
+
+    Returns:
+        str: The summary message text.
+    """
+    return f'Summary of the earlier conversation with the user: {summary}'
+
+
 def get_tools_functions():
     """
     Retrieves a list of tools functions.
@@ -1,9 +1,12 @@
 import os
+import asyncio
 import logging
 import requests
 import json
+import time
 
 from backend.config import environment
+from backend.services.message import load_tokenizer
 
 
 def init_search_index() -> None:
@@ -45,7 +48,7 @@ def init_search_index() -> None:
             }
 
             # Call Azure AI Cognitive Search API to create the index
-            response = requests.post(endpoint, headers=headers, json=search_index)
+            response = requests.post(endpoint, headers=headers, json=search_index, timeout=environment.STARTUP_CHECK_TIMEOUT)
 
             if response.status_code == 201:
                 logging.info("Azure AI Cognitive Search index created successfully.")
@@ -73,7 +76,7 @@ def check_search_index(index_name: str) -> bool:
             "api-key": environment.AZURE_SEARCH_ADMIN_KEY
         }
 
-        response = requests.get(url, headers=headers)
+        response = requests.get(url, headers=headers, timeout=environment.STARTUP_CHECK_TIMEOUT)
 
         if response.status_code == 200:
             return True
@@ -84,4 +87,102 @@ def check_search_index(index_name: str) -> bool:
             response.raise_for_status()
 
     except Exception as e:
-        raise Exception(f"Error in CognitiveSearch.check_index_exists: {e}")
\ No newline at end of file
+        raise Exception(f"Error in CognitiveSearch.check_index_exists: {e}")
+
+
+def validate_settings() -> None:
+    """
+    Checks that the required settings are set.
+
+    Raises:
+        Exception: If required settings are missing.
+    """
+    required_settings = [
+        'AZURE_OPENAI_ENDPOINT', 'AZURE_OPENAI_API_VERSION', 'AZURE_OPENAI_API_KEY',
+        'AZURE_OPENAI_API_MODEL_CHAT', 'AZURE_OPENAI_API_MODEL_EMBEDDING'
+    ]
+    if environment.SEARCH_BACKEND == 'azure':
+        required_settings += ['AZURE_SEARCH_ENDPOINT', 'AZURE_SEARCH_API_VERSION', 'AZURE_SEARCH_API_KEY', 'AZURE_SEARCH_INDEX_NAME']
+    if environment.CHAT_HISTORY_STORE == 'cosmos':
+        required_settings += ['AZURE_COSMOS_ENDPOINT', 'AZURE_COSMOS_KEY', 'AZURE_COSMOS_DATABASE', 'AZURE_COSMOS_CONTAINER']
+
+    missing_settings = [name for name in required_settings if not getattr(environment, name)]
+    if missing_settings:
+        raise Exception(f"Missing settings: {', '.join(missing_settings)}")
+
+
+class Readiness():
+    """
+    The readiness of the application, set by the warm-up run in the background at startup.
+
+    The application serves liveness probes (/ping) as soon as it starts, and reports ready (/ready)
+    once the warm-up checks have finished. The checks run concurrently, each with a timeout. A failed
+    or timed out service check is logged and does not block readiness (the services are retried by
+    the requests), but invalid settings do.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.checks = {}
+
+
+    async def warm_up(self, clients) -> None:
+        """
+        Verify the search index, prime the connections to the services, load the tokenizer and validate the settings, concurrently.
+
+        Args:
+            clients (ClientRegistry): The client registry.
+        """
+        checks = {
+            'settings': lambda: asyncio.to_thread(validate_settings),
+            'search': lambda: clients.async_search_client.get_document_count(),
+            'openai': lambda: asyncio.gather(*[client.models.list() for client in clients.get_openai_clients()]),
+            'tokenizer': lambda: asyncio.to_thread(load_tokenizer)
+        }
+        if environment.SEARCH_BACKEND == 'azure':
+            checks['search_index'] = lambda: asyncio.to_thread(init_search_index)
+        if clients.async_cosmos_client:
+            checks['cosmos'] = lambda: clients.async_cosmos_container.read()
+
+        await asyncio.gather(*[self.run_check(name, check) for name, check in checks.items()])
+
+        self.ready = self.checks['settings']['status'] == 'ok'
+        if self.ready:
+            logging.info("Application ready")
+        else:
+            logging.error(f"Application not ready, invalid settings: {self.checks['settings']['error']}")
+
+
+    async def run_check(self, name: str, check, timeout: float = environment.STARTUP_CHECK_TIMEOUT) -> None:
+        """
+        Run a warm-up check and record its outcome.
+
+        Args:
+            name (str): The name of the check.
+            check (Callable): The function returning the awaitable of the check.
+            timeout (float, optional): The maximum duration of the check, in seconds.
+        """
+        start_time = time.perf_counter()
+        self.checks[name] = {'status': 'pending'}
+
+        try:
+            await asyncio.wait_for(check(), timeout)
+            self.checks[name] = {'status': 'ok'}
+        except asyncio.TimeoutError:
+            self.checks[name] = {'status': 'timeout'}
+            logging.error(f"Startup check {name} timed out after {timeout} seconds")
+        except Exception as e:
+            self.checks[name] = {'status': 'failed', 'error': f"{e}"}
+            logging.error(f"Startup check {name} failed: {e}")
+
+        self.checks[name]['duration_ms'] = round(1000 * (time.perf_counter() - start_time), 1)
+
+
+    def get_status(self) -> dict:
+        """
+        Get the readiness status.
+
+        Returns:
+            dict: Whether the application is ready, and the outcome of each warm-up check.
+        """
+        return {'ready': self.ready, 'checks': self.checks}
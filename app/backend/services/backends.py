@@ -0,0 +1,351 @@
+import asyncio
+import logging
+import random
+import time
+import openai
+
+from backend.config import environment
+from backend.services.ratelimit import Priority, RateLimitScheduler, get_backoff_delay, get_retry_after, is_retryable
+from backend.services.telemetry import telemetry
+
+
+class CircuitBreaker():
+    """
+    A circuit breaker: after failure_threshold consecutive failures, the circuit opens and calls are
+    rejected for reset_timeout seconds. A single trial call is then allowed (half-open): the circuit
+    closes if it succeeds, and opens again if it fails.
+    """
+
+    def __init__(self,
+                 failure_threshold: int = environment.OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = environment.OPENAI_CIRCUIT_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+
+    def get_state(self) -> str:
+        """
+        Get the state of the circuit.
+
+        Returns:
+            str: 'closed', 'open' or 'half-open'.
+        """
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+
+    def allow(self) -> bool:
+        """
+        Check whether a call is allowed.
+
+        Returns:
+            bool: True if the circuit is closed, or half-open without a trial call in progress.
+        """
+        state = self.get_state()
+        return state == 'closed' or (state == 'half-open' and not self.trial)
+
+
+    def start(self) -> None:
+        """
+        Record the start of a call (the trial call, when the circuit is half-open).
+        """
+        if self.get_state() == 'half-open':
+            self.trial = True
+
+
+    def record_success(self) -> None:
+        """
+        Record a successful call, closing the circuit.
+        """
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+
+    def record_failure(self) -> None:
+        """
+        Record a failed call, opening the circuit after too many consecutive failures (or a failed trial call).
+        """
+        self.failures += 1
+        if self.trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.trial = False
+
+
+class OpenAIBackend():
+    """
+    An Azure OpenAI endpoint of the backend pool, with its client, routing weight, deployment names,
+    deployment quota (None for the scheduler quota), load (outstanding tokens), latency and circuit breaker.
+    """
+
+    # Smoothing factor of the latency moving average
+    latency_smoothing = 0.2
+
+    def __init__(self, name: str, client, weight: float = 1, deployments: dict = None,
+                 tokens_per_minute: int = None, requests_per_minute: int = None):
+        self.name = name
+        self.client = client
+        self.weight = weight
+        self.deployments = deployments or {}
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.circuit_breaker = CircuitBreaker()
+        self.outstanding_tokens = 0
+        self.latency = None
+        self.throttled_until = 0
+        self.requests = 0
+        self.errors = 0
+        self.throttled = 0
+
+
+    def get_deployment(self, model: str) -> str:
+        """
+        Get the name of a model deployment on this endpoint.
+
+        Args:
+            model (str): The model deployment name of the settings.
+
+        Returns:
+            str: The deployment name on this endpoint (the same name, if it is not mapped).
+        """
+        return self.deployments.get(model, model)
+
+
+    def is_available(self) -> bool:
+        """
+        Check whether the backend can take a request.
+
+        Returns:
+            bool: True if the circuit allows calls and the backend is not throttled.
+        """
+        return self.circuit_breaker.allow() and time.monotonic() >= self.throttled_until
+
+
+    def record_latency(self, latency: float) -> None:
+        """
+        Update the latency moving average.
+
+        Args:
+            latency (float): The latency of a successful call, in seconds.
+        """
+        self.latency = latency if self.latency is None else \
+            self.latency_smoothing * latency + (1 - self.latency_smoothing) * self.latency
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the backend counters.
+
+        Returns:
+            dict: The requests, errors and throttled requests, the outstanding tokens, the latency moving average in milliseconds and the circuit state.
+        """
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'throttled': self.throttled,
+            'outstanding_tokens': self.outstanding_tokens,
+            'latency_ms': round(1000 * self.latency, 2) if self.latency is not None else None,
+            'circuit': self.circuit_breaker.get_state()
+        }
+
+
+class OpenAIBackendPool():
+    """
+    A pool of Azure OpenAI endpoints (for instance regional deployments), used to add up their quotas.
+
+    Each request is routed to an available backend, by least outstanding tokens (relative to the
+    backend weight) or by latency-weighted random selection. Backends failing repeatedly are ejected
+    by their circuit breaker, and throttled backends are skipped for the retry-after delay. The pool
+    is the only retry layer of its requests (the clients and the scheduler do not retry them): a
+    throttled or failed request is retried on another backend, or on the same backend after a delay
+    when all the backends were tried. With the rate limit scheduler, each backend deployment is
+    admitted by its own buckets (sized to the backend quota, or to the scheduler quota), and the
+    requests are routed to the backends with quota left, so that the pool adds up their quotas.
+    """
+
+    def __init__(self, backends: list,
+                 routing: str = environment.OPENAI_BACKEND_ROUTING,
+                 max_retries: int = environment.OPENAI_RATE_LIMIT_MAX_RETRIES):
+        self.backends = backends
+        self.routing = routing
+        self.max_retries = max_retries
+
+
+    def select(self, exclude: list = None, get_wait = None) -> OpenAIBackend:
+        """
+        Select the backend of a request. With the rate limit scheduler, the backends with quota left are
+        preferred, or the backend with the shortest wait for quota when none has.
+
+        Args:
+            exclude (list, optional): The backends already tried by the request.
+            get_wait (Callable, optional): The function returning the estimated wait for quota of a backend, in seconds.
+
+        Returns:
+            OpenAIBackend: The backend, or None if all the backends were tried.
+        """
+        candidates = [backend for backend in self.backends if backend not in (exclude or [])]
+        if not candidates:
+            return None
+
+        # When no backend is available, try the one throttled or ejected the longest ago rather than failing
+        available = [backend for backend in candidates if backend.is_available()]
+        if not available:
+            return min(candidates, key=lambda backend: max(backend.throttled_until, backend.circuit_breaker.opened_at or 0))
+
+        if get_wait:
+            waits = {backend: get_wait(backend) for backend in available}
+            ready = [backend for backend in available if waits[backend] == 0]
+            if not ready:
+                return min(available, key=lambda backend: (waits[backend], random.random()))
+            available = ready
+
+        if self.routing == 'latency':
+            # Backends without latency yet are given the best latency, so that they get traffic
+            latencies = [backend.latency for backend in available if backend.latency is not None]
+            default_latency = min(latencies) if latencies else 1
+            weights = [backend.weight / (backend.latency or default_latency) for backend in available]
+            return random.choices(available, weights)[0]
+
+        return min(available, key=lambda backend: (backend.outstanding_tokens / backend.weight, random.random()))
+
+
+    async def run(self, model: str, tokens: int, call, scheduler: RateLimitScheduler = None, priority: Priority = Priority.INTERACTIVE):
+        """
+        Send a request to a backend, retrying throttled and failed requests on another backend.
+
+        Args:
+            model (str): The model deployment name of the settings.
+            tokens (int): The estimated number of tokens of the request.
+            call (Callable): The function returning the awaitable of the request, given the client and the deployment name of a backend.
+            scheduler (RateLimitScheduler, optional): The rate limit scheduler admitting the requests of each backend deployment.
+            priority (Priority, optional): The priority of the request in the scheduler queues. Defaults to INTERACTIVE.
+
+        Returns:
+            Any: The response of the request.
+        """
+        tried = []
+        get_wait = (lambda backend: self.get_bucket(scheduler, backend, model).get_wait(tokens)) if scheduler else None
+
+        for attempt in range(self.max_retries + 1):
+            backend = self.select(tried, get_wait)
+            if backend is None:
+                # All the backends were tried: start over, after a delay
+                tried = []
+                backend = self.select(get_wait=get_wait)
+                await asyncio.sleep(max(backend.throttled_until - time.monotonic(), get_backoff_delay(attempt)))
+            tried.append(backend)
+
+            bucket = None
+            if scheduler:
+                bucket = self.get_bucket(scheduler, backend, model)
+                await scheduler.acquire(bucket, backend.get_deployment(model), tokens, priority)
+
+            try:
+                return await self.send(backend, model, tokens, call)
+
+            except openai.RateLimitError as e:
+                if bucket:
+                    bucket.pause(get_retry_after(e) or 1)
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Azure OpenAI backend {backend.name} throttled, retrying: {e}")
+
+            except openai.APIError as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+                logging.warning(f"Azure OpenAI backend {backend.name} failed, retrying: {e}")
+
+
+    def get_bucket(self, scheduler: RateLimitScheduler, backend: OpenAIBackend, model: str):
+        """
+        Get the rate limit buckets of a backend deployment.
+
+        Args:
+            scheduler (RateLimitScheduler): The rate limit scheduler.
+            backend (OpenAIBackend): The backend.
+            model (str): The model deployment name of the settings.
+
+        Returns:
+            RateLimitBucket: The buckets of the deployment on the backend.
+        """
+        return scheduler.get_bucket(
+            f"{backend.name}/{backend.get_deployment(model)}",
+            backend.tokens_per_minute,
+            backend.requests_per_minute
+        )
+
+
+    async def send(self, backend: OpenAIBackend, model: str, tokens: int, call):
+        """
+        Send a request to a backend, and record its latency and outcome.
+
+        Args:
+            backend (OpenAIBackend): The backend.
+            model (str): The model deployment name of the settings.
+            tokens (int): The estimated number of tokens of the request.
+            call (Callable): The function returning the awaitable of the request, given the client and the deployment name of the backend.
+
+        Returns:
+            Any: The response of the request.
+        """
+        start_time = time.perf_counter()
+        backend.requests += 1
+        backend.outstanding_tokens += tokens
+        backend.circuit_breaker.start()
+        outcome = 'error'
+
+        try:
+            response = await call(backend.client, backend.get_deployment(model))
+            outcome = 'ok'
+            backend.circuit_breaker.record_success()
+            backend.record_latency(time.perf_counter() - start_time)
+            return response
+
+        except openai.RateLimitError as e:
+            # A throttled backend is healthy: it is skipped for the retry-after delay, without opening its circuit
+            outcome = 'throttled'
+            backend.throttled += 1
+            backend.throttled_until = time.monotonic() + (get_retry_after(e) or 1)
+            backend.circuit_breaker.trial = False
+            raise
+
+        except (openai.APIConnectionError, openai.InternalServerError):
+            backend.errors += 1
+            backend.circuit_breaker.record_failure()
+            raise
+
+        except Exception:
+            # Request errors (such as invalid prompts) do not reflect the health of the backend
+            backend.errors += 1
+            backend.circuit_breaker.trial = False
+            raise
+
+        finally:
+            backend.outstanding_tokens -= tokens
+            telemetry.openai_backend_duration.observe(time.perf_counter() - start_time, backend=backend.name, outcome=outcome)
+
+
+    def get_clients(self) -> list:
+        """
+        Get the clients of the backends.
+
+        Returns:
+            list: The Azure OpenAI clients.
+        """
+        return [backend.client for backend in self.backends]
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the counters of the backends.
+
+        Returns:
+            dict: The counters of each backend, by name.
+        """
+        return {backend.name: backend.get_stats() for backend in self.backends}
@@ -0,0 +1,920 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import numpy as np
+
+from abc import ABC, abstractmethod
+from array import array
+from collections import OrderedDict
+from azure.cosmos import exceptions
+from backend.config import environment
+
+
+class LruCache():
+    """
+    An in-process LRU cache with size and TTL limits, and hit/miss counters.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def get(self, key: str):
+        """
+        Get a value from the cache.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            The cached value, or None if the key is not cached or has expired.
+        """
+        entry = self.entries.get(key)
+
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+
+    def set(self, key: str, value, ttl: float = None) -> None:
+        """
+        Add a value to the cache, evicting the least recently used entries if the cache is full.
+
+        Args:
+            key (str): The cache key.
+            value: The value to cache.
+            ttl (float, optional): The time to live of the entry, in seconds. Defaults to the cache TTL.
+        """
+        self.entries[key] = (time.monotonic() + (ttl if ttl is not None else self.ttl), value)
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def delete(self, key: str) -> None:
+        """
+        Remove a value from the cache.
+
+        Args:
+            key (str): The cache key.
+        """
+        self.entries.pop(key, None)
+
+
+    def clear(self) -> None:
+        """
+        Remove all values from the cache.
+        """
+        self.entries.clear()
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: The number of entries, hits, misses and evictions.
+        """
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class SharedCacheTier(ABC):
+    """
+    Interface of a cache tier shared between application instances. Values are stored as bytes.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+
+
+    @abstractmethod
+    async def get(self, key: str) -> bytes:
+        """
+        Get a value.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            bytes: The value, or None if not found or expired.
+        """
+
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        """
+        Set a value.
+
+        Args:
+            key (str): The cache key.
+            value (bytes): The value.
+            ttl (float): The time to live of the value, in seconds.
+        """
+
+
+    @abstractmethod
+    async def delete(self, key: str) -> None:
+        """
+        Delete a value.
+
+        Args:
+            key (str): The cache key.
+        """
+
+
+    async def close(self) -> None:
+        pass
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache tier counters.
+
+        Returns:
+            dict: The number of hits and misses.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class LocalSharedCacheTier(SharedCacheTier):
+    """
+    An in-process stand-in for the shared cache tier, used for local development and tests.
+    """
+
+    def __init__(self, max_entries: int = environment.CACHE_SHARED_MAX_ENTRIES):
+        super().__init__()
+        self.cache = LruCache(max_entries, 0)
+
+
+    async def get(self, key: str) -> bytes:
+        value = self.cache.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.cache.set(key, value, ttl)
+
+
+    async def delete(self, key: str) -> None:
+        self.cache.delete(key)
+
+
+class RedisSharedCacheTier(SharedCacheTier):
+    """
+    A shared cache tier backed by Redis (requires the 'redis' package).
+    """
+
+    def __init__(self, url: str = environment.CACHE_REDIS_URL):
+        super().__init__()
+        import redis.asyncio as redis
+        self.client = redis.from_url(url)
+
+
+    async def get(self, key: str) -> bytes:
+        value = await self.client.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+
+    async def set(self, key: str, value: bytes, ttl: float) -> None:
+        await self.client.set(key, value, ex=max(1, int(ttl)))
+
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(key)
+
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def get_shared_cache_tier() -> SharedCacheTier:
+    """
+    Creates the shared cache tier configured with CACHE_SHARED_TIER ('none', 'local' or 'redis').
+
+    Returns:
+        SharedCacheTier: The shared cache tier, or None if it is disabled.
+    """
+    if environment.CACHE_SHARED_TIER == 'redis':
+        return RedisSharedCacheTier()
+
+    if environment.CACHE_SHARED_TIER == 'local':
+        return LocalSharedCacheTier()
+
+    return None
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize a text before using it in a cache key (case and whitespace insensitive).
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+    """
+    return ' '.join(text.split()).lower()
+
+
+class EmbeddingCache():
+    """
+    A two-tier cache of embeddings keyed by embedding deployment and normalized text.
+
+    Embeddings are stored as compact float arrays in an in-process LRU tier and, optionally,
+    in a shared tier so that multiple application instances can reuse them.
+    """
+
+    def __init__(self, shared_tier: SharedCacheTier = None,
+                 max_entries: int = environment.EMBEDDING_CACHE_MAX_ENTRIES,
+                 ttl: float = environment.EMBEDDING_CACHE_TTL):
+        self.local_tier = LruCache(max_entries, ttl)
+        self.shared_tier = shared_tier
+        self.ttl = ttl
+
+
+    def get_key(self, deployment: str, text: str) -> str:
+        """
+        Get the cache key of an embedding.
+
+        Args:
+            deployment (str): The embedding model deployment.
+            text (str): The embedded text.
+
+        Returns:
+            str: The cache key.
+        """
+        digest = hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+        return f"embedding:{deployment}:{digest}"
+
+
+    async def get_many(self, deployment: str, texts: list) -> list:
+        """
+        Get the cached embeddings of a list of texts.
+
+        Args:
+            deployment (str): The embedding model deployment.
+            texts (list): The texts to look up.
+
+        Returns:
+            list: The cached embeddings, with None for each text that is not cached.
+        """
+        embeddings = []
+
+        for text in texts:
+            key = self.get_key(deployment, text)
+            value = self.local_tier.get(key)
+
+            if value is None and self.shared_tier:
+                try:
+                    data = await self.shared_tier.get(key)
+                    if data is not None:
+                        value = array('f')
+                        value.frombytes(data)
+                        self.local_tier.set(key, value)
+                except Exception as e:
+                    logging.warning(f"Error reading the shared embedding cache: {e}")
+
+            embeddings.append(value.tolist() if value is not None else None)
+
+        return embeddings
+
+
+    async def set_many(self, deployment: str, texts: list, embeddings: list) -> None:
+        """
+        Add the embeddings of a list of texts to the cache.
+
+        Args:
+            deployment (str): The embedding model deployment.
+            texts (list): The embedded texts.
+            embeddings (list): The embeddings, in the same order as the texts.
+        """
+        for text, embedding in zip(texts, embeddings):
+            key = self.get_key(deployment, text)
+            value = array('f', embedding)
+            self.local_tier.set(key, value)
+
+            if self.shared_tier:
+                try:
+                    await self.shared_tier.set(key, value.tobytes(), self.ttl)
+                except Exception as e:
+                    logging.warning(f"Error writing the shared embedding cache: {e}")
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache counters of both tiers.
+
+        Returns:
+            dict: The local and shared tier counters.
+        """
+        return {
+            'local': self.local_tier.get_stats(),
+            'shared': self.shared_tier.get_stats() if self.shared_tier else None
+        }
+
+
+class IndexVersion():
+    """
+    A token identifying the current content version of the search index.
+
+    Caches derived from the index content store the token with their entries and discard entries
+    created with another version. The token is bumped when the index content changes, and is
+    propagated to the other application instances through shared state, read every refresh_interval
+    seconds: the redis shared cache tier if configured, otherwise an item of the chat history Cosmos DB
+    container. Without either, a bump only reaches the instance it is made on.
+    """
+
+    key = 'search:index-version'
+
+    def __init__(self, shared_tier: SharedCacheTier = None, container = None,
+                 version: str = environment.AZURE_SEARCH_INDEX_VERSION,
+                 refresh_interval: float = environment.INDEX_VERSION_REFRESH_INTERVAL):
+        self.shared_tier = shared_tier
+        self.container = container
+        self.version = version
+        self.refresh_interval = refresh_interval
+        self.refreshed = 0
+
+
+    async def get(self) -> str:
+        """
+        Get the current index version token.
+
+        Returns:
+            str: The index version token.
+        """
+        if (self.shared_tier or self.container) and time.monotonic() - self.refreshed > self.refresh_interval:
+            self.refreshed = time.monotonic()
+            try:
+                value = await self.read()
+                if value is not None:
+                    self.version = value
+            except Exception as e:
+                logging.warning(f"Error reading the index version from the shared state: {e}")
+
+        return self.version
+
+
+    async def bump(self) -> str:
+        """
+        Set a new index version token, invalidating all cache entries derived from the index content.
+
+        Returns:
+            str: The new index version token.
+        """
+        self.version = hashlib.sha256(f"{self.version}:{time.time_ns()}".encode('utf-8')).hexdigest()[:16]
+        self.refreshed = time.monotonic()
+
+        try:
+            await self.write(self.version)
+        except Exception as e:
+            logging.warning(f"Error writing the index version to the shared state: {e}")
+
+        return self.version
+
+
+    async def read(self) -> str:
+        """
+        Read the index version token from the shared state.
+
+        Returns:
+            str: The index version token, or None if it was never bumped.
+        """
+        if self.shared_tier:
+            value = await self.shared_tier.get(self.key)
+            return value.decode('utf-8') if isinstance(value, bytes) else value
+
+        try:
+            item = await self.container.read_item(item=self.key, partition_key=self.key)
+            return item['version']
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+
+
+    async def write(self, version: str) -> None:
+        """
+        Write the index version token to the shared state.
+
+        Args:
+            version (str): The index version token.
+        """
+        if self.shared_tier:
+            await self.shared_tier.set(self.key, version.encode('utf-8'), 365 * 86400)
+        elif self.container:
+            # Typed item, in its own partition: it is not part of any chat history
+            await self.container.upsert_item({'id': self.key, 'session_id': self.key, 'type': 'index_version', 'version': version})
+
+
+class SemanticCache():
+    """
+    An in-process cache of chat responses looked up by cosine similarity of the prompt embeddings.
+
+    The prompt embeddings are stored in a preallocated NumPy matrix, so that a lookup is a single
+    matrix-vector product. Entries are evicted in LRU order, expire after a TTL, and are discarded
+    when the search index version changes. Entries are partitioned by a scope (for instance the
+    user name used in the system prompt), so that personalized answers are not shared.
+    """
+
+    def __init__(self, index_version: IndexVersion,
+                 threshold: float = environment.SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = environment.SEMANTIC_CACHE_MAX_ENTRIES,
+                 ttl: float = environment.SEMANTIC_CACHE_TTL):
+        self.index_version = index_version
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.vectors = None
+        self.valid = np.zeros(max_entries, dtype=bool)
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    async def get(self, scope: str, embedding: list):
+        """
+        Get the cached value of the most similar prompt, if its similarity is above the threshold.
+
+        Args:
+            scope (str): The scope of the entries to search.
+            embedding (list): The embedding of the prompt.
+
+        Returns:
+            The cached value, or None if there is no similar prompt.
+        """
+        version = await self.index_version.get()
+        self.evict(version)
+
+        if self.vectors is None or not self.valid.any():
+            self.misses += 1
+            return None
+
+        vector = self.normalize(embedding)
+        similarities = np.where(self.valid, self.vectors @ vector, -1.0)
+
+        # Only consider the entries of the same scope
+        for slot in np.argsort(similarities)[::-1]:
+            if similarities[slot] < self.threshold:
+                break
+            entry = self.entries.get(int(slot))
+            if entry and entry['scope'] == scope:
+                self.entries.move_to_end(int(slot))
+                self.hits += 1
+                return entry['value']
+
+        self.misses += 1
+        return None
+
+
+    async def set(self, scope: str, embedding: list, value) -> None:
+        """
+        Add a value to the cache.
+
+        Args:
+            scope (str): The scope of the entry.
+            embedding (list): The embedding of the prompt.
+            value: The value to cache.
+        """
+        version = await self.index_version.get()
+        self.evict(version)
+
+        vector = self.normalize(embedding)
+
+        if self.vectors is None:
+            self.vectors = np.zeros((self.max_entries, len(vector)), dtype=np.float32)
+
+        # Use a free slot, or the least recently used one
+        free_slots = np.flatnonzero(~self.valid)
+        if len(free_slots) > 0:
+            slot = int(free_slots[0])
+        else:
+            slot, _ = self.entries.popitem(last=False)
+
+        self.vectors[slot] = vector
+        self.valid[slot] = True
+        self.entries[slot] = {
+            'scope': scope,
+            'value': value,
+            'version': version,
+            'expires': time.monotonic() + self.ttl
+        }
+
+
+    def evict(self, version: str) -> None:
+        """
+        Remove the expired entries and the entries of another index version.
+
+        Args:
+            version (str): The current index version token.
+        """
+        now = time.monotonic()
+        for slot in [slot for slot, entry in self.entries.items() if entry['expires'] <= now or entry['version'] != version]:
+            del self.entries[slot]
+            self.valid[slot] = False
+
+
+    def clear(self) -> None:
+        """
+        Remove all values from the cache.
+        """
+        self.entries.clear()
+        self.valid[:] = False
+
+
+    def normalize(self, embedding: list) -> np.ndarray:
+        """
+        Normalize an embedding to unit length, so that the dot product is the cosine similarity.
+
+        Args:
+            embedding (list): The embedding.
+
+        Returns:
+            np.ndarray: The normalized embedding.
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: The number of entries, hits and misses.
+        """
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+class SingleFlight():
+    """
+    Deduplicates concurrent calls with the same key: the first caller runs the call, and the
+    callers arriving while it is in flight await the same result instead of repeating it.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+
+    async def run(self, key: str, factory):
+        """
+        Run a call, or join the call in flight with the same key.
+
+        Args:
+            key (str): The call key.
+            factory (Callable): A function returning the coroutine to run.
+
+        Returns:
+            The result of the call.
+        """
+        task = self.calls.get(key)
+
+        if task is None:
+            task = asyncio.ensure_future(factory())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key) if self.calls.get(key) is task else None)
+        else:
+            self.coalesced += 1
+
+        # A cancelled caller must not cancel the call shared with the other callers
+        return await asyncio.shield(task)
+
+
+class SearchResultCache():
+    """
+    An in-process cache of search results, with stampede protection.
+
+    Results are keyed by the normalized query text, the query options and the index version, so
+    that they are invalidated when the index content changes. Concurrent identical queries that
+    miss the cache result in a single call to the search service.
+    """
+
+    def __init__(self, index_version: IndexVersion,
+                 max_entries: int = environment.SEARCH_CACHE_MAX_ENTRIES,
+                 ttl: float = environment.SEARCH_CACHE_TTL):
+        self.index_version = index_version
+        self.cache = LruCache(max_entries, ttl)
+        self.single_flight = SingleFlight()
+
+
+    def get_key(self, search_query: str, **options) -> str:
+        """
+        Get the cache key of a search query.
+
+        Args:
+            search_query (str): The search query text.
+            **options: The query options affecting the results (maximum results, fields, ...).
+
+        Returns:
+            str: The cache key.
+        """
+        key = json.dumps({
+            'query': normalize_text(search_query),
+            'options': options,
+            'version': self.index_version.version
+        }, sort_keys=True)
+        return f"search:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+    def contains(self, key: str) -> bool:
+        """
+        Check whether the results of a query are cached, without updating the counters.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            bool: True if the results are cached and have not expired.
+        """
+        entry = self.cache.entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+
+    async def get_or_create(self, key: str, factory) -> list:
+        """
+        Get the cached results of a query, or run the query once for all concurrent callers.
+
+        Args:
+            key (str): The cache key.
+            factory (Callable): A function returning the coroutine that runs the query.
+
+        Returns:
+            list: The search results.
+        """
+        results = self.cache.get(key)
+        if results is not None:
+            return results
+
+        async def create():
+            results = await factory()
+            self.cache.set(key, results)
+            return results
+
+        return await self.single_flight.run(key, create)
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: The cache counters and the number of queries coalesced with a query in flight.
+        """
+        return dict(self.cache.get_stats(), coalesced=self.single_flight.coalesced)
+
+
+class SessionHistoryCache():
+    """
+    A cache of the most recent chat history turns of each session, updated write-through.
+
+    An entry is created from the turns loaded from the database, and the turns written to the
+    database are then appended to it, so that the following turns of a session read their history
+    from memory. An entry is only used if it holds enough turns for a request, or all the turns of
+    the session; otherwise the history is loaded from the database again.
+
+    Without a shared tier, entries are kept in-process and evicted when the session is idle or
+    the cache is full. With a shared tier, entries are only kept in the shared tier, so that all
+    application instances see the turns written by each other (sessions are not sticky).
+
+    The entries are not checked against the database: without the redis shared tier, the cache is
+    only safe with a single application process (or sticky sessions), and it is disabled by default.
+    """
+
+    # Fields of the chat history items kept in the cache (the fields of the history query)
+    fields = ['id', 'user_prompt', 'assistant_response']
+
+    def __init__(self, shared_tier: SharedCacheTier = None,
+                 max_sessions: int = environment.HISTORY_CACHE_MAX_SESSIONS,
+                 max_turns: int = environment.HISTORY_CACHE_MAX_TURNS,
+                 idle_ttl: float = environment.HISTORY_CACHE_IDLE_TTL):
+        self.local_tier = LruCache(max_sessions, idle_ttl)
+        self.shared_tier = shared_tier
+        self.max_turns = max_turns
+        self.idle_ttl = idle_ttl
+        self.hits = 0
+        self.misses = 0
+
+
+    def get_key(self, session_id: str) -> str:
+        """
+        Get the cache key of the turns of a session.
+
+        Args:
+            session_id (str): The ID of the session.
+
+        Returns:
+            str: The cache key.
+        """
+        return f"history:{session_id}"
+
+
+    def get_summary_key(self, session_id: str) -> str:
+        """
+        Get the cache key of the conversation summary of a session.
+
+        Args:
+            session_id (str): The ID of the session.
+
+        Returns:
+            str: The cache key.
+        """
+        return f"history-summary:{session_id}"
+
+
+    async def get(self, session_id: str, max_results: int) -> list:
+        """
+        Get the most recent chat history turns of a session.
+
+        Args:
+            session_id (str): The ID of the session.
+            max_results (int): The maximum number of turns.
+
+        Returns:
+            list: The turns, oldest first, or None if the cache does not hold enough turns.
+        """
+        entry = await self.get_entry(self.get_key(session_id))
+
+        if entry is None or (len(entry['turns']) < max_results and not entry['complete']):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+
+        # Extend the lifetime of the in-process entry of an active session
+        if not self.shared_tier:
+            self.local_tier.set(self.get_key(session_id), entry)
+
+        return [dict(turn) for turn in entry['turns'][-max_results:]] if max_results > 0 else []
+
+
+    async def set(self, session_id: str, turns: list, max_results: int) -> None:
+        """
+        Add the chat history turns loaded from the database for a session.
+
+        Args:
+            session_id (str): The ID of the session.
+            turns (list): The turns, oldest first.
+            max_results (int): The maximum number of turns of the database query, used to know whether the session has more turns.
+        """
+        await self.set_entry(self.get_key(session_id), {
+            'turns': [{field: turn.get(field) for field in self.fields} for turn in turns[-self.max_turns:]],
+            'complete': len(turns) < max_results and len(turns) <= self.max_turns
+        })
+
+
+    async def append(self, turn: dict) -> None:
+        """
+        Add a chat history turn written to the database to the entry of its session, if cached.
+
+        Args:
+            turn (dict): The chat history item.
+        """
+        entry = await self.get_entry(self.get_key(turn['session_id']))
+        if entry is None:
+            return
+
+        turns = [cached_turn for cached_turn in entry['turns'] if cached_turn['id'] != turn['id']]
+        turns.append({field: turn.get(field) for field in self.fields})
+
+        if len(turns) > self.max_turns:
+            turns = turns[-self.max_turns:]
+            entry['complete'] = False
+
+        entry['turns'] = turns
+        await self.set_entry(self.get_key(turn['session_id']), entry)
+
+
+    async def get_summary(self, session_id: str) -> dict:
+        """
+        Get the conversation summary of a session.
+
+        Args:
+            session_id (str): The ID of the session.
+
+        Returns:
+            dict: The conversation summary item (empty if the session has no summary), or None if not cached.
+        """
+        return await self.get_entry(self.get_summary_key(session_id))
+
+
+    async def set_summary(self, session_id: str, summary: dict) -> None:
+        """
+        Set the conversation summary of a session.
+
+        Args:
+            session_id (str): The ID of the session.
+            summary (dict): The conversation summary item (empty if the session has no summary).
+        """
+        await self.set_entry(self.get_summary_key(session_id), summary)
+
+
+    async def delete(self, session_id: str) -> None:
+        """
+        Remove the entries of a session, so that its history is loaded from the database again.
+
+        Args:
+            session_id (str): The ID of the session.
+        """
+        for key in [self.get_key(session_id), self.get_summary_key(session_id)]:
+            self.local_tier.delete(key)
+
+            if self.shared_tier:
+                try:
+                    await self.shared_tier.delete(key)
+                except Exception as e:
+                    logging.warning(f"Error deleting from the shared history cache: {e}")
+
+
+    async def get_entry(self, key: str) -> dict:
+        """
+        Get a cache entry.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            dict: A copy of the entry, or None if not cached.
+        """
+        if not self.shared_tier:
+            entry = self.local_tier.get(key)
+            return {name: list(value) if isinstance(value, list) else value for name, value in entry.items()} if entry is not None else None
+
+        try:
+            data = await self.shared_tier.get(key)
+            return json.loads(data) if data is not None else None
+        except Exception as e:
+            logging.warning(f"Error reading the shared history cache: {e}")
+            return None
+
+
+    async def set_entry(self, key: str, entry: dict) -> None:
+        """
+        Set a cache entry.
+
+        Args:
+            key (str): The cache key.
+            entry (dict): The entry.
+        """
+        if not self.shared_tier:
+            self.local_tier.set(key, entry)
+            return
+
+        try:
+            await self.shared_tier.set(key, json.dumps(entry).encode('utf-8'), self.idle_ttl)
+        except Exception as e:
+            logging.warning(f"Error writing the shared history cache: {e}")
+            try:
+                await self.shared_tier.delete(key)
+            except Exception:
+                pass
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache counters.
+
+        Returns:
+            dict: The number of in-process entries, hits, misses and evicted sessions.
+        """
+        return {
+            'entries': len(self.local_tier.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.local_tier.evictions
+        }
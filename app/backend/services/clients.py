@@ -0,0 +1,334 @@
+import aiohttp
+import httpx
+import openai
+import requests
+
+from functools import cached_property
+from requests.adapters import HTTPAdapter
+from openai import AzureOpenAI, AsyncAzureOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
+from azure.core.credentials import AzureKeyCredential
+from azure.core.pipeline.transport import RequestsTransport, AioHttpTransport
+from azure.cosmos import CosmosClient
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+from backend.config import environment
+from backend.services.followup import FollowupStore
+from backend.services.compaction import ToolPayloadCompactor
+from backend.services.summary import SummaryScheduler
+from backend.services.ratelimit import RateLimitScheduler
+from backend.services.backends import OpenAIBackend, OpenAIBackendPool
+from backend.services.routing import ToolRouter
+from backend.services.localsearch import LocalSearchClient
+from backend.services.searchbackend import AzureSearchBackend
+from backend.services.coalescing import ChatTurnCoalescer
+from backend.services.persistence import ChatHistoryWriter, LocalChatHistoryContainer
+from backend.services.cache import EmbeddingCache, IndexVersion, SearchResultCache, SemanticCache, SessionHistoryCache, get_shared_cache_tier
+
+
+class ClientRegistry():
+    """
+    A process-wide registry of Azure service clients and shared in-process state.
+
+    The registry is created once during the application lifespan and injected into the API classes,
+    so that all requests share the same keep-alive HTTP connection pools instead of building new
+    clients (and paying TLS handshakes and account metadata lookups) on every call.
+
+    The asyncio clients used by the API endpoints are created eagerly (the registry must be created
+    inside a running event loop). The synchronous clients are only created on first use.
+    """
+
+    def __init__(self):
+        # Shared HTTP connection pool used by the asyncio OpenAI client (httpx)
+        self.async_http_client = DefaultAsyncHttpxClient(
+            limits = self.get_http_limits(),
+            timeout = environment.HTTP_TIMEOUT
+        )
+
+        # Shared HTTP connection pool used by the asyncio Azure SDK clients (aiohttp)
+        self.async_http_session = aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(
+                limit = environment.HTTP_POOL_MAX_CONNECTIONS,
+                keepalive_timeout = environment.HTTP_POOL_KEEPALIVE_EXPIRY
+            )
+        )
+
+        # Scheduler of the GPT model requests (deployment quotas, priorities and retries)
+        self.openai_scheduler = RateLimitScheduler() if environment.OPENAI_SCHEDULER_ENABLED else None
+
+        self.async_openai_client = AsyncAzureOpenAI(
+            api_key = environment.AZURE_OPENAI_API_KEY,
+            azure_endpoint = environment.AZURE_OPENAI_ENDPOINT,
+            api_version = environment.AZURE_OPENAI_API_VERSION,
+            http_client = self.async_http_client,
+            max_retries = 0 if self.openai_scheduler else openai.DEFAULT_MAX_RETRIES
+        )
+
+        # Pool of Azure OpenAI endpoints the GPT model requests are balanced across, when configured
+        self.openai_backends = self.get_openai_backends() if environment.AZURE_OPENAI_BACKENDS else None
+
+        # Search index backend (SearchBackend): Azure AI Search, or an in-process index
+        if environment.SEARCH_BACKEND == 'local':
+            self.async_search_client = LocalSearchClient()
+        else:
+            self.async_search_client = AzureSearchBackend(AsyncSearchClient(
+                endpoint = environment.AZURE_SEARCH_ENDPOINT,
+                api_version = environment.AZURE_SEARCH_API_VERSION,
+                index_name = environment.AZURE_SEARCH_INDEX_NAME,
+                credential = AzureKeyCredential(environment.AZURE_SEARCH_API_KEY),
+                transport = self.get_async_transport()
+            ))
+
+        if environment.CHAT_HISTORY_STORE == 'local':
+            self.async_cosmos_client = None
+            self.async_cosmos_container = LocalChatHistoryContainer()
+        else:
+            self.async_cosmos_client = AsyncCosmosClient(
+                environment.AZURE_COSMOS_ENDPOINT,
+                environment.AZURE_COSMOS_KEY,
+                transport = self.get_async_transport()
+            )
+            self.async_cosmos_container = self.async_cosmos_client \
+                .get_database_client(environment.AZURE_COSMOS_DATABASE) \
+                .get_container_client(environment.AZURE_COSMOS_CONTAINER)
+
+        # Write-behind queue of the chat history items
+        self.history_writer = ChatHistoryWriter(self.async_cosmos_container) if environment.HISTORY_WRITE_BEHIND_ENABLED else None
+
+        # Caches (in-process tier, with an optional shared tier)
+        self.shared_cache = get_shared_cache_tier()
+        self.embedding_cache = EmbeddingCache(self.shared_cache)
+        # Index version shared through redis, or through the chat history container (the local shared tier is per process)
+        self.index_version = IndexVersion(self.shared_cache if environment.CACHE_SHARED_TIER == 'redis' else None, self.async_cosmos_container)
+        self.semantic_cache = SemanticCache(self.index_version) if environment.SEMANTIC_CACHE_ENABLED else None
+        self.search_cache = SearchResultCache(self.index_version) if environment.SEARCH_CACHE_ENABLED else None
+        self.history_cache = SessionHistoryCache(self.shared_cache) if environment.HISTORY_CACHE_ENABLED else None
+
+        # Follow-up questions (kept in the shared tier, if configured) and conversation summaries generated in the background
+        self.followup_store = FollowupStore(self.shared_cache)
+        self.summary_scheduler = SummaryScheduler() if environment.SUMMARY_ENABLED else None
+
+        # Deduplication of identical chat turns (in flight, or retried with an idempotency key)
+        self.chat_coalescer = ChatTurnCoalescer(self.shared_cache) if environment.CHAT_COALESCING_ENABLED else None
+
+        # Compaction of the search results sent to the GPT model
+        self.tool_payload_compactor = ToolPayloadCompactor() if environment.TOOL_PAYLOAD_COMPACTION_ENABLED else None
+
+        # Tool routing fast path (retrieval decided up front, or speculative search)
+        self.tool_router = ToolRouter() if environment.TOOL_ROUTING_MODE != 'model' else None
+
+
+    @cached_property
+    def http_client(self) -> httpx.Client:
+        """
+        Shared HTTP connection pool used by the synchronous OpenAI client (httpx).
+        """
+        return DefaultHttpxClient(
+            limits = self.get_http_limits(),
+            timeout = environment.HTTP_TIMEOUT
+        )
+
+
+    @cached_property
+    def http_session(self) -> requests.Session:
+        """
+        Shared HTTP connection pool used by the synchronous Azure SDK clients (requests).
+        """
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections = environment.HTTP_POOL_MAX_KEEPALIVE,
+            pool_maxsize = environment.HTTP_POOL_MAX_CONNECTIONS
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+    @cached_property
+    def openai_client(self) -> AzureOpenAI:
+        """
+        Synchronous Azure OpenAI client.
+        """
+        return AzureOpenAI(
+            api_key = environment.AZURE_OPENAI_API_KEY,
+            azure_endpoint = environment.AZURE_OPENAI_ENDPOINT,
+            api_version = environment.AZURE_OPENAI_API_VERSION,
+            http_client = self.http_client
+        )
+
+
+    @cached_property
+    def search_client(self) -> SearchClient:
+        """
+        Synchronous Azure AI Search client.
+        """
+        return SearchClient(
+            endpoint = environment.AZURE_SEARCH_ENDPOINT,
+            api_version = environment.AZURE_SEARCH_API_VERSION,
+            index_name = environment.AZURE_SEARCH_INDEX_NAME,
+            credential = AzureKeyCredential(environment.AZURE_SEARCH_API_KEY),
+            transport = self.get_transport()
+        )
+
+
+    @cached_property
+    def cosmos_client(self) -> CosmosClient:
+        """
+        Synchronous Cosmos DB client.
+        """
+        return CosmosClient(
+            environment.AZURE_COSMOS_ENDPOINT,
+            environment.AZURE_COSMOS_KEY,
+            transport = self.get_transport()
+        )
+
+
+    @cached_property
+    def cosmos_container(self):
+        """
+        Synchronous Cosmos DB container client for the chat history container.
+        """
+        return self.cosmos_client \
+            .get_database_client(environment.AZURE_COSMOS_DATABASE) \
+            .get_container_client(environment.AZURE_COSMOS_CONTAINER)
+
+
+    def get_http_limits(self) -> httpx.Limits:
+        """
+        Returns the connection pool limits for the httpx clients.
+
+        Returns:
+            httpx.Limits: The configured connection pool limits.
+        """
+        return httpx.Limits(
+            max_connections = environment.HTTP_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections = environment.HTTP_POOL_MAX_KEEPALIVE,
+            keepalive_expiry = environment.HTTP_POOL_KEEPALIVE_EXPIRY
+        )
+
+
+    def get_transport(self) -> RequestsTransport:
+        """
+        Creates a synchronous Azure SDK transport bound to the shared HTTP session.
+
+        Returns:
+            RequestsTransport: The transport object, which does not own (and will not close) the shared session.
+        """
+        return RequestsTransport(
+            session = self.http_session,
+            session_owner = False,
+            connection_timeout = environment.HTTP_TIMEOUT,
+            read_timeout = environment.HTTP_TIMEOUT
+        )
+
+
+    def get_async_transport(self) -> AioHttpTransport:
+        """
+        Creates an asyncio Azure SDK transport bound to the shared HTTP session.
+
+        Returns:
+            AioHttpTransport: The transport object, which does not own (and will not close) the shared session.
+        """
+        return AioHttpTransport(
+            session = self.async_http_session,
+            session_owner = False,
+            connection_timeout = environment.HTTP_TIMEOUT,
+            read_timeout = environment.HTTP_TIMEOUT
+        )
+
+
+    def get_openai_backends(self) -> OpenAIBackendPool:
+        """
+        Creates the pool of Azure OpenAI backends of the settings, sharing the asyncio HTTP connection pool.
+        The requests are retried by the pool, not by the clients.
+
+        Returns:
+            OpenAIBackendPool: The backend pool.
+        """
+        return OpenAIBackendPool([
+            OpenAIBackend(
+                name = backend.get('name', backend['endpoint']),
+                client = AsyncAzureOpenAI(
+                    api_key = backend.get('api_key', environment.AZURE_OPENAI_API_KEY),
+                    azure_endpoint = backend['endpoint'],
+                    api_version = backend.get('api_version', environment.AZURE_OPENAI_API_VERSION),
+                    http_client = self.async_http_client,
+                    max_retries = 0
+                ),
+                weight = backend.get('weight', 1),
+                deployments = backend.get('deployments'),
+                tokens_per_minute = backend.get('tokens_per_minute'),
+                requests_per_minute = backend.get('requests_per_minute')
+            )
+            for backend in environment.AZURE_OPENAI_BACKENDS
+        ])
+
+
+    def get_openai_clients(self) -> list:
+        """
+        Returns the asyncio Azure OpenAI clients the GPT model requests are sent to.
+
+        Returns:
+            list: The clients of the backend pool, or the single client.
+        """
+        return self.openai_backends.get_clients() if self.openai_backends else [self.async_openai_client]
+
+
+    def get_stats(self) -> dict:
+        """
+        Returns the counters of the caches, of the tool payload compaction, of the chat history writer, of the GPT model scheduler and backends, of the tool routing and of the chat request coalescing.
+
+        Returns:
+            dict: The counters, by component.
+        """
+        return {
+            'embeddings': self.embedding_cache.get_stats(),
+            'semantic': self.semantic_cache.get_stats() if self.semantic_cache else None,
+            'search': self.search_cache.get_stats() if self.search_cache else None,
+            'history': self.history_cache.get_stats() if self.history_cache else None,
+            'tool_payloads': self.tool_payload_compactor.get_stats() if self.tool_payload_compactor else None,
+            'history_writes': self.history_writer.get_stats() if self.history_writer else None,
+            'openai_scheduler': self.openai_scheduler.get_stats() if self.openai_scheduler else None,
+            'openai_backends': self.openai_backends.get_stats() if self.openai_backends else None,
+            'tool_routing': self.tool_router.get_stats() if self.tool_router else None,
+            'chat_coalescing': self.chat_coalescer.get_stats() if self.chat_coalescer else None
+        }
+
+
+    def close(self) -> None:
+        """
+        Closes the synchronous clients that have been created and releases their connection pools.
+        """
+        for name in ['search_client', 'cosmos_client', 'openai_client', 'http_client', 'http_session']:
+            if name in self.__dict__:
+                self.__dict__[name].close()
+
+
+    async def drain(self) -> None:
+        """
+        Writes the chat history items still queued in the write-behind queue.
+        """
+        if self.history_writer:
+            await self.history_writer.drain()
+
+
+    async def aclose(self) -> None:
+        """
+        Closes all clients and releases the shared connection pools.
+        """
+        await self.drain()
+        self.followup_store.close()
+        if self.summary_scheduler:
+            self.summary_scheduler.close()
+        await self.async_search_client.close()
+        if self.async_cosmos_client:
+            await self.async_cosmos_client.close()
+        await self.async_openai_client.close()
+        if self.openai_backends:
+            for client in self.openai_backends.get_clients():
+                await client.close()
+        await self.async_http_client.aclose()
+        await self.async_http_session.close()
+        if self.shared_cache:
+            await self.shared_cache.close()
+        self.close()
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+
+from backend.config import environment
+from backend.config.models import ChatRequest, ChatResponse
+from backend.services.cache import LruCache, SharedCacheTier, SingleFlight, normalize_text
+
+
+class ChatTurnCoalescer():
+    """
+    Deduplicates chat turns, such as double-clicked or retried requests.
+
+    Concurrent identical turns of a session (same request fields, user prompt included, and same history
+    version) run the chat pipeline once, and all the callers get its response, so that the history is only
+    written once.
+    The history version of a session is the number of its turns completed by this instance: a prompt
+    repeated after the previous turn completed is a new turn.
+
+    Requests with an idempotency key also get the response stored for ttl seconds under that key (and
+    the request fields): a retried request is answered with the stored response instead of running the
+    pipeline again. Responses are kept in the shared cache tier when configured, so that retries
+    landing on another application instance are answered as well.
+    """
+
+    def __init__(self, shared_tier: SharedCacheTier = None,
+                 max_entries: int = environment.CHAT_IDEMPOTENCY_MAX_ENTRIES,
+                 ttl: float = environment.CHAT_IDEMPOTENCY_TTL):
+        self.single_flight = SingleFlight()
+        self.history_versions = LruCache(max_entries, ttl)
+        self.local_tier = LruCache(max_entries, ttl)
+        self.shared_tier = shared_tier
+        self.ttl = ttl
+        self.executed = 0
+        self.replayed = 0
+
+
+    def get_key(self, request: ChatRequest, version: int) -> str:
+        """
+        Get the single-flight key of a chat turn, from all the fields of the request affecting the response.
+
+        Args:
+            request (ChatRequest): The chat request.
+            version (int): The history version of the session.
+
+        Returns:
+            str: The key.
+        """
+        fields = request.model_dump()
+        fields['user_prompt'] = normalize_text(request.user_prompt)
+        payload = json.dumps([fields, version], sort_keys=True)
+        return f"chat-turn:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+    def get_response_key(self, request: ChatRequest, idempotency_key: str) -> str:
+        """
+        Get the cache key of the response stored for an idempotency key.
+
+        Args:
+            request (ChatRequest): The chat request.
+            idempotency_key (str): The idempotency key of the request.
+
+        Returns:
+            str: The cache key.
+        """
+        payload = json.dumps([request.model_dump(), idempotency_key], sort_keys=True)
+        return f"chat-response:{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+    async def run(self, request: ChatRequest, factory, idempotency_key: str = None) -> ChatResponse:
+        """
+        Run a chat turn, join the identical turn in flight, or replay the response stored for the idempotency key.
+
+        Args:
+            request (ChatRequest): The chat request.
+            factory (Callable): A function returning the coroutine of the chat pipeline.
+            idempotency_key (str, optional): The idempotency key of the request.
+
+        Returns:
+            ChatResponse: The response.
+        """
+        if idempotency_key:
+            response_key = self.get_response_key(request, idempotency_key)
+            response = await self.get_response(response_key)
+            if response is not None:
+                self.replayed += 1
+                return response
+
+        version = self.history_versions.get(request.session_id) or 0
+        response = await self.single_flight.run(
+            self.get_key(request, version),
+            lambda: self.execute(request.session_id, factory)
+        )
+
+        if idempotency_key:
+            await self.set_response(response_key, response)
+
+        return response
+
+
+    async def execute(self, session_id: str, factory) -> ChatResponse:
+        """
+        Run the chat pipeline, then move the session to its next history version.
+
+        Args:
+            session_id (str): The ID of the session.
+            factory (Callable): A function returning the coroutine of the chat pipeline.
+
+        Returns:
+            ChatResponse: The response.
+        """
+        self.executed += 1
+        response = await factory()
+        self.history_versions.set(session_id, (self.history_versions.get(session_id) or 0) + 1)
+        return response
+
+
+    async def get_response(self, key: str) -> ChatResponse:
+        """
+        Get a stored response.
+
+        Args:
+            key (str): The cache key.
+
+        Returns:
+            ChatResponse: The response, or None if not stored.
+        """
+        if not self.shared_tier:
+            return self.local_tier.get(key)
+
+        try:
+            data = await self.shared_tier.get(key)
+            return ChatResponse.model_validate_json(data) if data is not None else None
+        except Exception as e:
+            logging.warning(f"Error reading the shared idempotency cache: {e}")
+            return None
+
+
+    async def set_response(self, key: str, response: ChatResponse) -> None:
+        """
+        Store a response.
+
+        Args:
+            key (str): The cache key.
+            response (ChatResponse): The response.
+        """
+        if not self.shared_tier:
+            self.local_tier.set(key, response)
+            return
+
+        try:
+            await self.shared_tier.set(key, response.model_dump_json().encode('utf-8'), self.ttl)
+        except Exception as e:
+            logging.warning(f"Error writing the shared idempotency cache: {e}")
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the coalescing counters.
+
+        Returns:
+            dict: The number of pipeline runs, of coalesced and replayed turns, and of stored responses in-process.
+        """
+        return {
+            'executed': self.executed,
+            'coalesced': self.single_flight.coalesced,
+            'replayed': self.replayed,
+            'stored': len(self.local_tier.entries)
+        }
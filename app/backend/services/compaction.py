@@ -0,0 +1,140 @@
+import json
+import re
+
+from backend.config import environment
+from backend.services.message import Tokenizer
+
+
+class ToolPayloadCompactor():
+    """
+    Compacts the search results sent to the GPT model as tool responses.
+
+    Only the configured fields are kept (the search metadata such as scores is dropped), the content
+    is replaced by the semantic captions when available and capped in size, and near-identical
+    results are removed. The number of prompt tokens saved is estimated from the payload sizes.
+    """
+
+    # Tokens are estimated from the length of the payloads, which is enough for the statistics
+    tokenizer = Tokenizer()
+
+    def __init__(self,
+                 fields: list = environment.TOOL_PAYLOAD_FIELDS,
+                 use_captions: bool = environment.TOOL_PAYLOAD_USE_CAPTIONS,
+                 max_bytes: int = environment.TOOL_PAYLOAD_MAX_BYTES,
+                 dedupe_threshold: float = environment.TOOL_PAYLOAD_DEDUPE_THRESHOLD):
+        self.fields = fields
+        self.use_captions = use_captions
+        self.max_bytes = max_bytes
+        self.dedupe_threshold = dedupe_threshold
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self.deduplicated = 0
+        self.truncated = 0
+
+
+    def compact(self, records: list) -> list:
+        """
+        Compact a list of search results. The records are not modified, since they may be cached.
+
+        Args:
+            records (list): The search results.
+
+        Returns:
+            list: The compacted search results.
+        """
+        compacted_records = []
+        shingles_seen = []
+
+        for record in records:
+            compacted_record = {field: record[field] for field in self.fields if record.get(field) is not None}
+
+            if 'content' in compacted_record:
+                content = self.get_caption(record) or compacted_record['content']
+
+                if self.max_bytes > 0 and len(content.encode('utf-8')) > self.max_bytes:
+                    content = content.encode('utf-8')[:self.max_bytes].decode('utf-8', errors='ignore')
+                    self.truncated += 1
+
+                compacted_record['content'] = content
+
+            # Skip the results nearly identical to a previous result
+            shingles = self.get_shingles(compacted_record.get('content') or compacted_record.get('title') or '')
+            if shingles and any(self.get_similarity(shingles, seen) >= self.dedupe_threshold for seen in shingles_seen):
+                self.deduplicated += 1
+                continue
+
+            shingles_seen.append(shingles)
+            compacted_records.append(compacted_record)
+
+        self.tokens_before += self.tokenizer.count(json.dumps(records, default=str))
+        self.tokens_after += self.tokenizer.count(json.dumps(compacted_records))
+
+        return compacted_records
+
+
+    def get_caption(self, record: dict) -> str:
+        """
+        Get the semantic captions of a search result.
+
+        Args:
+            record (dict): The search result.
+
+        Returns:
+            str: The text of the captions, or None if there are no captions.
+        """
+        if not self.use_captions:
+            return None
+
+        captions = record.get('@search.captions') or []
+        texts = [
+            caption.get('text') if isinstance(caption, dict) else getattr(caption, 'text', None)
+            for caption in captions
+        ]
+
+        return ' '.join(text for text in texts if text) or None
+
+
+    def get_shingles(self, text: str) -> set:
+        """
+        Get the word 3-grams of a text, used to detect near-identical results.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            set: The word 3-grams (or the words, for texts shorter than 3 words).
+        """
+        words = re.findall(r'\w+', text.lower())
+        if len(words) < 3:
+            return set(words)
+        return set(zip(words, words[1:], words[2:]))
+
+
+    def get_similarity(self, shingles: set, other_shingles: set) -> float:
+        """
+        Get the Jaccard similarity of two sets of shingles.
+
+        Args:
+            shingles (set): The shingles of the first text.
+            other_shingles (set): The shingles of the second text.
+
+        Returns:
+            float: The similarity, between 0 and 1.
+        """
+        return len(shingles & other_shingles) / len(shingles | other_shingles)
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the compaction counters.
+
+        Returns:
+            dict: The prompt tokens before and after compaction, the tokens saved, and the deduplicated and truncated results.
+        """
+        return {
+            'tokens_before': self.tokens_before,
+            'tokens_after': self.tokens_after,
+            'tokens_saved': self.tokens_before - self.tokens_after,
+            'deduplicated': self.deduplicated,
+            'truncated': self.truncated
+        }
@@ -1,38 +1,34 @@
 import uuid
 
-from azure.cosmos import CosmosClient
-from backend.config.models import ChatHistoryItem, FeedbackRequest, FeedbackResponse
+from azure.cosmos import CosmosClient, exceptions
+from azure.cosmos.aio import CosmosClient as AsyncCosmosClient
+from backend.config.models import ChatHistoryItem, ChatSummaryItem, FeedbackRequest, FeedbackResponse
 from backend.config import environment
+from backend.services.clients import ClientRegistry
+from backend.services.telemetry import telemetry
 
 
-class ChatHistoryDatabase():
+class ChatHistoryDatabaseBase():
     """
-    A class that represents a database for storing and retrieving chat history.
+    Base class with the queries and documents shared by the synchronous and asyncio chat history databases.
     """
-    
-    def __init__(self):
-        self.client = CosmosClient(
-            environment.AZURE_COSMOS_ENDPOINT,
-            environment.AZURE_COSMOS_KEY
-        )
-        self.client_db = self.client.get_database_client(environment.AZURE_COSMOS_DATABASE)
-        self.client_db_container = self.client_db.get_container_client(environment.AZURE_COSMOS_CONTAINER)
-
 
-    def load_chat_history(self, session_id: str, max_results: int = 5) -> list:
+    def get_chat_history_query(self, session_id: str, max_results: int) -> dict:
         """
-        Load chat history for a given session ID.
+        Builds the query to load the most recent chat history records of a session.
+
+        Only the fields replayed into the prompts are projected, and the conversation summary
+        item stored in the same partition is excluded.
 
         Args:
             session_id (str): The ID of the session for which to load the chat history.
-            max_results (int, optional): The maximum number of chat history records to retrieve. Defaults to 5.
+            max_results (int): The maximum number of chat history records to retrieve.
 
         Returns:
-            list: A list of chat history prompts from the database.
-
+            dict: The query text and parameters.
         """
-        chat_history = list(self.client_db_container.query_items(
-            query="SELECT * FROM c WHERE c.session_id=@session_id_param ORDER BY c._ts DESC OFFSET 0 LIMIT @max_results_param",
+        return dict(
+            query="SELECT c.id, c.user_prompt, c.assistant_response FROM c WHERE c.session_id=@session_id_param AND NOT IS_DEFINED(c.type) ORDER BY c._ts DESC OFFSET 0 LIMIT @max_results_param",
             parameters=[
                 {
                     "name": "@session_id_param",
@@ -42,16 +38,163 @@ class ChatHistoryDatabase():
                     "name": "@max_results_param",
                     "value": max_results
                 }
+            ]
+        )
+
+
+    def get_chat_history_item(self, session_id: str, user_prompt: str, assistant_response: str, total_tokens: int, id: str = None) -> ChatHistoryItem:
+        """
+        Builds a chat history item.
+
+        Args:
+            session_id (str): The ID of the chat session.
+            user_prompt (str): The user's prompt.
+            assistant_response (str): The assistant's response.
+            total_tokens (int): The total number of tokens used in the chat turn.
+            id (str, optional): The ID of the chat history item. A new ID is generated if not provided.
+
+        Returns:
+            ChatHistoryItem: The chat history item.
+        """
+        return ChatHistoryItem(
+            id=id if id else str(uuid.uuid4()),
+            session_id=session_id,
+            user_prompt=user_prompt,
+            assistant_response=assistant_response,
+            total_tokens=total_tokens
+        )
+
+
+    def get_feedback_patch(self, request: FeedbackRequest) -> dict:
+        """
+        Builds the partial update of the feedback rating of a chat history item.
+
+        The patch fails if the item does not exist (404) or is not a chat history item (412).
+
+        Args:
+            request (FeedbackRequest): The feedback request object containing the feedback ID, session ID, and feedback rating.
+
+        Returns:
+            dict: The patch arguments.
+        """
+        return dict(
+            item=request.id,
+            partition_key=request.session_id,
+            patch_operations=[
+                {
+                    "op": "set",
+                    "path": "/feedback_rating",
+                    "value": request.feedback_rating
+                }
             ],
+            filter_predicate="FROM c WHERE NOT IS_DEFINED(c.type)",
+            no_response=True
+        )
+
+
+    def get_total_tokens_patch(self, session_id: str, id: str, total_tokens: int) -> dict:
+        """
+        Builds the partial update of the total number of tokens of a chat history item.
+
+        Args:
+            session_id (str): The ID of the chat session.
+            id (str): The ID of the chat history item.
+            total_tokens (int): The total number of tokens used in the chat turn.
+
+        Returns:
+            dict: The patch arguments.
+        """
+        return dict(
+            item=id,
+            partition_key=session_id,
+            patch_operations=[
+                {
+                    "op": "set",
+                    "path": "/total_tokens",
+                    "value": total_tokens
+                }
+            ],
+            filter_predicate="FROM c WHERE NOT IS_DEFINED(c.type)",
+            no_response=True
+        )
+
+
+    def get_chat_summary_item(self, session_id: str, summary: str, last_turn_id: str, total_tokens: int) -> ChatSummaryItem:
+        """
+        Builds the conversation summary item of a session.
+
+        Args:
+            session_id (str): The ID of the chat session.
+            summary (str): The summary of the conversation turns folded so far.
+            last_turn_id (str): The ID of the most recent chat history item folded into the summary.
+            total_tokens (int): The total number of tokens used to generate the summary.
+
+        Returns:
+            ChatSummaryItem: The chat summary item.
+        """
+        return ChatSummaryItem(
+            id=self.get_chat_summary_id(session_id),
+            session_id=session_id,
+            type='summary',
+            summary=summary,
+            last_turn_id=last_turn_id,
+            total_tokens=total_tokens
+        )
+
+
+    def get_chat_summary_id(self, session_id: str) -> str:
+        """
+        Get the ID of the conversation summary item of a session.
+
+        Args:
+            session_id (str): The ID of the chat session.
+
+        Returns:
+            str: The ID of the chat summary item.
+        """
+        return f"summary-{session_id}"
+
+
+class ChatHistoryDatabase(ChatHistoryDatabaseBase):
+    """
+    A class that represents a database for storing and retrieving chat history.
+    """
+
+    def __init__(self, clients: ClientRegistry = None):
+        if clients:
+            self.client_db_container = clients.cosmos_container
+        else:
+            self.client = CosmosClient(
+                environment.AZURE_COSMOS_ENDPOINT,
+                environment.AZURE_COSMOS_KEY
+            )
+            self.client_db = self.client.get_database_client(environment.AZURE_COSMOS_DATABASE)
+            self.client_db_container = self.client_db.get_container_client(environment.AZURE_COSMOS_CONTAINER)
+
+
+    def load_chat_history(self, session_id: str, max_results: int = 5) -> list:
+        """
+        Load chat history for a given session ID.
+
+        Args:
+            session_id (str): The ID of the session for which to load the chat history.
+            max_results (int, optional): The maximum number of chat history records to retrieve. Defaults to 5.
+
+        Returns:
+            list: A list of chat history prompts from the database.
+
+        """
+        chat_history = list(self.client_db_container.query_items(
+            **self.get_chat_history_query(session_id, max_results),
             enable_cross_partition_query=False
         ))
 
         if len(chat_history) > 1: chat_history.reverse()
-        
+
         return chat_history
 
 
-    def write_chat_history(self, session_id: str, user_prompt: str, assistant_response: str, total_tokens: int, id: str = str(uuid.uuid4())) -> str:
+    def write_chat_history(self, session_id: str, user_prompt: str, assistant_response: str, total_tokens: int, id: str = None) -> str:
         """
         Writes the chat history to the database.
 
@@ -63,13 +206,7 @@ class ChatHistoryDatabase():
         Returns:
             str: The ID of the chat history item.
         """
-        chat_history_item = ChatHistoryItem(
-            id=id,
-            session_id=session_id,
-            user_prompt=user_prompt,
-            assistant_response=assistant_response,
-            total_tokens=total_tokens
-        )
+        chat_history_item = self.get_chat_history_item(session_id, user_prompt, assistant_response, total_tokens, id)
 
         self.client_db_container.upsert_item(chat_history_item)
 
@@ -86,10 +223,195 @@ class ChatHistoryDatabase():
         Returns:
             FeedbackResponse: The response indicating the success of the feedback update.
         """
-        item = self.client_db_container.read_item(item=request.id, partition_key=request.session_id)
-        item['feedback_rating'] = request.feedback_rating
+        self.client_db_container.patch_item(**self.get_feedback_patch(request))
+
+        response = FeedbackResponse(
+            status = "Feedback updated successfully"
+        )
+
+        return response
+
+
+class AsyncChatHistoryDatabase(ChatHistoryDatabaseBase):
+    """
+    A class that represents a database for storing and retrieving chat history, using the asyncio Cosmos DB client.
+    """
+
+    def __init__(self, clients: ClientRegistry = None):
+        if clients:
+            self.client_db_container = clients.async_cosmos_container
+        else:
+            self.client = AsyncCosmosClient(
+                environment.AZURE_COSMOS_ENDPOINT,
+                environment.AZURE_COSMOS_KEY
+            )
+            self.client_db = self.client.get_database_client(environment.AZURE_COSMOS_DATABASE)
+            self.client_db_container = self.client_db.get_container_client(environment.AZURE_COSMOS_CONTAINER)
+        self.history_cache = clients.history_cache if clients else None
+        self.history_writer = clients.history_writer if clients else None
+
+
+    async def load_chat_history(self, session_id: str, max_results: int = 5) -> list:
+        """
+        Load chat history for a given session ID.
 
-        self.client_db_container.upsert_item(item)
+        Args:
+            session_id (str): The ID of the session for which to load the chat history.
+            max_results (int, optional): The maximum number of chat history records to retrieve. Defaults to 5.
+
+        Returns:
+            list: A list of chat history prompts from the history cache, or from the database on a cache miss.
+        """
+        if self.history_cache:
+            chat_history = await self.history_cache.get(session_id, max_results)
+            if chat_history is not None:
+                return chat_history
+
+        with telemetry.span('cosmos_query'):
+            chat_history = [item async for item in self.client_db_container.query_items(
+                **self.get_chat_history_query(session_id, max_results),
+                partition_key=session_id,
+                response_hook=telemetry.get_request_charge_hook('query_chat_history')
+            )]
+
+        if len(chat_history) > 1: chat_history.reverse()
+
+        # Add the items not yet written by the write-behind queue
+        if self.history_writer:
+            turn_ids = [item['id'] for item in chat_history]
+            chat_history += [
+                {'id': item['id'], 'user_prompt': item['user_prompt'], 'assistant_response': item['assistant_response']}
+                for item in self.history_writer.get_pending(session_id) if item['id'] not in turn_ids
+            ]
+            chat_history = chat_history[-max_results:]
+
+        if self.history_cache:
+            await self.history_cache.set(session_id, chat_history, max_results)
+
+        return chat_history
+
+
+    async def write_chat_history(self, session_id: str, user_prompt: str, assistant_response: str, total_tokens: int, id: str = None) -> str:
+        """
+        Writes the chat history to the database.
+
+        Args:
+            session_id (str): The ID of the chat session.
+            user_prompt (str): The user's prompt.
+            assistant_response (str): The assistant's response.
+            total_tokens (int): The total number of tokens used in the chat turn.
+            id (str, optional): The ID of the chat history item. A new ID is generated if not provided.
+
+        Returns:
+            str: The ID of the chat history item.
+        """
+        chat_history_item = self.get_chat_history_item(session_id, user_prompt, assistant_response, total_tokens, id)
+
+        if self.history_writer:
+            await self.history_writer.put(chat_history_item)
+        else:
+            with telemetry.span('cosmos_upsert'):
+                await self.client_db_container.upsert_item(
+                    chat_history_item,
+                    response_hook=telemetry.get_request_charge_hook('upsert_chat_history')
+                )
+
+        # Update the history cache once the item is written or queued (write-through)
+        if self.history_cache:
+            await self.history_cache.append(chat_history_item)
+
+        return chat_history_item['id']
+
+
+    async def update_total_tokens(self, session_id: str, id: str, total_tokens: int) -> None:
+        """
+        Update the total number of tokens of a chat history item, with the tokens used after it was written.
+
+        Args:
+            session_id (str): The ID of the chat session.
+            id (str): The ID of the chat history item.
+            total_tokens (int): The total number of tokens used in the chat turn.
+        """
+        # Update the item in the write-behind queue if it is not written yet, otherwise patch it in the database
+        if not (self.history_writer and await self.history_writer.update(id, {'total_tokens': total_tokens})):
+            with telemetry.span('cosmos_patch'):
+                await self.client_db_container.patch_item(
+                    **self.get_total_tokens_patch(session_id, id, total_tokens),
+                    response_hook=telemetry.get_request_charge_hook('patch_total_tokens')
+                )
+
+
+    async def load_chat_summary(self, session_id: str) -> ChatSummaryItem:
+        """
+        Load the conversation summary of a session.
+
+        Args:
+            session_id (str): The ID of the chat session.
+
+        Returns:
+            ChatSummaryItem: The chat summary item, or None if the session has no summary.
+        """
+        if self.history_cache:
+            chat_summary = await self.history_cache.get_summary(session_id)
+            if chat_summary is not None:
+                return chat_summary or None
+
+        try:
+            with telemetry.span('cosmos_read'):
+                chat_summary = await self.client_db_container.read_item(
+                    item=self.get_chat_summary_id(session_id),
+                    partition_key=session_id,
+                    response_hook=telemetry.get_request_charge_hook('read_chat_summary')
+                )
+        except exceptions.CosmosResourceNotFoundError:
+            chat_summary = None
+
+        if self.history_cache:
+            await self.history_cache.set_summary(session_id, {
+                key: chat_summary.get(key) for key in ChatSummaryItem.__annotations__
+            } if chat_summary else {})
+
+        return chat_summary
+
+
+    async def write_chat_summary(self, session_id: str, summary: str, last_turn_id: str, total_tokens: int) -> None:
+        """
+        Writes the conversation summary of a session to the database.
+
+        Args:
+            session_id (str): The ID of the chat session.
+            summary (str): The summary of the conversation turns folded so far.
+            last_turn_id (str): The ID of the most recent chat history item folded into the summary.
+            total_tokens (int): The total number of tokens used to generate the summary.
+        """
+        chat_summary_item = self.get_chat_summary_item(session_id, summary, last_turn_id, total_tokens)
+
+        await self.client_db_container.upsert_item(
+            chat_summary_item,
+            response_hook=telemetry.get_request_charge_hook('upsert_chat_summary')
+        )
+
+        if self.history_cache:
+            await self.history_cache.set_summary(session_id, dict(chat_summary_item))
+
+
+    async def update_feedback(self, request: FeedbackRequest) -> FeedbackResponse:
+        """
+        Update the feedback rating for a given feedback item.
+
+        Args:
+            request (FeedbackRequest): The feedback request object containing the feedback ID, session ID, and feedback rating.
+
+        Returns:
+            FeedbackResponse: The response indicating the success of the feedback update.
+        """
+        # Update the item in the write-behind queue if it is not written yet, otherwise patch it in the database
+        if not (self.history_writer and await self.history_writer.update(request.id, {'feedback_rating': request.feedback_rating})):
+            with telemetry.span('cosmos_patch'):
+                await self.client_db_container.patch_item(
+                    **self.get_feedback_patch(request),
+                    response_hook=telemetry.get_request_charge_hook('patch_feedback')
+                )
 
         response = FeedbackResponse(
             status = "Feedback updated successfully"
@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import time
+
+from collections import OrderedDict
+from backend.config import environment
+from backend.services.cache import SharedCacheTier
+
+
+class FollowupStore():
+    """
+    A bounded in-process store of follow-up questions generated in the background, keyed by response ID.
+
+    With a shared tier, the state of each entry (pending, then the follow-up questions) is also kept in the
+    shared tier, so that the follow-up questions can be fetched from any application instance.
+    """
+
+    # Interval between the reads of a pending entry of the shared tier, when waiting for it, in seconds
+    poll_interval = 0.2
+
+    def __init__(self, shared_tier: SharedCacheTier = None,
+                 max_entries: int = environment.FOLLOWUP_MAX_ENTRIES,
+                 ttl: float = environment.FOLLOWUP_TTL):
+        self.shared_tier = shared_tier
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tasks = OrderedDict()
+        self.running = set()
+
+
+    async def schedule(self, response_id: str, coroutine) -> None:
+        """
+        Schedule the generation of follow-up questions in the background.
+
+        Args:
+            response_id (str): The ID of the response the follow-up questions belong to.
+            coroutine (Coroutine): The coroutine generating the follow-up questions.
+        """
+        self.evict()
+
+        # The entry is pending in the shared tier before the response is returned
+        await self.set_shared(response_id, True, {})
+
+        task = asyncio.create_task(self.run(response_id, coroutine))
+        task.add_done_callback(self.log_task_error)
+
+        # Keep a strong reference to running tasks, even after their entry is evicted
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+        self.tasks.pop(response_id, None)
+        self.tasks[response_id] = (time.monotonic() + self.ttl, task)
+
+        # Drop the oldest entries when the store is full (running tasks are left to complete)
+        while len(self.tasks) > self.max_entries:
+            self.tasks.popitem(last=False)
+
+
+    async def get(self, response_id: str, timeout: float = 0):
+        """
+        Get the follow-up questions for a given response ID.
+
+        Args:
+            response_id (str): The ID of the response.
+            timeout (float, optional): The maximum time to wait for pending follow-up questions, in seconds. Defaults to 0.
+
+        Returns:
+            tuple: A (found, pending, followup_questions) tuple.
+        """
+        self.evict()
+
+        if response_id not in self.tasks:
+            return await self.get_shared(response_id, timeout)
+
+        _, task = self.tasks[response_id]
+
+        if not task.done() and timeout > 0:
+            await asyncio.wait({task}, timeout=timeout)
+
+        if not task.done():
+            return True, True, {}
+
+        if task.cancelled() or task.exception():
+            return True, False, {}
+
+        return True, False, task.result()
+
+
+    async def run(self, response_id: str, coroutine) -> dict:
+        """
+        Generate the follow-up questions, and store them in the shared tier.
+
+        Args:
+            response_id (str): The ID of the response the follow-up questions belong to.
+            coroutine (Coroutine): The coroutine generating the follow-up questions.
+
+        Returns:
+            dict: The follow-up questions.
+        """
+        followup_questions = {}
+        try:
+            followup_questions = await coroutine
+            return followup_questions
+        finally:
+            await self.set_shared(response_id, False, followup_questions)
+
+
+    async def get_shared(self, response_id: str, timeout: float = 0) -> tuple:
+        """
+        Get the follow-up questions of a response from the shared tier, generated by another application instance.
+
+        Args:
+            response_id (str): The ID of the response.
+            timeout (float, optional): The maximum time to wait for pending follow-up questions, in seconds. Defaults to 0.
+
+        Returns:
+            tuple: A (found, pending, followup_questions) tuple.
+        """
+        if not self.shared_tier:
+            return False, False, {}
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                value = await self.shared_tier.get(self.get_key(response_id))
+            except Exception as e:
+                logging.warning(f"Error reading the shared follow-up store: {e}")
+                value = None
+
+            if value is None:
+                return False, False, {}
+
+            entry = json.loads(value)
+            if not entry['pending'] or time.monotonic() >= deadline:
+                return True, entry['pending'], entry['followup_questions']
+
+            await asyncio.sleep(min(self.poll_interval, deadline - time.monotonic()))
+
+
+    async def set_shared(self, response_id: str, pending: bool, followup_questions: dict) -> None:
+        """
+        Set the state of an entry in the shared tier.
+
+        Args:
+            response_id (str): The ID of the response.
+            pending (bool): Whether the follow-up questions are being generated.
+            followup_questions (dict): The follow-up questions.
+        """
+        if not self.shared_tier:
+            return
+
+        try:
+            value = json.dumps({'pending': pending, 'followup_questions': followup_questions})
+            await self.shared_tier.set(self.get_key(response_id), value.encode('utf-8'), self.ttl)
+        except Exception as e:
+            logging.warning(f"Error writing the shared follow-up store: {e}")
+
+
+    def get_key(self, response_id: str) -> str:
+        """
+        Get the shared tier key of the follow-up questions of a response.
+
+        Args:
+            response_id (str): The ID of the response.
+
+        Returns:
+            str: The cache key.
+        """
+        return f"followups:{response_id}"
+
+
+    def evict(self) -> None:
+        """
+        Remove the expired entries from the store.
+        """
+        now = time.monotonic()
+        while self.tasks:
+            expires, _ = next(iter(self.tasks.values()))
+            if expires > now:
+                break
+            self.tasks.popitem(last=False)
+
+
+    def close(self) -> None:
+        """
+        Cancel all pending follow-up question tasks.
+        """
+        for task in self.running:
+            task.cancel()
+        self.tasks.clear()
+
+
+    def log_task_error(self, task: asyncio.Task) -> None:
+        """
+        Log the error of a failed follow-up questions task.
+
+        Args:
+            task (asyncio.Task): The completed task.
+        """
+        if not task.cancelled() and task.exception():
+            logging.error(f"Error generating follow-up questions: {task.exception()}")
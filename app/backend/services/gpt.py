@@ -1,55 +1,131 @@
-from openai import AzureOpenAI
+from openai import AzureOpenAI, AsyncAzureOpenAI
+from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall, Function
 from backend.config import environment
 from backend.config import prompts
 from backend.config.models import GptModelResponse
+from backend.services.clients import ClientRegistry
+from backend.services.ratelimit import Priority, estimate_tokens
+from backend.services.telemetry import telemetry
 
-class GptModel():
+
+class GptModelBase():
     """
-    A class that provides AI services using GPT models.
+    Base class with the request and response handling shared by the synchronous and asyncio GPT models.
     """
 
     def __init__(self, user_id: str = None):
-
         self.user_id = user_id
-        
-        self.client = AzureOpenAI(
-            api_key = environment.AZURE_OPENAI_API_KEY,
-            azure_endpoint = environment.AZURE_OPENAI_ENDPOINT,
-            api_version = environment.AZURE_OPENAI_API_VERSION
-        )
         self.model_chat = environment.AZURE_OPENAI_API_MODEL_CHAT
         self.model_embedding = environment.AZURE_OPENAI_API_MODEL_EMBEDDING
+        self.model_followup = environment.AZURE_OPENAI_API_MODEL_FOLLOWUP
+        self.model_summary = environment.AZURE_OPENAI_API_MODEL_SUMMARY
 
-    def call_gpt_model(self, messages: list) -> GptModelResponse:
+
+    def get_completion_args(self, messages: list, tools: bool = False, stream: bool = False, model: str = None, tool_choice: str = "auto") -> dict:
         """
-        Calls the GPT model to generate a response based on the given messages.
+        Builds the arguments of a chat completion request.
+
+        The tools functions are part of the prompt prefix cached by the model: they are also sent with
+        tool_choice "none" on the calls answering from the tool responses, so that all the calls of a chat
+        turn share the same prefix.
 
         Args:
             messages (list): A list of messages exchanged between the user and the model.
+            tools (bool, optional): Whether the tools functions should be sent to the model. Defaults to False.
+            stream (bool, optional): Whether the response should be streamed, including the usage totals. Defaults to False.
+            model (str, optional): The model deployment to use. Defaults to the chat model deployment.
+            tool_choice (str, optional): Whether the model may call the tools functions ("auto") or not ("none"). Defaults to "auto".
 
         Returns:
-            GptModelResponse: The response from the GPT model, containing the generated content and other information.
+            dict: The chat completion request arguments.
         """
-        request = self.client.chat.completions.create(
-            model=self.model_chat,
+        args = dict(
+            model=model if model else self.model_chat,
             temperature=0.7,
             max_tokens=1000,
-            stream=False,
+            stream=stream,
             user=self.user_id,
             messages=messages
         )
 
-        response = GptModelResponse(
+        if stream:
+            args['stream_options'] = {"include_usage": True}
+
+        if tools:
+            args['tool_choice'] = tool_choice
+            args['tools'] = prompts.get_tools_functions()
+
+        return args
+
+
+    def get_model_response(self, request) -> GptModelResponse:
+        """
+        Converts a chat completion into a GPT model response.
+
+        Args:
+            request (ChatCompletion): The chat completion returned by the model.
+
+        Returns:
+            GptModelResponse: The response from the GPT model, containing the generated content and other information.
+        """
+        return GptModelResponse(
             id = request.id,
             model = request.model,
             content = request.choices[0].message.content,
-            tool_calls = [],
+            tool_calls = request.choices[0].message.tool_calls if request.choices[0].message.tool_calls else [],
             completion_tokens = request.usage.completion_tokens,
             prompt_tokens = request.usage.prompt_tokens,
-            total_tokens = request.usage.total_tokens
+            total_tokens = request.usage.total_tokens,
+            cached_tokens = self.get_cached_tokens(request.usage)
         )
 
-        return response
+
+    def get_cached_tokens(self, usage) -> int:
+        """
+        Get the number of prompt tokens served from the prompt cache of the model.
+
+        Args:
+            usage (CompletionUsage): The usage of a chat completion.
+
+        Returns:
+            int: The number of cached tokens (0 when not reported).
+        """
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return getattr(details, 'cached_tokens', None) or 0
+
+
+class GptModel(GptModelBase):
+    """
+    A class that provides AI services using GPT models.
+    """
+
+    def __init__(self, user_id: str = None, clients: ClientRegistry = None):
+        super().__init__(user_id)
+
+        if clients:
+            self.client = clients.openai_client
+        else:
+            self.client = AzureOpenAI(
+                api_key = environment.AZURE_OPENAI_API_KEY,
+                azure_endpoint = environment.AZURE_OPENAI_ENDPOINT,
+                api_version = environment.AZURE_OPENAI_API_VERSION
+            )
+
+
+    def call_gpt_model(self, messages: list, model: str = None, tools: bool = False) -> GptModelResponse:
+        """
+        Calls the GPT model to generate a response based on the given messages.
+
+        Args:
+            messages (list): A list of messages exchanged between the user and the model.
+            model (str, optional): The model deployment to use. Defaults to the chat model deployment.
+            tools (bool, optional): Whether the tools functions should be sent (without being called) to share the prompt prefix of the tools calls. Defaults to False.
+
+        Returns:
+            GptModelResponse: The response from the GPT model, containing the generated content and other information.
+        """
+        request = self.client.chat.completions.create(**self.get_completion_args(messages, tools=tools, model=model, tool_choice="none"))
+        return self.get_model_response(request)
 
 
     def call_gpt_model_tools(self, messages: list) -> GptModelResponse:
@@ -61,29 +137,9 @@ class GptModel():
 
         Returns:
             GptModelResponse: The response from the GPT model, containing the generated content and other information.
-        """        
-        request = self.client.chat.completions.create(
-            model=self.model_chat,
-            temperature=0.7,
-            max_tokens=1000,
-            stream=False,
-            user=self.user_id,
-            messages=messages,
-            tool_choice="auto",
-            tools=prompts.get_tools_functions()
-        )
-
-        response = GptModelResponse(
-            id = request.id,
-            model = request.model,
-            content = request.choices[0].message.content,
-            tool_calls = request.choices[0].message.tool_calls if request.choices[0].message.tool_calls else [],
-            completion_tokens = request.usage.completion_tokens,
-            prompt_tokens = request.usage.prompt_tokens,
-            total_tokens = request.usage.total_tokens
-        )
-
-        return response
+        """
+        request = self.client.chat.completions.create(**self.get_completion_args(messages, tools=True))
+        return self.get_model_response(request)
 
 
     def generate_embeddings(self, text: str) -> list:
@@ -101,3 +157,285 @@ class GptModel():
             input=text
         )
         return response.data[0].embedding
+
+
+    def generate_embeddings_batch(self, texts: list) -> list:
+        """
+        Generate embeddings for a list of texts in a single request.
+
+        Args:
+            texts (list): The input texts to generate embeddings for.
+
+        Returns:
+            list: The generated embeddings, in the same order as the input texts.
+        """
+        if not texts:
+            return []
+
+        response = self.client.embeddings.create(
+            model=self.model_embedding,
+            input=texts
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+class AsyncGptModel(GptModelBase):
+    """
+    A class that provides AI services using GPT models, using the asyncio Azure OpenAI client.
+    """
+
+    def __init__(self, user_id: str = None, clients: ClientRegistry = None):
+        super().__init__(user_id)
+
+        self.embedding_cache = clients.embedding_cache if clients else None
+        self.scheduler = clients.openai_scheduler if clients else None
+        self.backends = clients.openai_backends if clients else None
+
+        if clients:
+            self.client = clients.async_openai_client
+        else:
+            self.client = AsyncAzureOpenAI(
+                api_key = environment.AZURE_OPENAI_API_KEY,
+                azure_endpoint = environment.AZURE_OPENAI_ENDPOINT,
+                api_version = environment.AZURE_OPENAI_API_VERSION
+            )
+
+
+    def record_usage(self, response: GptModelResponse, model: str) -> GptModelResponse:
+        """
+        Record the token usage of a GPT model response in the telemetry metrics.
+
+        Args:
+            response (GptModelResponse): The GPT model response.
+            model (str): The model deployment.
+
+        Returns:
+            GptModelResponse: The GPT model response.
+        """
+        telemetry.record_tokens(model, response['prompt_tokens'], response['completion_tokens'], response['cached_tokens'])
+        return response
+
+
+    async def create_chat_completion(self, args: dict, priority: Priority = Priority.INTERACTIVE):
+        """
+        Sends a chat completion request, through the rate limit scheduler and the backend pool when enabled.
+
+        Args:
+            args (dict): The chat completion request arguments.
+            priority (Priority, optional): The priority of the request. Defaults to INTERACTIVE.
+
+        Returns:
+            ChatCompletion: The chat completion (or the stream of chunks, for streamed requests).
+        """
+        return await self.send(
+            args['model'],
+            estimate_tokens(args['messages'], args['max_tokens']),
+            lambda client, deployment: client.chat.completions.create(**dict(args, model=deployment)),
+            priority
+        )
+
+
+    async def create_embeddings(self, input):
+        """
+        Sends an embeddings request, through the rate limit scheduler and the backend pool when enabled.
+
+        Args:
+            input (str | list): The input text or texts.
+
+        Returns:
+            CreateEmbeddingResponse: The embeddings.
+        """
+        return await self.send(
+            self.model_embedding,
+            estimate_tokens(texts=input if isinstance(input, list) else [input]),
+            lambda client, deployment: client.embeddings.create(model=deployment, input=input)
+        )
+
+
+    async def send(self, model: str, tokens: int, call, priority: Priority = Priority.INTERACTIVE):
+        """
+        Sends a request to the model deployment, through the rate limit scheduler and the backend pool when enabled.
+
+        Args:
+            model (str): The model deployment.
+            tokens (int): The estimated number of tokens of the request.
+            call (Callable): The function returning the awaitable of the request, given the client and the deployment name.
+            priority (Priority, optional): The priority of the request. Defaults to INTERACTIVE.
+
+        Returns:
+            Any: The response of the request.
+        """
+        # The backend pool admits the requests of each backend deployment, and retries them itself
+        if self.backends:
+            return await self.backends.run(model, tokens, call, self.scheduler, priority)
+
+        if not self.scheduler:
+            return await call(self.client, model)
+
+        return await self.scheduler.run(model, tokens, lambda: call(self.client, model), priority)
+
+
+    async def call_gpt_model(self, messages: list, model: str = None, priority: Priority = Priority.INTERACTIVE, tools: bool = False) -> GptModelResponse:
+        """
+        Calls the GPT model to generate a response based on the given messages.
+
+        Args:
+            messages (list): A list of messages exchanged between the user and the model.
+            model (str, optional): The model deployment to use. Defaults to the chat model deployment.
+            priority (Priority, optional): The priority of the request, when the deployment quota is exhausted. Defaults to INTERACTIVE.
+            tools (bool, optional): Whether the tools functions should be sent (without being called) to share the prompt prefix of the tools calls. Defaults to False.
+
+        Returns:
+            GptModelResponse: The response from the GPT model, containing the generated content and other information.
+        """
+        args = self.get_completion_args(messages, tools=tools, model=model, tool_choice="none")
+
+        with telemetry.span('openai_chat', model=args['model']):
+            request = await self.create_chat_completion(args, priority)
+
+        return self.record_usage(self.get_model_response(request), args['model'])
+
+
+    async def call_gpt_model_tools(self, messages: list) -> GptModelResponse:
+        """
+        Calls the GPT model with Tools to generate a list of functions and arguments to be called based on the given messages.
+
+        Args:
+            messages (list): A list of messages to be used as input for the GPT model.
+
+        Returns:
+            GptModelResponse: The response from the GPT model, containing the generated content and other information.
+        """
+        args = self.get_completion_args(messages, tools=True)
+
+        with telemetry.span('openai_chat', model=args['model']):
+            request = await self.create_chat_completion(args)
+
+        return self.record_usage(self.get_model_response(request), args['model'])
+
+
+    async def generate_embeddings(self, text: str) -> list:
+        """
+        Generate embeddings for the given text.
+
+        Args:
+            text (str): The input text to generate embeddings for.
+
+        Returns:
+            list: The generated embeddings for the input text.
+        """
+        if self.embedding_cache:
+            return (await self.generate_embeddings_batch([text]))[0]
+
+        with telemetry.span('openai_embeddings', model=self.model_embedding, inputs=1):
+            response = await self.create_embeddings(text)
+        return response.data[0].embedding
+
+
+    async def generate_embeddings_batch(self, texts: list) -> list:
+        """
+        Generate embeddings for a list of texts in a single request.
+
+        Args:
+            texts (list): The input texts to generate embeddings for.
+
+        Returns:
+            list: The generated embeddings, in the same order as the input texts.
+        """
+        if not texts:
+            return []
+
+        if not self.embedding_cache:
+            with telemetry.span('openai_embeddings', model=self.model_embedding, inputs=len(texts)):
+                response = await self.create_embeddings(texts)
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+        # Only request the embeddings of the texts not found in the cache (once per distinct text)
+        embeddings = await self.embedding_cache.get_many(self.model_embedding, texts)
+        missing_texts = list(dict.fromkeys(text for text, embedding in zip(texts, embeddings) if embedding is None))
+
+        if missing_texts:
+            with telemetry.span('openai_embeddings', model=self.model_embedding, inputs=len(missing_texts)):
+                response = await self.create_embeddings(missing_texts)
+            missing_embeddings = [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            await self.embedding_cache.set_many(self.model_embedding, missing_texts, missing_embeddings)
+
+            generated = dict(zip(missing_texts, missing_embeddings))
+            embeddings = [embedding if embedding is not None else generated[text] for text, embedding in zip(texts, embeddings)]
+
+        return embeddings
+
+
+    async def stream_gpt_model(self, messages: list, tools: bool = False, tool_choice: str = "auto"):
+        """
+        Calls the GPT model and streams the response as it is generated.
+
+        Args:
+            messages (list): A list of messages exchanged between the user and the model.
+            tools (bool, optional): Whether the tools functions should be sent to the model. Defaults to False.
+            tool_choice (str, optional): Whether the model may call the tools functions ("auto") or not ("none"). Defaults to "auto".
+
+        Yields:
+            tuple: A ('token', str) tuple for each content delta received from the model, followed by a single
+            ('response', GptModelResponse) tuple with the full content, the assembled tool calls and the usage totals.
+        """
+        args = self.get_completion_args(messages, tools=tools, stream=True, tool_choice=tool_choice)
+
+        response = GptModelResponse(
+            id = None,
+            model = None,
+            content = '',
+            tool_calls = [],
+            completion_tokens = 0,
+            prompt_tokens = 0,
+            total_tokens = 0,
+            cached_tokens = 0
+        )
+        tool_calls = {}
+
+        # The span is not made current, since it spans the yield statements of the generator
+        with telemetry.span('openai_chat', current=False, model=args['model'], stream=True):
+            request = await self.create_chat_completion(args)
+
+            async for chunk in request:
+                if chunk.id and not response['id']:
+                    response['id'] = chunk.id
+
+                if chunk.model and not response['model']:
+                    response['model'] = chunk.model
+
+                if chunk.usage:
+                    response['completion_tokens'] = chunk.usage.completion_tokens
+                    response['prompt_tokens'] = chunk.usage.prompt_tokens
+                    response['total_tokens'] = chunk.usage.total_tokens
+                    response['cached_tokens'] = self.get_cached_tokens(chunk.usage)
+
+                if not chunk.choices:
+                    continue
+
+                delta = chunk.choices[0].delta
+
+                if delta.content:
+                    response['content'] += delta.content
+                    yield 'token', delta.content
+
+                # Tool calls are streamed as fragments, identified by their index
+                for tool_call in delta.tool_calls or []:
+                    item = tool_calls.setdefault(tool_call.index, {'id': None, 'name': '', 'arguments': ''})
+                    if tool_call.id:
+                        item['id'] = tool_call.id
+                    if tool_call.function and tool_call.function.name:
+                        item['name'] += tool_call.function.name
+                    if tool_call.function and tool_call.function.arguments:
+                        item['arguments'] += tool_call.function.arguments
+
+        response['tool_calls'] = [
+            ChatCompletionMessageToolCall(
+                id = item['id'],
+                type = 'function',
+                function = Function(name = item['name'], arguments = item['arguments'])
+            )
+            for _, item in sorted(tool_calls.items())
+        ]
+
+        yield 'response', self.record_usage(response, args['model'])
@@ -0,0 +1,412 @@
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import time
+
+from backend.config import environment
+from backend.config.models import SourceDocument
+from backend.services.message import load_tokenizer
+from backend.services.telemetry import telemetry
+
+
+def get_document_text(name: str, data: str) -> str:
+    """
+    Get the plain text of a document (the markup of HTML documents is removed).
+
+    Args:
+        name (str): The file name of the document.
+        data (str): The content of the document.
+
+    Returns:
+        str: The text.
+    """
+    if name.lower().endswith(('.html', '.htm')):
+        data = re.sub(r'(?is)<(script|style)\b.*?</\1>', ' ', data)
+        data = re.sub(r'(?i)<(br|/p|/div|/h[1-6]|/li)\b[^>]*>', '\n\n', data)
+        data = html.unescape(re.sub(r'<[^>]+>', ' ', data))
+    return data
+
+
+def get_document_title(name: str, text: str) -> str:
+    """
+    Get the title of a document: its first Markdown heading, or its file name.
+
+    Args:
+        name (str): The file name of the document.
+        text (str): The text of the document.
+
+    Returns:
+        str: The title.
+    """
+    heading = re.search(r'^#\s+(.+)$', text, re.MULTILINE)
+    if heading:
+        return heading.group(1).strip()
+    return os.path.splitext(os.path.basename(name))[0].replace('-', ' ').replace('_', ' ')
+
+
+class LocalDocumentSource():
+    """
+    Documents read from a local folder (text, Markdown and HTML files).
+    """
+
+    def __init__(self, path: str, base_url: str = None, extensions: list = environment.INGESTION_FILE_EXTENSIONS):
+        self.path = path
+        self.base_url = base_url
+        self.extensions = extensions
+
+
+    async def get_documents(self):
+        """
+        Read the documents, one at a time.
+
+        Yields:
+            SourceDocument: The documents.
+        """
+        for directory, _, file_names in sorted(os.walk(self.path)):
+            for file_name in sorted(file_names):
+                if not file_name.lower().endswith(tuple(self.extensions)):
+                    continue
+
+                file_path = os.path.join(directory, file_name)
+                key = os.path.relpath(file_path, self.path).replace(os.sep, '/')
+
+                with open(file_path, 'r', encoding='utf-8', errors='replace') as file:
+                    text = get_document_text(file_name, file.read())
+
+                yield SourceDocument(
+                    key = key,
+                    title = get_document_title(file_name, text),
+                    url = f"{self.base_url.rstrip('/')}/{key}" if self.base_url else f"file://{os.path.abspath(file_path)}",
+                    text = text
+                )
+
+
+class BlobDocumentSource():
+    """
+    Documents read from an Azure Storage blob container (text, Markdown and HTML blobs).
+    Requires the azure-storage-blob package.
+    """
+
+    def __init__(self, container_name: str, prefix: str = None,
+                 connection_string: str = environment.AZURE_STORAGE_CONNECTION_STRING,
+                 extensions: list = environment.INGESTION_FILE_EXTENSIONS):
+        self.container_name = container_name
+        self.prefix = prefix
+        self.connection_string = connection_string
+        self.extensions = extensions
+
+
+    async def get_documents(self):
+        """
+        Download the documents, one at a time.
+
+        Yields:
+            SourceDocument: The documents.
+        """
+        from azure.storage.blob.aio import ContainerClient
+
+        async with ContainerClient.from_connection_string(self.connection_string, self.container_name) as container:
+            async for blob in container.list_blobs(name_starts_with=self.prefix):
+                if not blob.name.lower().endswith(tuple(self.extensions)):
+                    continue
+
+                stream = await container.download_blob(blob.name)
+                text = get_document_text(blob.name, (await stream.readall()).decode('utf-8', errors='replace'))
+
+                yield SourceDocument(
+                    key = blob.name,
+                    title = get_document_title(blob.name, text),
+                    url = f"{container.url}/{blob.name}",
+                    text = text
+                )
+
+
+class IngestionState():
+    """
+    The state of the ingestion, saved to a local JSON file: the content hash of each chunk in the
+    index, and the chunks of each document. Unchanged chunks are not embedded and uploaded again,
+    and the chunks removed from a document are deleted from the index. The state is checkpointed
+    at most every checkpoint_interval seconds while batches are uploaded (rewriting the whole file
+    after each batch would be quadratic on large corpora), and saved at the end of the run, so that
+    an interrupted run resumes close to where it stopped.
+    """
+
+    def __init__(self, path: str, checkpoint_interval: float = environment.INGESTION_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        self.saved = time.monotonic()
+        self.documents = {}
+        self.chunks = {}
+
+        if path and os.path.exists(path):
+            with open(path, 'r') as file:
+                state = json.load(file)
+            self.documents = state.get('documents', {})
+            self.chunks = state.get('chunks', {})
+
+
+    def save(self) -> None:
+        """
+        Save the state (atomically, so that an interruption does not corrupt it).
+        """
+        if not self.path:
+            return
+
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump({'documents': self.documents, 'chunks': self.chunks}, file)
+        os.replace(temporary_path, self.path)
+        self.saved = time.monotonic()
+
+
+    def checkpoint(self) -> None:
+        """
+        Save the state if it was last saved more than checkpoint_interval seconds ago.
+        """
+        if time.monotonic() - self.saved >= self.checkpoint_interval:
+            self.save()
+
+
+class DocumentIngestor():
+    """
+    Loads documents into the search index.
+
+    Documents are streamed from a source and split into chunks of about chunk_tokens tokens, on
+    paragraph boundaries. The new and changed chunks are embedded in batches through the GPT model,
+    and uploaded with merge_or_upload in batches bounded in number of documents and in size. Up to
+    max_concurrency batches are embedded and uploaded at a time.
+    """
+
+    def __init__(self, gpt_model, search_client, state: IngestionState,
+                 chunk_tokens: int = environment.INGESTION_CHUNK_TOKENS,
+                 embedding_batch_size: int = environment.INGESTION_EMBEDDING_BATCH_SIZE,
+                 upload_batch_size: int = environment.INGESTION_UPLOAD_BATCH_SIZE,
+                 upload_max_bytes: int = environment.INGESTION_UPLOAD_MAX_BYTES,
+                 max_concurrency: int = environment.INGESTION_MAX_CONCURRENCY):
+        self.gpt_model = gpt_model
+        self.search_client = search_client
+        self.state = state
+        self.chunk_tokens = chunk_tokens
+        self.embedding_batch_size = embedding_batch_size
+        self.upload_batch_size = upload_batch_size
+        self.upload_max_bytes = upload_max_bytes
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.tokenizer = load_tokenizer()
+        self.tasks = set()
+        self.stats = {'documents': 0, 'chunks': 0, 'unchanged': 0, 'uploaded': 0, 'failed': 0, 'deleted': 0}
+
+
+    async def ingest(self, source, delete_missing: bool = False) -> dict:
+        """
+        Ingest the documents of a source.
+
+        Args:
+            source (LocalDocumentSource | BlobDocumentSource): The source of the documents.
+            delete_missing (bool, optional): Whether to delete from the index the documents of previous runs no longer in the source.
+
+        Returns:
+            dict: The number of documents and chunks, and of unchanged, uploaded, failed and deleted chunks.
+        """
+        keys = set()
+        pending = []
+
+        try:
+            async for document in source.get_documents():
+                keys.add(document.key)
+                chunks = self.get_chunks(document)
+                self.stats['documents'] += 1
+                self.stats['chunks'] += len(chunks)
+
+                # Delete the chunks removed from the document
+                chunk_ids = [chunk['id'] for chunk in chunks]
+                await self.delete_chunks([chunk_id for chunk_id in self.state.documents.get(document.key, []) if chunk_id not in chunk_ids])
+                self.state.documents[document.key] = chunk_ids
+
+                for chunk in chunks:
+                    if self.state.chunks.get(chunk['id']) == chunk['hash']:
+                        self.stats['unchanged'] += 1
+                        continue
+
+                    pending.append(chunk)
+                    if len(pending) >= self.upload_batch_size:
+                        await self.schedule(pending)
+                        pending = []
+
+            if pending:
+                await self.schedule(pending)
+
+            if self.tasks:
+                await asyncio.gather(*self.tasks)
+
+            if delete_missing:
+                for key in [key for key in self.state.documents if key not in keys]:
+                    await self.delete_chunks(self.state.documents.pop(key))
+
+        finally:
+            # Saved even if the run is interrupted, so that the next run resumes where it stopped
+            self.state.save()
+
+        return self.stats
+
+
+    def get_chunks(self, document: SourceDocument) -> list:
+        """
+        Split a document into chunks of about chunk_tokens tokens, on paragraph boundaries (paragraphs
+        longer than a chunk are split on word boundaries).
+
+        Args:
+            document (SourceDocument): The document.
+
+        Returns:
+            list: The chunks (index documents without embeddings), with the content hash of each chunk.
+        """
+        pieces = []
+        for paragraph in re.split(r'\n\s*\n', document.text):
+            paragraph = ' '.join(paragraph.split())
+            if not paragraph:
+                continue
+
+            if self.tokenizer.count(paragraph) <= self.chunk_tokens:
+                pieces.append(paragraph)
+                continue
+
+            words = []
+            tokens = 0
+            for word in paragraph.split(' '):
+                word_tokens = self.tokenizer.count(f" {word}")
+                if words and tokens + word_tokens > self.chunk_tokens:
+                    pieces.append(' '.join(words))
+                    words = []
+                    tokens = 0
+                words.append(word)
+                tokens += word_tokens
+            pieces.append(' '.join(words))
+
+        contents = []
+        for piece in pieces:
+            if contents and self.tokenizer.count(f"{contents[-1]}\n\n{piece}") <= self.chunk_tokens:
+                contents[-1] = f"{contents[-1]}\n\n{piece}"
+            else:
+                contents.append(piece)
+
+        document_id = hashlib.sha256(document.key.encode('utf-8')).hexdigest()[:32]
+        chunks = []
+        for index, content in enumerate(contents):
+            chunk = {
+                'id': f"{document_id}-{index}",
+                'title': document.title,
+                'content': content,
+                'url': document.url
+            }
+            chunk['hash'] = hashlib.sha256(json.dumps(chunk, sort_keys=True).encode('utf-8')).hexdigest()
+            chunks.append(chunk)
+
+        return chunks
+
+
+    async def schedule(self, chunks: list) -> None:
+        """
+        Embed and upload a batch of chunks in the background, waiting while max_concurrency batches are in progress.
+
+        Args:
+            chunks (list): The chunks.
+        """
+        await self.semaphore.acquire()
+
+        task = asyncio.create_task(self.upload(chunks))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(lambda _: self.semaphore.release())
+
+
+    async def upload(self, chunks: list) -> None:
+        """
+        Embed a batch of chunks and upload them to the index, then checkpoint the state.
+
+        Args:
+            chunks (list): The chunks.
+        """
+        # Chunks not uploaded yet, counted as failed if the batch fails
+        remaining = len(chunks)
+
+        try:
+            with telemetry.span('ingestion_embeddings', chunks=len(chunks)):
+                embeddings = []
+                for start in range(0, len(chunks), self.embedding_batch_size):
+                    embeddings += await self.gpt_model.generate_embeddings_batch([
+                        f"{chunk['title']}\n\n{chunk['content']}" for chunk in chunks[start:start + self.embedding_batch_size]
+                    ])
+
+            documents = [
+                dict({key: value for key, value in chunk.items() if key != 'hash'}, content_vector=embedding)
+                for chunk, embedding in zip(chunks, embeddings)
+            ]
+            hashes = {chunk['id']: chunk['hash'] for chunk in chunks}
+
+            for batch in self.get_upload_batches(documents):
+                with telemetry.span('ingestion_upload', documents=len(batch)):
+                    results = await self.search_client.merge_or_upload_documents(documents=batch)
+
+                for result in results:
+                    if result.succeeded:
+                        self.state.chunks[result.key] = hashes[result.key]
+                        self.stats['uploaded'] += 1
+                    else:
+                        self.stats['failed'] += 1
+                        logging.error(f"Error uploading chunk {result.key}: {result.status_code} - {result.error_message}")
+
+                remaining -= len(batch)
+
+        except Exception as e:
+            self.stats['failed'] += remaining
+            logging.error(f"Error ingesting {remaining} of {len(chunks)} chunks: {e}")
+
+        self.state.checkpoint()
+
+
+    def get_upload_batches(self, documents: list) -> list:
+        """
+        Split documents into upload batches, bounded in number of documents and in size.
+
+        Args:
+            documents (list): The index documents.
+
+        Returns:
+            list: The batches.
+        """
+        batches = []
+        batch = []
+        batch_bytes = 0
+
+        for document in documents:
+            document_bytes = len(json.dumps(document))
+            if batch and (len(batch) >= self.upload_batch_size or batch_bytes + document_bytes > self.upload_max_bytes):
+                batches.append(batch)
+                batch = []
+                batch_bytes = 0
+            batch.append(document)
+            batch_bytes += document_bytes
+
+        if batch:
+            batches.append(batch)
+
+        return batches
+
+
+    async def delete_chunks(self, chunk_ids: list) -> None:
+        """
+        Delete chunks from the index and from the state.
+
+        Args:
+            chunk_ids (list): The IDs of the chunks.
+        """
+        for start in range(0, len(chunk_ids), self.upload_batch_size):
+            batch = chunk_ids[start:start + self.upload_batch_size]
+            await self.search_client.delete_documents(documents=[{'id': chunk_id} for chunk_id in batch])
+            for chunk_id in batch:
+                self.state.chunks.pop(chunk_id, None)
+            self.stats['deleted'] += len(batch)
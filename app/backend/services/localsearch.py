@@ -0,0 +1,644 @@
+import asyncio
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import numpy as np
+
+from collections import Counter
+from azure.search.documents.models import IndexingResult
+from backend.config import environment
+from backend.services.searchbackend import SearchBackend
+
+
+def get_index_definition() -> dict:
+    """
+    Load the definition of the search index (the same definition the Azure AI Search index is created from).
+
+    Returns:
+        dict: The index definition.
+    """
+    search_config_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../config/search")
+    with open(f'{search_config_directory}/index.json', 'r') as file:
+        return json.load(file)
+
+
+def get_terms(value) -> list:
+    """
+    Split a field value into terms, like the standard Lucene analyzer (lowercase words, at most 255 characters).
+
+    Args:
+        value (str | list): The value of a text field, or of a collection of text fields.
+
+    Returns:
+        list: The terms.
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        value = ' '.join(item for item in value if item)
+    return [term for term in re.findall(r'\w+', value.lower()) if len(term) <= 255]
+
+
+class StoredDocuments():
+    """
+    The stored fields of the documents of a saved index: a JSON Lines file, memory-mapped, and the
+    offsets of its lines. Documents are only parsed when they are returned by a search.
+    """
+
+    def __init__(self, path: str):
+        self.offsets = np.load(os.path.join(path, 'documents.offsets.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'documents.jsonl'), 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(file.fileno()).st_size else b''
+
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+
+    def __getitem__(self, position: int) -> dict:
+        return json.loads(self.data[self.offsets[position]:self.offsets[position + 1]])
+
+
+class TextFieldIndex():
+    """
+    The inverted index of a text field, for BM25 scoring: the sorted vocabulary, and for each term
+    the positions of the documents containing it and the term frequencies (compressed sparse rows),
+    with the length of the field in each document.
+    """
+
+    array_names = ['vocabulary', 'indptr', 'positions', 'frequencies', 'lengths']
+
+    def __init__(self, vocabulary: np.ndarray, indptr: np.ndarray, positions: np.ndarray,
+                 frequencies: np.ndarray, lengths: np.ndarray):
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.positions = positions
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) and lengths.mean() > 0 else 1.0
+
+
+    @classmethod
+    def build(cls, term_counts: list) -> 'TextFieldIndex':
+        """
+        Build the inverted index of a field.
+
+        Args:
+            term_counts (list): The term frequencies of the field (Counter), by document position.
+
+        Returns:
+            TextFieldIndex: The index.
+        """
+        terms = []
+        positions = []
+        frequencies = []
+        for position, counts in enumerate(term_counts):
+            terms.extend(counts.keys())
+            positions.extend([position] * len(counts))
+            frequencies.extend(counts.values())
+
+        vocabulary, term_rows = np.unique(np.array(terms, dtype=str), return_inverse=True)
+        order = np.argsort(term_rows, kind='stable')
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(term_rows, minlength=len(vocabulary)))
+
+        return cls(
+            vocabulary,
+            indptr,
+            np.array(positions, dtype=np.int32)[order],
+            np.array(frequencies, dtype=np.float32)[order],
+            np.array([sum(counts.values()) for counts in term_counts], dtype=np.float32)
+        )
+
+
+    @classmethod
+    def load(cls, path: str, field: str) -> 'TextFieldIndex':
+        """
+        Load the memory-mapped inverted index of a field.
+
+        Args:
+            path (str): The directory of the saved index.
+            field (str): The field name.
+
+        Returns:
+            TextFieldIndex: The index.
+        """
+        return cls(*[np.load(os.path.join(path, f"{field}.{name}.npy"), mmap_mode='r') for name in cls.array_names])
+
+
+    def save(self, path: str, field: str) -> None:
+        """
+        Save the inverted index of a field.
+
+        Args:
+            path (str): The directory of the saved index.
+            field (str): The field name.
+        """
+        for name in self.array_names:
+            np.save(os.path.join(path, f"{field}.{name}.npy"), getattr(self, name))
+
+
+    def score(self, terms: list, scores: np.ndarray, weight: float, k1: float, b: float) -> None:
+        """
+        Add the weighted BM25 scores of the field for query terms to the scores of the documents.
+
+        Args:
+            terms (list): The unique query terms.
+            scores (np.ndarray): The scores of the documents, by position.
+            weight (float): The weight of the field in the scoring profile.
+            k1 (float): The BM25 term frequency saturation.
+            b (float): The BM25 length normalization.
+        """
+        if not len(self.vocabulary):
+            return
+
+        count = len(self.lengths)
+        for term, row in zip(terms, np.searchsorted(self.vocabulary, terms)):
+            if row >= len(self.vocabulary) or self.vocabulary[row] != term:
+                continue
+
+            start, end = self.indptr[row], self.indptr[row + 1]
+            positions = self.positions[start:end]
+            frequencies = self.frequencies[start:end]
+            idf = math.log(1 + (count - (end - start) + 0.5) / ((end - start) + 0.5))
+            norms = k1 * (1 - b + b * self.lengths[positions] / self.average_length)
+            scores[positions] += weight * idf * frequencies * (k1 + 1) / (frequencies + norms)
+
+
+class IndexSegment():
+    """
+    An immutable snapshot of the local index: the stored documents, the normalized vectors (flat
+    index, searched exhaustively) and the inverted index of each text field. A segment is built in
+    memory, or loaded from memory-mapped files.
+    """
+
+    def __init__(self, documents, vectors: np.ndarray, text_indexes: dict):
+        self.documents = documents
+        self.vectors = vectors
+        self.text_indexes = text_indexes
+
+
+    @classmethod
+    def build(cls, documents: list, term_counts: list, text_fields: list, vector_field: str) -> 'IndexSegment':
+        """
+        Build a segment.
+
+        Args:
+            documents (list): The documents (with their vectors).
+            term_counts (list): The term frequencies of the text fields (dict of Counter), by document position.
+            text_fields (list): The searchable text fields.
+            vector_field (str): The vector field.
+
+        Returns:
+            IndexSegment: The segment.
+        """
+        dimensions = max([len(document[vector_field]) for document in documents if document.get(vector_field) is not None] or [0])
+        vectors = np.zeros((len(documents), dimensions), dtype=np.float32)
+        for position, document in enumerate(documents):
+            if document.get(vector_field) is not None and len(document[vector_field]) == dimensions:
+                vectors[position] = document[vector_field]
+
+        # Cosine similarity: the vectors are normalized once, queries are dot products
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+        return cls(
+            [{key: value for key, value in document.items() if key != vector_field} for document in documents],
+            vectors,
+            {field: TextFieldIndex.build([counts[field] for counts in term_counts]) for field in text_fields}
+        )
+
+
+    @classmethod
+    def load(cls, path: str, text_fields: list) -> 'IndexSegment':
+        """
+        Load a saved segment, memory-mapping its files (the data is paged in on first use).
+
+        Args:
+            path (str): The directory of the saved index.
+            text_fields (list): The searchable text fields.
+
+        Returns:
+            IndexSegment: The segment.
+        """
+        return cls(
+            StoredDocuments(path),
+            np.load(os.path.join(path, 'vectors.npy'), mmap_mode='r'),
+            {field: TextFieldIndex.load(path, field) for field in text_fields}
+        )
+
+
+    def save(self, path: str) -> None:
+        """
+        Save the segment. The files are written to a temporary directory which then replaces the directory of the index.
+
+        Args:
+            path (str): The directory of the saved index.
+        """
+        temporary_path = f"{path}.tmp"
+        shutil.rmtree(temporary_path, ignore_errors=True)
+        os.makedirs(temporary_path)
+
+        offsets = [0]
+        with open(os.path.join(temporary_path, 'documents.jsonl'), 'wb') as file:
+            for position in range(len(self.documents)):
+                line = json.dumps(self.documents[position]).encode('utf-8') + b'\n'
+                file.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(os.path.join(temporary_path, 'documents.offsets.npy'), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(temporary_path, 'vectors.npy'), self.vectors)
+        for field, text_index in self.text_indexes.items():
+            text_index.save(temporary_path, field)
+
+        previous_path = f"{path}.old"
+        shutil.rmtree(previous_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, previous_path)
+        os.replace(temporary_path, path)
+        shutil.rmtree(previous_path, ignore_errors=True)
+
+
+    def search_text(self, terms: list, weights: dict, k1: float, b: float) -> np.ndarray:
+        """
+        Score the documents for query terms with BM25, summing the weighted scores of the fields.
+
+        Args:
+            terms (list): The unique query terms.
+            weights (dict): The weight of each searched field.
+            k1 (float): The BM25 term frequency saturation.
+            b (float): The BM25 length normalization.
+
+        Returns:
+            np.ndarray: The scores of the documents, by position.
+        """
+        scores = np.zeros(len(self.documents), dtype=np.float32)
+        for field, weight in weights.items():
+            if field in self.text_indexes:
+                self.text_indexes[field].score(terms, scores, weight, k1, b)
+        return scores
+
+
+    def search_vector(self, vector: list, k: int) -> tuple:
+        """
+        Find the nearest neighbors of a query vector, by cosine similarity (exhaustive search).
+
+        Args:
+            vector (list): The query vector.
+            k (int): The number of neighbors.
+
+        Returns:
+            tuple: The positions of the neighbors, most similar first, and their similarities.
+        """
+        if not len(self.documents) or len(vector) != self.vectors.shape[1]:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+
+        query = np.asarray(vector, dtype=np.float32)
+        similarities = self.vectors @ (query / (np.linalg.norm(query) or 1))
+
+        k = min(k, len(similarities))
+        positions = np.argpartition(-similarities, k - 1)[:k]
+        positions = positions[np.argsort(-similarities[positions], kind='stable')]
+        return positions, similarities[positions]
+
+
+class LocalSearchResults():
+    """
+    The results of a local search, iterated like the results of the asyncio Azure AI Search client.
+    """
+
+    def __init__(self, records: list, count: int):
+        self.records = records
+        self.count = count
+
+
+    def __aiter__(self):
+        async def iterate():
+            for record in self.records:
+                yield record
+        return iterate()
+
+
+    async def get_count(self) -> int:
+        return self.count
+
+
+class LocalSearchClient(SearchBackend):
+    """
+    An in-process search index, used in place of the asyncio Azure AI Search client for local
+    development, tests and benchmarks, and to avoid a network hop on small corpora.
+
+    The index follows the definition of the Azure AI Search index (index.json): BM25 scoring of the
+    searchable text fields with the weights of the scoring profile, an exhaustive cosine similarity
+    search of the vector field, and reciprocal rank fusion of the text and vector rankings for
+    hybrid queries. Semantic ranking is not available: the results have no reranker score and no
+    captions. Filters, facets and ordering are not supported.
+
+    Changes are applied to an in-memory copy of the documents, and the searched arrays are rebuilt
+    on the next search. The index can be saved to a directory of memory-mapped files, which loads
+    instantly.
+    """
+
+    def __init__(self,
+                 path: str = environment.LOCAL_SEARCH_INDEX_PATH,
+                 definition: dict = None,
+                 text_results: int = environment.LOCAL_SEARCH_TEXT_RESULTS,
+                 rrf_k: int = environment.LOCAL_SEARCH_RRF_K):
+        definition = definition or get_index_definition()
+        fields = definition['fields']
+
+        self.key_field = next(field['name'] for field in fields if field.get('key'))
+        self.text_fields = [field['name'] for field in fields if field.get('searchable') and field['type'] in ['Edm.String', 'Collection(Edm.String)']]
+        self.vector_field = next((field['name'] for field in fields if field.get('dimensions')), None)
+        self.scoring_profiles = {profile['name']: (profile.get('text') or {}).get('weights') or {} for profile in definition.get('scoringProfiles') or []}
+        self.default_scoring_profile = definition.get('defaultScoringProfile')
+        self.k1 = (definition.get('similarity') or {}).get('k1') or 1.2
+        self.b = (definition.get('similarity') or {}).get('b') or 0.75
+
+        self.path = path
+        self.text_results = text_results
+        self.rrf_k = rrf_k
+        self.lock = asyncio.Lock()
+
+        if path and os.path.exists(os.path.join(path, 'documents.offsets.npy')):
+            self.segment = IndexSegment.load(path, self.text_fields)
+        else:
+            self.segment = IndexSegment.build([], [], self.text_fields, self.vector_field)
+
+        # Mutable copy of the documents and of their terms, only created on the first change
+        self.documents = None
+        self.term_counts = None
+        self.changed = False
+
+
+    async def search(self, search_text: str = None, *, top: int = None, skip: int = None, select: list = None,
+                     search_fields: list = None, scoring_profile: str = None, vector_queries: list = None,
+                     include_total_count: bool = None, **kwargs) -> LocalSearchResults:
+        """
+        Search the index (text, vector or hybrid query).
+
+        Args:
+            search_text (str, optional): The text query (any term matches, '*' matches all the documents).
+            top (int, optional): The number of results. Defaults to 50.
+            skip (int, optional): The number of results to skip.
+            select (list, optional): The fields returned. Defaults to all the fields.
+            search_fields (list, optional): The text fields searched. Defaults to the searchable fields.
+            scoring_profile (str, optional): The scoring profile. Defaults to the default scoring profile of the index.
+            vector_queries (list, optional): The vector queries (VectorizedQuery).
+            include_total_count (bool, optional): Whether to count the matching documents (always counted).
+
+        Returns:
+            LocalSearchResults: The results, with the '@search.score' of each document.
+        """
+        segment = await self.get_segment()
+
+        weights = self.scoring_profiles.get(scoring_profile or self.default_scoring_profile, {})
+        weights = {field: weights.get(field, 1) for field in search_fields or self.text_fields}
+        vectors = [(query.vector, query.k_nearest_neighbors or top or 50) for query in vector_queries or []]
+
+        # As in Azure AI Search, '*' matches all the documents, with the same score
+        match_all = (search_text or '').strip() == '*'
+        terms = [] if match_all else get_terms(search_text or '')
+
+        scores = await asyncio.to_thread(self.get_scores, segment, terms, weights, vectors, match_all)
+
+        start = skip or 0
+        records = []
+        for position, score in scores[start:start + (top or 50)]:
+            document = segment.documents[position]
+            record = {field: document.get(field) for field in select} if select else dict(document)
+            record.update({
+                '@search.score': score,
+                '@search.reranker_score': None,
+                '@search.highlights': None,
+                '@search.captions': None
+            })
+            records.append(record)
+
+        return LocalSearchResults(records, len(scores))
+
+
+    def get_scores(self, segment: IndexSegment, terms: list, weights: dict, vectors: list, match_all: bool = False) -> list:
+        """
+        Rank the documents matching a query. A single ranking is returned with its own scores; the
+        text and vector rankings of hybrid queries are fused by reciprocal rank.
+
+        Args:
+            segment (IndexSegment): The searched segment.
+            terms (list): The query terms.
+            weights (dict): The weight of each searched field.
+            vectors (list): The query vectors, with their number of neighbors.
+            match_all (bool, optional): Whether the text query matches all the documents ('*'), in index order.
+
+        Returns:
+            list: The positions and scores of the matching documents, best first.
+        """
+        rankings = []
+
+        if match_all:
+            positions = range(min(len(segment.documents), self.text_results) if vectors else len(segment.documents))
+            rankings.append([(position, 1.0) for position in positions])
+
+        if terms:
+            text_scores = segment.search_text(sorted(set(terms)), weights, self.k1, self.b)
+            positions = np.flatnonzero(text_scores > 0)
+            positions = positions[np.argsort(-text_scores[positions], kind='stable')][:self.text_results]
+            rankings.append(list(zip(positions.tolist(), text_scores[positions].tolist())))
+
+        for vector, k in vectors:
+            positions, similarities = segment.search_vector(vector, k)
+            rankings.append(list(zip(positions.tolist(), similarities.tolist())))
+
+        if len(rankings) == 1:
+            return rankings[0]
+
+        fused_scores = Counter()
+        for ranking in rankings:
+            for rank, (position, _) in enumerate(ranking, start=1):
+                fused_scores[position] += 1 / (self.rrf_k + rank)
+        return fused_scores.most_common()
+
+
+    async def get_segment(self) -> IndexSegment:
+        """
+        Get the segment searched, rebuilding it first if the documents changed.
+
+        Returns:
+            IndexSegment: The segment.
+        """
+        async with self.lock:
+            if self.changed:
+                self.changed = False
+                self.segment = await asyncio.to_thread(
+                    IndexSegment.build,
+                    list(self.documents.values()),
+                    list(self.term_counts.values()),
+                    self.text_fields,
+                    self.vector_field
+                )
+        return self.segment
+
+
+    def get_documents(self) -> dict:
+        """
+        Get the mutable copy of the documents, creating it from the segment on the first change.
+
+        Returns:
+            dict: The documents (with their vectors), by key.
+        """
+        if self.documents is None:
+            self.documents = {}
+            self.term_counts = {}
+            for position in range(len(self.segment.documents)):
+                document = dict(self.segment.documents[position])
+                if self.vector_field and self.segment.vectors.shape[1]:
+                    document[self.vector_field] = np.array(self.segment.vectors[position])
+                self.set_document(document)
+        return self.documents
+
+
+    def set_document(self, document: dict) -> None:
+        """
+        Add or replace a document of the mutable copy.
+
+        Args:
+            document (dict): The document.
+        """
+        key = document[self.key_field]
+        self.documents[key] = document
+        self.term_counts[key] = {field: Counter(get_terms(document.get(field))) for field in self.text_fields}
+        self.changed = True
+
+
+    async def upload_documents(self, documents: list, **kwargs) -> list:
+        """
+        Add or replace documents.
+
+        Args:
+            documents (list): The documents.
+
+        Returns:
+            list: The indexing results (IndexingResult).
+        """
+        return self.index_documents(documents, merge=False)
+
+
+    async def merge_or_upload_documents(self, documents: list, **kwargs) -> list:
+        """
+        Update the fields of documents, adding the documents which do not exist.
+
+        Args:
+            documents (list): The documents.
+
+        Returns:
+            list: The indexing results (IndexingResult).
+        """
+        return self.index_documents(documents, merge=True)
+
+
+    def index_documents(self, documents: list, merge: bool) -> list:
+        """
+        Add, replace or update documents.
+
+        Args:
+            documents (list): The documents.
+            merge (bool): Whether to update the fields of existing documents rather than replace them.
+
+        Returns:
+            list: The indexing results (IndexingResult).
+        """
+        existing_documents = self.get_documents()
+        results = []
+
+        for document in documents:
+            key = document.get(self.key_field)
+            if key is None:
+                results.append(IndexingResult(key=None, succeeded=False, status_code=400, error_message=f"Missing key field {self.key_field}"))
+                continue
+
+            self.set_document(dict(existing_documents.get(key, {}), **document) if merge else dict(document))
+            results.append(IndexingResult(key=key, succeeded=True, status_code=200))
+
+        return results
+
+
+    async def delete_documents(self, documents: list, **kwargs) -> list:
+        """
+        Delete documents.
+
+        Args:
+            documents (list): The documents (only their key is used).
+
+        Returns:
+            list: The indexing results (IndexingResult).
+        """
+        existing_documents = self.get_documents()
+        results = []
+
+        for document in documents:
+            key = document.get(self.key_field)
+            if existing_documents.pop(key, None) is not None:
+                self.term_counts.pop(key)
+                self.changed = True
+            results.append(IndexingResult(key=key, succeeded=True, status_code=200))
+
+        return results
+
+
+    async def get_document(self, key: str, selected_fields: list = None, **kwargs) -> dict:
+        """
+        Get a document by key.
+
+        Args:
+            key (str): The document key.
+            selected_fields (list, optional): The fields returned. Defaults to all the fields.
+
+        Returns:
+            dict: The document.
+
+        Raises:
+            KeyError: If the document does not exist.
+        """
+        if self.documents is not None:
+            if key not in self.documents:
+                raise KeyError(key)
+            document = {field: value for field, value in self.documents[key].items() if field != self.vector_field}
+            return {field: document.get(field) for field in selected_fields} if selected_fields else document
+
+        segment = self.segment
+        for position in range(len(segment.documents)):
+            document = segment.documents[position]
+            if document[self.key_field] == key:
+                return {field: document.get(field) for field in selected_fields} if selected_fields else dict(document)
+        raise KeyError(key)
+
+
+    async def get_document_count(self, **kwargs) -> int:
+        """
+        Get the number of documents in the index.
+
+        Returns:
+            int: The number of documents.
+        """
+        return len(self.documents) if self.documents is not None else len(self.segment.documents)
+
+
+    async def save(self, path: str = None) -> None:
+        """
+        Save the index to a directory of memory-mapped files.
+
+        Args:
+            path (str, optional): The directory. Defaults to the directory the index was loaded from.
+        """
+        path = path or self.path
+        if not path:
+            raise Exception("Error in LocalSearchClient.save: no index path")
+
+        segment = await self.get_segment()
+        await asyncio.to_thread(segment.save, path)
+
+
+    async def close(self) -> None:
+        pass
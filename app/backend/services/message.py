@@ -1,10 +1,116 @@
+import json
+import logging
+
+from backend.config import environment
+
+
+class Tokenizer:
+    """
+    A tokenizer that approximates the number of tokens of a text (about 4 characters per token).
+    """
+
+    def count(self, text: str) -> int:
+        """
+        Count the number of tokens of a text.
+
+        Args:
+            text (str): The text.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return (len(text) + 3) // 4 if text else 0
+
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """
+        Truncate a text to a maximum number of tokens.
+
+        Args:
+            text (str): The text.
+            max_tokens (int): The maximum number of tokens.
+
+        Returns:
+            str: The truncated text.
+        """
+        return text[:max_tokens * 4]
+
+
+class TiktokenTokenizer(Tokenizer):
+    """
+    A tokenizer using the tiktoken encodings of the OpenAI models.
+    """
+
+    def __init__(self, encoding_name: str = environment.TOKENIZER_ENCODING):
+        import tiktoken
+        self.encoding = tiktoken.get_encoding(encoding_name)
+
+
+    def count(self, text: str) -> int:
+        return len(self.encoding.encode(text, disallowed_special=())) if text else 0
+
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return self.encoding.decode(tokens[:max_tokens]) if len(tokens) > max_tokens else text
+
+
+# The shared tokenizer, set by load_tokenizer
+shared_tokenizer = None
+
+
+def load_tokenizer() -> Tokenizer:
+    """
+    Loads the shared tokenizer: tiktoken if it is installed and the encoding can be loaded, otherwise an approximation.
+
+    On first use, tiktoken downloads the encoding file (without a timeout) unless it is found in the
+    TIKTOKEN_CACHE_DIR directory, so the tokenizer is loaded at startup, outside of the event loop.
+
+    Returns:
+        Tokenizer: The tokenizer.
+    """
+    global shared_tokenizer
+
+    if shared_tokenizer is None:
+        try:
+            shared_tokenizer = TiktokenTokenizer()
+        except Exception as e:
+            logging.warning(f"Using approximate token counts, tiktoken is not available: {e}")
+            shared_tokenizer = Tokenizer()
+
+    return shared_tokenizer
+
+
+def get_tokenizer() -> Tokenizer:
+    """
+    Gets the shared tokenizer without loading it (an approximation until load_tokenizer has run).
+
+    Returns:
+        Tokenizer: The tokenizer.
+    """
+    return shared_tokenizer or Tokenizer()
+
+
 class MessageBuilder:
     """
     A class that builds a message by adding prompts, system prompts, tool calls, and tool results.
+
+    Each message belongs to a section ('system', 'history', 'conversation' or 'tools'), used to
+    report the number of tokens of each section and to fit the prompts into a token budget.
     """
 
-    def __init__(self):
+    # Number of tokens added by the chat format to each message
+    message_overhead_tokens = 4
+
+    # Minimum number of tokens kept for each document of a tool response
+    min_document_tokens = 50
+
+    def __init__(self, tokenizer: Tokenizer = None):
         self.prompts = []
+        self.sections = []
+        self.records = {}
+        self.tokenizer = tokenizer
+        self.token_report = {}
 
 
     def add_system_prompt(self, content: str):
@@ -24,20 +130,23 @@ class MessageBuilder:
                 'role': 'system',
                 'content': content
             })
+            self.sections.append('system')
 
 
-    def add_prompt(self, role: str, content: str):
+    def add_prompt(self, role: str, content: str, section: str = 'conversation'):
         """
         Add a prompt to the list of prompts.
 
         Args:
             role (str): The role of the participant in the conversation.
             content (str): The content of the participant's message.
+            section (str, optional): The section of the message. Defaults to 'conversation'.
         """
         self.prompts.append({
             'role': role,
             'content': content
         })
+        self.sections.append(section)
 
 
     def add_tool_calls(self, tool_calls: list):
@@ -51,9 +160,10 @@ class MessageBuilder:
             'role': 'assistant',
             'tool_calls': tool_calls
         })
+        self.sections.append('tools')
 
 
-    def add_tool_response(self, tool_id: str, function_name: str, content: str):
+    def add_tool_response(self, tool_id: str, function_name: str, content: str, records: list = None):
         """
         Add a tool response to the list of prompts.
 
@@ -61,6 +171,7 @@ class MessageBuilder:
             tool_id (str): The ID of the tool being called.
             function_name (str): The name of the function being called.
             content (str): The content of the tool response.
+            records (list, optional): The documents serialized in the content, truncated per document to fit a token budget.
         """
         self.prompts.append({
             'role': 'tool',
@@ -68,6 +179,10 @@ class MessageBuilder:
             'name': function_name,
             'content': content
         })
+        self.sections.append('tools')
+
+        if records is not None:
+            self.records[len(self.prompts) - 1] = records
 
 
     def get_prompts(self):
@@ -78,3 +193,163 @@ class MessageBuilder:
             list: The list of prompts.
         """
         return self.prompts
+
+
+    def get_prompts_with_budget(self, max_tokens: int, max_document_tokens: int = 0) -> list:
+        """
+        Get the list of prompts, fitted into a token budget.
+
+        The documents of the tool responses are first truncated to max_document_tokens each. If the
+        prompts still exceed the budget, the oldest history turns are removed, and then the documents
+        are truncated further. The number of tokens of each section is available in the token report.
+
+        Args:
+            max_tokens (int): The maximum number of prompt tokens (0 for no limit).
+            max_document_tokens (int, optional): The maximum number of tokens of each tool response document (0 for no limit).
+
+        Returns:
+            list: The list of prompts (the messages of the builder are not modified).
+        """
+        indexes = list(range(len(self.prompts)))
+        tool_responses = {}
+        trimmed_history_messages = 0
+        truncated_documents = 0
+
+        def get_prompts():
+            return [tool_responses.get(index, self.prompts[index]) for index in indexes]
+
+        # Truncate each document of the tool responses
+        if max_document_tokens > 0:
+            tool_responses, truncated_documents = self.truncate_documents(max_document_tokens)
+
+        if max_tokens > 0:
+            # Remove the oldest history turns (user prompt and assistant response)
+            history = [index for index in indexes if self.sections[index] == 'history']
+            while history and self.count_tokens(get_prompts()) > max_tokens:
+                for index in history[:2]:
+                    indexes.remove(index)
+                trimmed_history_messages += len(history[:2])
+                history = history[2:]
+
+            # Truncate the documents further, halving their size until the prompts fit
+            document_tokens = max_document_tokens or self.get_max_document_tokens()
+            while self.records and document_tokens > self.min_document_tokens and self.count_tokens(get_prompts()) > max_tokens:
+                document_tokens = max(self.min_document_tokens, document_tokens // 2)
+                tool_responses, truncated_documents = self.truncate_documents(document_tokens)
+
+        prompts = get_prompts()
+
+        # Report the number of tokens of each section
+        sections = {}
+        for index, prompt in zip(indexes, prompts):
+            section = self.sections[index]
+            sections[section] = sections.get(section, 0) + self.count_message_tokens(prompt)
+
+        self.token_report = {
+            'sections': sections,
+            'total': sum(sections.values()),
+            'budget': max_tokens,
+            'saved': self.count_tokens() - sum(sections.values()),
+            'trimmed_history_messages': trimmed_history_messages,
+            'truncated_documents': truncated_documents
+        }
+
+        return prompts
+
+
+    def truncate_documents(self, max_document_tokens: int) -> tuple:
+        """
+        Truncate the content of each document of the tool responses.
+
+        Args:
+            max_document_tokens (int): The maximum number of tokens of each document.
+
+        Returns:
+            tuple: The truncated tool response messages (by prompt index) and the number of truncated documents.
+        """
+        tokenizer = self.get_tokenizer()
+        tool_responses = {}
+        truncated_documents = 0
+
+        for index, records in self.records.items():
+            truncated_records = []
+            for record in records:
+                content = record.get('content')
+                if isinstance(content, str) and tokenizer.count(content) > max_document_tokens:
+                    record = dict(record, content = tokenizer.truncate(content, max_document_tokens))
+                    truncated_documents += 1
+                truncated_records.append(record)
+
+            tool_responses[index] = dict(self.prompts[index], content = json.dumps(truncated_records))
+
+        return tool_responses, truncated_documents
+
+
+    def get_max_document_tokens(self) -> int:
+        """
+        Get the number of tokens of the largest document of the tool responses.
+
+        Returns:
+            int: The number of tokens.
+        """
+        tokenizer = self.get_tokenizer()
+        return max([
+            tokenizer.count(record['content'])
+            for records in self.records.values()
+            for record in records
+            if isinstance(record.get('content'), str)
+        ] or [0])
+
+
+    def count_message_tokens(self, message: dict) -> int:
+        """
+        Count the number of tokens of a message.
+
+        Args:
+            message (dict): The message.
+
+        Returns:
+            int: The number of tokens.
+        """
+        tokenizer = self.get_tokenizer()
+        tokens = self.message_overhead_tokens + tokenizer.count(message.get('content') or '')
+
+        for tool_call in message.get('tool_calls') or []:
+            tokens += tokenizer.count(tool_call.function.name) + tokenizer.count(tool_call.function.arguments)
+
+        return tokens
+
+
+    def count_tokens(self, prompts: list = None) -> int:
+        """
+        Count the number of tokens of a list of prompts.
+
+        Args:
+            prompts (list, optional): The list of prompts. Defaults to all the prompts.
+
+        Returns:
+            int: The number of tokens.
+        """
+        return sum(self.count_message_tokens(prompt) for prompt in (prompts if prompts is not None else self.prompts))
+
+
+    def get_token_report(self) -> dict:
+        """
+        Get the number of tokens of each section of the last prompts fitted into a token budget.
+
+        Returns:
+            dict: The tokens per section, the total, the budget and the trimmed history messages and truncated documents.
+        """
+        return self.token_report
+
+
+    def get_tokenizer(self) -> Tokenizer:
+        """
+        Get the tokenizer, created on first use.
+
+        Returns:
+            Tokenizer: The tokenizer.
+        """
+        if self.tokenizer is None:
+            self.tokenizer = get_tokenizer()
+        return self.tokenizer
@@ -0,0 +1,593 @@
+import asyncio
+import itertools
+import json
+import logging
+import re
+import time
+
+from collections import OrderedDict
+from azure.core.exceptions import ServiceRequestError, ServiceResponseError
+from azure.cosmos import exceptions
+from backend.config import environment
+from backend.services.telemetry import telemetry
+
+
+class LocalChatHistoryContainer():
+    """
+    An in-memory stand-in for the chat history Cosmos DB container (asyncio API), used for local
+    development and tests. It supports the item operations and the queries of the chat history
+    database, not the full Cosmos DB query language.
+    """
+
+    # Maximum size of an item and of a transactional batch request, in bytes
+    max_request_bytes = 2 * 1024 * 1024
+
+    def __init__(self):
+        self.items = {}
+        self.sequence = itertools.count()
+
+
+    def query_items(self, query: str, parameters: list = None, partition_key: str = None, **kwargs):
+        """
+        Query the items of a session, most recent first (chat history query).
+
+        Args:
+            query (str): The query text. Only the projected fields, the session and the limit are used.
+            parameters (list, optional): The query parameters.
+            partition_key (str, optional): The session ID.
+
+        Returns:
+            AsyncIterator: The items.
+        """
+        values = {parameter['name']: parameter['value'] for parameter in parameters or []}
+        session_id = values.get('@session_id_param', partition_key)
+        max_results = values.get('@max_results_param')
+
+        select = re.match(r'SELECT\s+(.*?)\s+FROM', query, re.IGNORECASE).group(1)
+        fields = None if select.strip() == '*' else [field.strip()[2:] for field in select.split(',')]
+
+        items = sorted(
+            [item for (partition, _), item in self.items.items() if partition == session_id and 'type' not in item],
+            key=lambda item: (item['_ts'], item['_seq']),
+            reverse=True
+        )[:max_results]
+
+        async def iterate():
+            for item in items:
+                yield {field: item.get(field) for field in fields} if fields else dict(item)
+
+        return iterate()
+
+
+    async def upsert_item(self, body: dict, **kwargs) -> dict:
+        """
+        Create or replace an item.
+
+        Args:
+            body (dict): The item.
+
+        Returns:
+            dict: The stored item.
+        """
+        if len(json.dumps(body)) > self.max_request_bytes:
+            raise self.get_error(exceptions.CosmosHttpResponseError, 413, "Request Entity Too Large")
+
+        item = dict(body, _ts=int(time.time()), _seq=next(self.sequence))
+        self.items[(item['session_id'], item['id'])] = item
+        return dict(item)
+
+
+    async def read_item(self, item: str, partition_key: str, **kwargs) -> dict:
+        """
+        Read an item.
+
+        Args:
+            item (str): The item ID.
+            partition_key (str): The session ID.
+
+        Returns:
+            dict: The item.
+        """
+        if (partition_key, item) not in self.items:
+            raise self.get_error(exceptions.CosmosResourceNotFoundError, 404, "Not Found")
+        return dict(self.items[(partition_key, item)])
+
+
+    async def patch_item(self, item: str, partition_key: str, patch_operations: list, filter_predicate: str = None, **kwargs) -> dict:
+        """
+        Set fields of an item (partial update). Only 'set' operations on top-level fields are supported.
+
+        Args:
+            item (str): The item ID.
+            partition_key (str): The session ID.
+            patch_operations (list): The patch operations.
+            filter_predicate (str, optional): The condition of the update. Only chat history items (without a type) match it.
+
+        Returns:
+            dict: The updated item.
+        """
+        stored_item = self.items.get((partition_key, item))
+        if stored_item is None:
+            raise self.get_error(exceptions.CosmosResourceNotFoundError, 404, "Not Found")
+
+        if filter_predicate and 'type' in stored_item:
+            raise self.get_error(exceptions.CosmosAccessConditionFailedError, 412, "Precondition Failed")
+
+        for operation in patch_operations:
+            if operation['op'] != 'set':
+                raise ValueError(f"Unsupported patch operation: {operation['op']}")
+            stored_item[operation['path'].lstrip('/')] = operation['value']
+
+        return dict(stored_item)
+
+
+    async def execute_item_batch(self, batch_operations: list, partition_key: str, **kwargs) -> list:
+        """
+        Execute a transactional batch of upsert operations in a partition.
+
+        Args:
+            batch_operations (list): The (operation, arguments) tuples. Only 'upsert' is supported.
+            partition_key (str): The session ID.
+
+        Returns:
+            list: The results of the operations.
+        """
+        if len(json.dumps([arguments for _, arguments, *_ in batch_operations])) > self.max_request_bytes:
+            raise self.get_error(exceptions.CosmosHttpResponseError, 413, "Request Entity Too Large")
+
+        results = []
+        for operation, arguments, *_ in batch_operations:
+            if operation != 'upsert':
+                raise ValueError(f"Unsupported batch operation: {operation}")
+            results.append(await self.upsert_item(arguments[0]))
+        return results
+
+
+    def get_error(self, error_type: type, status_code: int, reason: str) -> exceptions.CosmosHttpResponseError:
+        """
+        Creates a Cosmos DB error, as raised by the Cosmos DB client.
+
+        Args:
+            error_type (type): The error class.
+            status_code (int): The HTTP status code.
+            reason (str): The HTTP reason.
+
+        Returns:
+            CosmosHttpResponseError: The error.
+        """
+        error = error_type(status_code=status_code, message=reason)
+        error.reason = reason
+        return error
+
+
+class ChatHistoryWriter():
+    """
+    A write-behind queue of chat history items.
+
+    Items are acknowledged as soon as they are queued, and written in the background as Cosmos DB
+    transactional batches (one per session partition, of up to batch_size items and max_batch_bytes).
+    Throttled (429) and transient (408, 5xx, timeouts) errors are retried with backoff, honoring the
+    retry-after delay. A batch rejected for another reason is written item by item. Items that still
+    fail are queued again up to max_requeues times, then dead-lettered: kept in memory (and appended to
+    dead_letter_path, if set) rather than discarded. The queue is bounded: writers wait when it is
+    full. Queued items are drained on shutdown. Updates of the items still queued
+    (feedback, tokens) are applied to the queued items, since they are not in the database yet.
+    """
+
+    # Maximum number of operations of a Cosmos DB transactional batch
+    max_batch_size = 100
+
+    # Maximum size of the items of a batch, in bytes (below the 2 MB request limit, to leave room for the batch envelope)
+    max_batch_bytes = 1800000
+
+    # Number of times items that failed to be written are queued again before they are dead-lettered
+    max_requeues = 3
+
+    def __init__(self, container,
+                 max_items: int = environment.HISTORY_WRITE_QUEUE_MAX_ITEMS,
+                 batch_size: int = environment.HISTORY_WRITE_BATCH_SIZE,
+                 flush_interval: float = environment.HISTORY_WRITE_FLUSH_INTERVAL,
+                 max_retries: int = environment.HISTORY_WRITE_MAX_RETRIES,
+                 dead_letter_path: str = environment.HISTORY_WRITE_DEAD_LETTER_PATH):
+        self.container = container
+        self.queue = asyncio.Queue(max_items)
+        self.batch_size = min(batch_size, self.max_batch_size)
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.dead_letter_path = dead_letter_path
+        self.pending = OrderedDict()
+        self.dead_letters = OrderedDict()
+        self.requeues = {}
+        self.waiters = {}
+        self.worker = None
+        self.closed = False
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.requeued = 0
+        self.dead_lettered = 0
+        self.flushes = 0
+        self.flush_latency_total = 0
+        self.flush_latency_max = 0
+
+
+    async def put(self, item: dict) -> None:
+        """
+        Queue a chat history item to be written. After shutdown, the item is written directly.
+
+        Args:
+            item (dict): The chat history item.
+        """
+        if self.closed:
+            await self.container.upsert_item(item)
+            return
+
+        if self.worker is None:
+            self.worker = asyncio.create_task(self.run())
+
+        self.pending[item['id']] = item
+        await self.queue.put(item)
+
+
+    async def update(self, item_id: str, fields: dict, timeout: float = environment.HISTORY_WRITE_DRAIN_TIMEOUT) -> bool:
+        """
+        Update an item that is queued or being written, by queuing an updated copy of it. While the writer
+        drains, the item is not queued again: the update waits until it is written.
+
+        Args:
+            item_id (str): The ID of the item.
+            fields (dict): The fields to set.
+            timeout (float, optional): The maximum time to wait for the item to be written while draining, in seconds.
+
+        Returns:
+            bool: True if the update was queued, False if the item must be updated in the database.
+        """
+        item = self.pending.get(item_id)
+        if item is None:
+            return False
+
+        if self.closed:
+            await self.wait_written(item_id, timeout)
+            return False
+
+        item = dict(item, **fields)
+        self.pending[item_id] = item
+        await self.queue.put(item)
+
+        return True
+
+
+    async def wait_written(self, item_id: str, timeout: float) -> None:
+        """
+        Wait until a pending item is written (or failed to be written).
+
+        Args:
+            item_id (str): The ID of the item.
+            timeout (float): The maximum time to wait, in seconds.
+        """
+        if item_id not in self.pending:
+            return
+
+        waiter = self.waiters.setdefault(item_id, asyncio.Event())
+        try:
+            await asyncio.wait_for(waiter.wait(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Timed out waiting for chat history item {item_id} to be written")
+
+
+    def get_pending(self, session_id: str) -> list:
+        """
+        Get the items of a session that are queued, being written or dead-lettered.
+
+        Args:
+            session_id (str): The ID of the session.
+
+        Returns:
+            list: The items, oldest first.
+        """
+        items = [item for item in self.dead_letters.values() if item['session_id'] == session_id]
+        return items + [item for item in self.pending.values() if item['session_id'] == session_id]
+
+
+    async def run(self) -> None:
+        """
+        Write the queued items in batches, until cancelled.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            items = [await self.queue.get()]
+
+            # Collect the items queued within the flush interval
+            deadline = loop.time() + self.flush_interval
+            while len(items) < self.batch_size:
+                try:
+                    if self.queue.empty():
+                        items.append(await asyncio.wait_for(self.queue.get(), max(0, deadline - loop.time())))
+                    else:
+                        items.append(self.queue.get_nowait())
+                except asyncio.TimeoutError:
+                    break
+
+            try:
+                await self.flush(items)
+            finally:
+                for _ in items:
+                    self.queue.task_done()
+
+
+    async def flush(self, items: list) -> None:
+        """
+        Write a list of items, as one transactional batch per session partition.
+
+        Args:
+            items (list): The chat history items.
+        """
+        start_time = time.perf_counter()
+
+        partitions = {}
+        for item in items:
+            partitions.setdefault(item['session_id'], []).append(item)
+
+        await asyncio.gather(*[
+            self.write_partition(session_id, partition_items)
+            for session_id, partition_items in partitions.items()
+        ])
+
+        latency = time.perf_counter() - start_time
+        self.flushes += 1
+        self.flush_latency_total += latency
+        self.flush_latency_max = max(self.flush_latency_max, latency)
+
+
+    async def write_partition(self, session_id: str, items: list) -> None:
+        """
+        Write the items of a session partition, as transactional batches bounded in items and bytes.
+
+        Args:
+            session_id (str): The ID of the session (partition key).
+            items (list): The chat history items of the session.
+        """
+        # Keep only the latest version of each item
+        items = list({item['id']: item for item in items}.values())
+
+        for batch in self.get_batches(items):
+            await self.write_batch(session_id, batch)
+
+
+    def get_batches(self, items: list) -> list:
+        """
+        Split items into batches of up to batch_size items and max_batch_bytes (serialized).
+
+        Args:
+            items (list): The chat history items.
+
+        Returns:
+            list: The batches of items.
+        """
+        batches = [[]]
+        batch_bytes = 0
+
+        for item in items:
+            item_bytes = len(json.dumps(item).encode('utf-8'))
+            if batches[-1] and (len(batches[-1]) == self.batch_size or batch_bytes + item_bytes > self.max_batch_bytes):
+                batches.append([])
+                batch_bytes = 0
+
+            batches[-1].append(item)
+            batch_bytes += item_bytes
+
+        return batches if batches[-1] else []
+
+
+    async def write_batch(self, session_id: str, items: list) -> None:
+        """
+        Write items of a session partition as a transactional batch. If the batch is rejected for a
+        reason other than a transient error, the items are written one by one.
+
+        Args:
+            session_id (str): The ID of the session (partition key).
+            items (list): The chat history items of the batch.
+        """
+        try:
+            await self.send(lambda: self.container.execute_item_batch(
+                batch_operations = [('upsert', (item,)) for item in items],
+                partition_key = session_id,
+                response_hook = telemetry.get_request_charge_hook('batch_chat_history')
+            ))
+            self.written += len(items)
+            self.complete(items)
+            return
+
+        except Exception as e:
+            if self.is_retryable(e):
+                self.fail(items, e)
+                return
+
+            logging.warning(f"Error writing a batch of {len(items)} chat history items of session {session_id}, writing them one by one: {e}")
+
+        for item in items:
+            await self.write_item(item)
+
+
+    async def write_item(self, item: dict) -> None:
+        """
+        Write a single item.
+
+        Args:
+            item (dict): The chat history item.
+        """
+        try:
+            await self.send(lambda: self.container.upsert_item(
+                item,
+                response_hook = telemetry.get_request_charge_hook('upsert_chat_history')
+            ))
+            self.written += 1
+            self.complete([item])
+
+        except Exception as e:
+            self.fail([item], e)
+
+
+    async def send(self, request) -> dict:
+        """
+        Send a request to the database, retrying throttled and transient errors with backoff.
+
+        Args:
+            request (Callable): The function returning the awaitable of the request.
+
+        Returns:
+            dict: The response.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await request()
+
+            except Exception as e:
+                if not self.is_retryable(e) or attempt == self.max_retries:
+                    raise
+
+                self.retries += 1
+                await asyncio.sleep(self.get_retry_delay(e, attempt))
+
+
+    def is_retryable(self, error: Exception) -> bool:
+        """
+        Check whether a database error is transient.
+
+        Args:
+            error (Exception): The error.
+
+        Returns:
+            bool: True for connection errors, timeouts, throttling (429, 449) and server errors (5xx).
+        """
+        if isinstance(error, (ServiceRequestError, ServiceResponseError, asyncio.TimeoutError)):
+            return True
+
+        status_code = getattr(error, 'status_code', None)
+        return status_code is not None and (status_code in (408, 429, 449) or status_code >= 500)
+
+
+    def complete(self, items: list) -> None:
+        """
+        Remove items that are written (or dead-lettered) from the pending items, unless a newer version of them is queued.
+
+        Args:
+            items (list): The chat history items.
+        """
+        for item in items:
+            if self.pending.get(item['id']) is item:
+                del self.pending[item['id']]
+                self.requeues.pop(item['id'], None)
+                if item['id'] in self.waiters:
+                    self.waiters.pop(item['id']).set()
+
+
+    def fail(self, items: list, error: Exception) -> None:
+        """
+        Queue items that failed to be written again, or dead-letter them once they failed max_requeues
+        times, failed with a non-transient error, or the queue is full.
+
+        Args:
+            items (list): The chat history items.
+            error (Exception): The error of the last attempt.
+        """
+        self.failed += len(items)
+
+        for item in items:
+            # A newer version of the item is queued, it replaces this one
+            if self.pending.get(item['id']) is not item:
+                continue
+
+            requeues = self.requeues.get(item['id'], 0)
+            if self.is_retryable(error) and requeues < self.max_requeues and not self.queue.full():
+                self.requeues[item['id']] = requeues + 1
+                self.requeued += 1
+                self.queue.put_nowait(item)
+            else:
+                self.dead_letter(item, error)
+
+
+    def dead_letter(self, item: dict, error: Exception) -> None:
+        """
+        Keep an item that could not be written, instead of discarding it. The item is still returned
+        with the pending items of its session, and appended to the dead-letter file, if set.
+
+        Args:
+            item (dict): The chat history item.
+            error (Exception): The error of the last attempt.
+        """
+        logging.error(f"Chat history item {item['id']} of session {item['session_id']} could not be written, dead-lettered: {error}")
+
+        self.dead_letters[item['id']] = item
+        if len(self.dead_letters) > self.queue.maxsize:
+            self.dead_letters.popitem(last=False)
+        self.dead_lettered += 1
+        self.complete([item])
+
+        if self.dead_letter_path:
+            try:
+                with open(self.dead_letter_path, 'a', encoding='utf-8') as file:
+                    file.write(json.dumps(item) + '\n')
+            except Exception as e:
+                logging.error(f"Error writing chat history item {item['id']} to the dead-letter file: {e}")
+
+
+    def get_retry_delay(self, error: Exception, attempt: int) -> float:
+        """
+        Get the delay before retrying a throttled or failed request.
+
+        Args:
+            error (Exception): The error.
+            attempt (int): The number of the failed attempt, starting at 0.
+
+        Returns:
+            float: The delay in seconds: the retry-after delay of the response, or an exponential backoff.
+        """
+        response = getattr(error, 'response', None)
+        headers = response.headers if response is not None else {}
+        retry_after_ms = headers.get('x-ms-retry-after-ms')
+
+        return float(retry_after_ms) / 1000 if retry_after_ms else min(0.1 * 2 ** attempt, 5)
+
+
+    async def drain(self, timeout: float = environment.HISTORY_WRITE_DRAIN_TIMEOUT) -> None:
+        """
+        Write the queued items and stop the background writer. Items queued afterwards are written directly.
+
+        Args:
+            timeout (float, optional): The maximum time to wait for the queued items to be written, in seconds.
+        """
+        self.closed = True
+
+        if self.worker is None:
+            return
+
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.error(f"Chat history writer drain timed out, {len(self.pending)} items not written")
+
+        self.worker.cancel()
+        self.worker = None
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the writer counters.
+
+        Returns:
+            dict: The queue depth, the items written, failed, retried, queued again and dead-lettered, and the flush latencies in milliseconds.
+        """
+        return {
+            'queue_depth': self.queue.qsize(),
+            'pending': len(self.pending),
+            'written': self.written,
+            'failed': self.failed,
+            'retries': self.retries,
+            'requeued': self.requeued,
+            'dead_lettered': self.dead_lettered,
+            'flushes': self.flushes,
+            'flush_latency_avg_ms': round(1000 * self.flush_latency_total / self.flushes, 2) if self.flushes else 0,
+            'flush_latency_max_ms': round(1000 * self.flush_latency_max, 2)
+        }
@@ -0,0 +1,386 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+import openai
+
+from enum import IntEnum
+from backend.config import environment
+from backend.services.message import MessageBuilder, Tokenizer
+from backend.services.telemetry import telemetry
+
+
+def get_retry_after(error: openai.APIStatusError) -> float:
+    """
+    Get the retry-after delay of a throttled Azure OpenAI request.
+
+    Args:
+        error (APIStatusError): The error of the request.
+
+    Returns:
+        float: The delay in seconds, or None if the response has no retry-after header.
+    """
+    headers = error.response.headers if error.response is not None else {}
+
+    try:
+        if headers.get('retry-after-ms'):
+            return float(headers['retry-after-ms']) / 1000
+        if headers.get('retry-after'):
+            return float(headers['retry-after'])
+    except ValueError:
+        pass
+
+    return None
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Check whether a failed Azure OpenAI request should be retried, as the OpenAI client does: connection
+    errors and timeouts, request timeouts (408), conflicts (409) and server errors, unless the response
+    tells otherwise (x-should-retry header). Throttled requests (429) are handled separately.
+
+    Args:
+        error (Exception): The error of the request.
+
+    Returns:
+        bool: True if the request should be retried.
+    """
+    if isinstance(error, openai.APIConnectionError):
+        return True
+
+    if not isinstance(error, openai.APIStatusError):
+        return False
+
+    should_retry = error.response.headers.get('x-should-retry') if error.response is not None else None
+    if should_retry in ('true', 'false'):
+        return should_retry == 'true'
+
+    return error.status_code in (408, 409) or error.status_code >= 500
+
+
+def get_backoff_delay(attempt: int) -> float:
+    """
+    Get an exponential backoff delay, with jitter.
+
+    Args:
+        attempt (int): The number of the failed attempt, starting at 0.
+
+    Returns:
+        float: The delay in seconds.
+    """
+    return min(0.5 * 2 ** attempt, 8) * random.uniform(0.5, 1)
+
+
+def estimate_tokens(messages: list = None, max_tokens: int = 0, texts: list = None) -> int:
+    """
+    Estimate the number of tokens of an Azure OpenAI request, as counted by the deployment quota
+    (approximate token counts, to keep the estimate cheap).
+
+    Args:
+        messages (list, optional): The messages of a chat completion request.
+        max_tokens (int, optional): The maximum number of completion tokens.
+        texts (list, optional): The input texts of an embeddings request.
+
+    Returns:
+        int: The estimated number of tokens.
+    """
+    tokenizer = Tokenizer()
+    tokens = MessageBuilder(tokenizer).count_tokens(messages) if messages else 0
+    tokens += sum(tokenizer.count(text) for text in texts or [])
+    return tokens + (max_tokens or 0)
+
+
+class Priority(IntEnum):
+    """
+    The priority of a GPT model request: queued requests are sent in priority order (lowest value first).
+    """
+    INTERACTIVE = 0
+    FOLLOWUP = 1
+    SUMMARY = 2
+
+
+class RateLimitBucket():
+    """
+    The token buckets of a model deployment quota (tokens and requests per minute), with a queue of
+    the requests waiting for quota, in priority order.
+    """
+
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.tokens = tokens_per_minute
+        self.requests = requests_per_minute
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.waiters = []
+        self.sequence = itertools.count()
+        self.timer = None
+
+
+    async def acquire(self, tokens: int, priority: Priority) -> None:
+        """
+        Wait until the quota allows a request, after the queued requests of the same or a higher priority.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+            priority (Priority): The priority of the request.
+        """
+        if not self.waiters and self.get_delay(tokens) == 0:
+            self.consume(tokens)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.sequence), tokens, future))
+        self.dispatch()
+
+        try:
+            await future
+        finally:
+            # Let the next request go if a cancelled request was at the head of the queue
+            if future.cancelled():
+                self.dispatch()
+
+
+    def dispatch(self) -> None:
+        """
+        Grant the quota to the queued requests in priority order, and schedule the next dispatch
+        when the request at the head of the queue has to wait.
+        """
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+        while self.waiters:
+            _, _, tokens, future = self.waiters[0]
+            if future.done():
+                heapq.heappop(self.waiters)
+                continue
+
+            delay = self.get_delay(tokens)
+            if delay > 0:
+                self.timer = asyncio.get_running_loop().call_later(delay, self.dispatch)
+                return
+
+            heapq.heappop(self.waiters)
+            self.consume(tokens)
+            future.set_result(None)
+
+
+    def get_delay(self, tokens: int) -> float:
+        """
+        Get the time until the quota allows a request.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+
+        Returns:
+            float: The delay in seconds (0 if the request can be sent now).
+        """
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+
+        delay = max(0, self.paused_until - now)
+
+        if self.tokens_per_minute > 0:
+            self.tokens = min(self.tokens_per_minute, self.tokens + elapsed * self.tokens_per_minute / 60)
+            tokens = min(tokens, self.tokens_per_minute)
+            if self.tokens < tokens:
+                delay = max(delay, (tokens - self.tokens) * 60 / self.tokens_per_minute)
+
+        if self.requests_per_minute > 0:
+            self.requests = min(self.requests_per_minute, self.requests + elapsed * self.requests_per_minute / 60)
+            if self.requests < 1:
+                delay = max(delay, (1 - self.requests) * 60 / self.requests_per_minute)
+
+        return delay
+
+
+    def get_wait(self, tokens: int) -> float:
+        """
+        Estimate the time a new request would wait for the quota, after the queued requests.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+
+        Returns:
+            float: The estimated wait in seconds (0 if the request can be sent now).
+        """
+        queued_tokens = sum(waiter[2] for waiter in self.waiters if not waiter[-1].done())
+        return self.get_delay(queued_tokens + tokens)
+
+
+    def consume(self, tokens: int) -> None:
+        """
+        Take a request from the quota.
+
+        Args:
+            tokens (int): The estimated number of tokens of the request.
+        """
+        if self.tokens_per_minute > 0:
+            self.tokens -= min(tokens, self.tokens_per_minute)
+        if self.requests_per_minute > 0:
+            self.requests -= 1
+
+
+    def pause(self, delay: float) -> None:
+        """
+        Hold the queued and new requests, after the service throttled a request.
+
+        Args:
+            delay (float): The retry-after delay, in seconds.
+        """
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+class RateLimitScheduler():
+    """
+    A client-side scheduler of the Azure OpenAI requests.
+
+    The requests of each model deployment are admitted by token buckets sized to the deployment
+    quota (tokens and requests per minute). With a backend pool, each backend deployment has its own
+    buckets, and the pool sends the requests and retries them (see OpenAIBackendPool.run). As the service does, the tokens of a request are
+    estimated up front from the size of the prompt and the maximum number of completion tokens.
+    Requests waiting for quota are sent in priority order (interactive answers before follow-up
+    questions and summaries). Throttled requests (429) hold the deployment queue for the retry-after
+    delay and are retried, as are the other errors retried by the OpenAI client: connection errors and
+    timeouts, 408, 409 and server errors (the OpenAI client retries are disabled, so that retries go
+    through the queue).
+    """
+
+    def __init__(self,
+                 tokens_per_minute: int = environment.OPENAI_RATE_LIMIT_TPM,
+                 requests_per_minute: int = environment.OPENAI_RATE_LIMIT_RPM,
+                 max_retries: int = environment.OPENAI_RATE_LIMIT_MAX_RETRIES):
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.max_retries = max_retries
+        self.buckets = {}
+        self.requests = 0
+        self.queued = 0
+        self.throttled = 0
+        self.retries = 0
+        self.wait_total = 0
+        self.wait_max = 0
+
+
+    async def run(self, model: str, tokens: int, call, priority: Priority = Priority.INTERACTIVE):
+        """
+        Send a request when the deployment quota allows it, retrying throttled and failed requests.
+
+        Args:
+            model (str): The model deployment.
+            tokens (int): The estimated number of tokens of the request.
+            call (Callable): The function returning the awaitable of the request.
+            priority (Priority, optional): The priority of the request. Defaults to INTERACTIVE.
+
+        Returns:
+            Any: The response of the request.
+        """
+        bucket = self.get_bucket(model)
+
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(bucket, model, tokens, priority)
+
+            try:
+                return await call()
+
+            except openai.RateLimitError as e:
+                self.throttled += 1
+                if attempt == self.max_retries:
+                    raise
+
+                delay = self.get_retry_delay(e, attempt)
+                logging.warning(f"Azure OpenAI deployment {model} throttled, retrying in {delay:.2f} seconds")
+                bucket.pause(delay)
+
+            except openai.APIError as e:
+                if not is_retryable(e) or attempt == self.max_retries:
+                    raise
+
+                logging.warning(f"Azure OpenAI request to deployment {model} failed, retrying: {e}")
+                await asyncio.sleep(get_backoff_delay(attempt))
+
+            self.retries += 1
+
+
+    def get_bucket(self, key: str, tokens_per_minute: int = None, requests_per_minute: int = None) -> RateLimitBucket:
+        """
+        Get the buckets of a model deployment, created on first use.
+
+        Args:
+            key (str): The model deployment (prefixed with the backend name, for the deployments of a backend pool).
+            tokens_per_minute (int, optional): The tokens per minute quota of the deployment. Defaults to the scheduler quota.
+            requests_per_minute (int, optional): The requests per minute quota of the deployment. Defaults to the scheduler quota.
+
+        Returns:
+            RateLimitBucket: The buckets of the deployment.
+        """
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = RateLimitBucket(
+                self.tokens_per_minute if tokens_per_minute is None else tokens_per_minute,
+                self.requests_per_minute if requests_per_minute is None else requests_per_minute
+            )
+        return bucket
+
+
+    async def acquire(self, bucket: RateLimitBucket, model: str, tokens: int, priority: Priority) -> None:
+        """
+        Wait for the quota of a request, and record the queue wait time.
+
+        Args:
+            bucket (RateLimitBucket): The buckets of the model deployment.
+            model (str): The model deployment.
+            tokens (int): The estimated number of tokens of the request.
+            priority (Priority): The priority of the request.
+        """
+        start_time = time.perf_counter()
+        self.requests += 1
+
+        if bucket.waiters or bucket.get_delay(tokens) > 0:
+            self.queued += 1
+            with telemetry.span('openai_queue', model=model, priority=priority.name.lower()):
+                await bucket.acquire(tokens, priority)
+        else:
+            bucket.consume(tokens)
+
+        wait = time.perf_counter() - start_time
+        self.wait_total += wait
+        self.wait_max = max(self.wait_max, wait)
+        telemetry.openai_queue_wait.observe(wait, model=model, priority=priority.name.lower())
+
+
+    def get_retry_delay(self, error: openai.RateLimitError, attempt: int) -> float:
+        """
+        Get the delay before retrying a throttled request.
+
+        Args:
+            error (RateLimitError): The throttling error.
+            attempt (int): The number of the failed attempt, starting at 0.
+
+        Returns:
+            float: The delay in seconds: the retry-after delay of the response, or an exponential backoff.
+        """
+        retry_after = get_retry_after(error)
+        return retry_after if retry_after is not None else get_backoff_delay(attempt)
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the scheduler counters.
+
+        Returns:
+            dict: The requests, the queued, throttled and retried requests, the requests waiting for quota and the queue wait times in milliseconds.
+        """
+        return {
+            'requests': self.requests,
+            'queued': self.queued,
+            'waiting': sum(not waiter[-1].done() for bucket in self.buckets.values() for waiter in bucket.waiters),
+            'throttled': self.throttled,
+            'retries': self.retries,
+            'queue_wait_avg_ms': round(1000 * self.wait_total / self.requests, 2) if self.requests else 0,
+            'queue_wait_max_ms': round(1000 * self.wait_max, 2)
+        }
@@ -0,0 +1,221 @@
+import json
+import random
+import re
+import uuid
+
+from openai.types.chat.chat_completion_message_tool_call import ChatCompletionMessageToolCall, Function
+from backend.config import environment
+from backend.services.cache import normalize_text
+from backend.services.telemetry import telemetry
+
+
+class ToolRouter():
+    """
+    Decides up front whether a chat turn needs retrieval, to skip the tool-selection round trip to the GPT model.
+
+    In 'router' mode, the search runs right away on the user prompt when retrieval is needed, and the
+    answer model is called once with the results. Retrieval is skipped for small talk ('heuristic'
+    strategy), or when the best search result is not relevant enough ('relevance' strategy). A sample
+    of the turns still goes through the tool-selection call, to measure its latency: the latency saved
+    by the routed turns is estimated from it. In 'speculative' mode, the tool-selection call is kept, and
+    the search on the user prompt runs in parallel with it: its results answer the search tool call with
+    the same (normalized) search query, and are discarded when the model searches for something else.
+    """
+
+    # Prompts answered without retrieval by the heuristic strategy: greetings, thanks and acknowledgements
+    small_talk_pattern = re.compile(
+        r"^(hi|hello|hey|thanks|thank you|thx|ok|okay|bye|goodbye|good (morning|afternoon|evening)|yes|no|great|cool|perfect|got it)"
+        r"( (there|so much|a lot|again|you))*[\s!.?,]*$",
+        re.IGNORECASE
+    )
+
+    # Smoothing factor of the tool-selection latency moving average
+    latency_smoothing = 0.2
+
+    def __init__(self,
+                 mode: str = environment.TOOL_ROUTING_MODE,
+                 strategy: str = environment.TOOL_ROUTER_STRATEGY,
+                 min_reranker_score: float = environment.TOOL_ROUTER_MIN_RERANKER_SCORE,
+                 sample_rate: float = environment.TOOL_ROUTER_SAMPLE_RATE):
+        self.mode = mode
+        self.strategy = strategy
+        self.min_reranker_score = min_reranker_score
+        self.sample_rate = sample_rate
+        self.tool_call_latency = None
+        self.routed = 0
+        self.sampled = 0
+        self.retrieved = 0
+        self.skipped = 0
+        self.speculated = 0
+        self.speculation_misses = 0
+        self.saved_total = 0
+
+
+    def should_route(self) -> bool:
+        """
+        Check whether a turn is routed, rather than sent through the tool-selection call.
+
+        Returns:
+            bool: True in 'router' mode, except for the sampled turns.
+        """
+        if self.mode != 'router':
+            return False
+        if random.random() < self.sample_rate:
+            self.sampled += 1
+            return False
+        self.routed += 1
+        return True
+
+
+    def should_speculate(self) -> bool:
+        """
+        Check whether the search runs speculatively, in parallel with the tool-selection call.
+
+        Returns:
+            bool: True in 'speculative' mode.
+        """
+        return self.mode == 'speculative'
+
+
+    def needs_retrieval(self, user_prompt: str) -> bool:
+        """
+        Decide whether a user prompt needs retrieval (small talk does not).
+
+        Args:
+            user_prompt (str): The user prompt.
+
+        Returns:
+            bool: True if the search should run.
+        """
+        if self.small_talk_pattern.match(user_prompt.strip()):
+            self.skipped += 1
+            return False
+        return True
+
+
+    def is_relevant(self, records: list) -> bool:
+        """
+        Decide whether search results are relevant enough to be sent to the model ('relevance' strategy).
+
+        Args:
+            records (list): The search results.
+
+        Returns:
+            bool: True if the results should be sent to the model.
+        """
+        if self.strategy != 'relevance':
+            self.retrieved += 1
+            return True
+
+        scores = [record['@search.reranker_score'] for record in records if record.get('@search.reranker_score') is not None]
+        if scores and max(scores) < self.min_reranker_score:
+            self.skipped += 1
+            return False
+
+        self.retrieved += 1
+        return True
+
+
+    def get_search_query(self, user_prompt: str, previous_user_prompt: str = None) -> str:
+        """
+        Get the search query of a user prompt. Short follow-up prompts ('and in Europe?') are completed
+        with the previous user prompt, since the query is not rewritten by the model.
+
+        Args:
+            user_prompt (str): The user prompt.
+            previous_user_prompt (str, optional): The previous user prompt of the session.
+
+        Returns:
+            str: The search query.
+        """
+        if previous_user_prompt and len(user_prompt.split()) < 6:
+            return f"{previous_user_prompt} {user_prompt}"
+        return user_prompt
+
+
+    def matches_search_query(self, speculative_query: str, search_query: str) -> bool:
+        """
+        Check whether the search query of a tool call is the query of the speculative search (case and whitespace insensitive).
+
+        Args:
+            speculative_query (str): The search query of the speculative search.
+            search_query (str): The search query of the tool call.
+
+        Returns:
+            bool: True if the speculative results answer the tool call.
+        """
+        return normalize_text(speculative_query or '') == normalize_text(search_query or '')
+
+
+    def record_speculation_miss(self) -> None:
+        """
+        Record a speculative search discarded because the model searched for another query.
+        """
+        self.speculation_misses += 1
+
+
+    def get_tool_call(self, search_query: str) -> ChatCompletionMessageToolCall:
+        """
+        Create the search tool call of a routed turn, as if the model had called the tool.
+
+        Args:
+            search_query (str): The search query.
+
+        Returns:
+            ChatCompletionMessageToolCall: The tool call.
+        """
+        return ChatCompletionMessageToolCall(
+            id = f"call_{uuid.uuid4().hex[:24]}",
+            type = 'function',
+            function = Function(name = 'sample_search', arguments = json.dumps({'search_query': search_query}))
+        )
+
+
+    def record_tool_call_latency(self, latency: float) -> None:
+        """
+        Update the moving average of the tool-selection call latency.
+
+        Args:
+            latency (float): The latency of a tool-selection call, in seconds.
+        """
+        self.tool_call_latency = latency if self.tool_call_latency is None else \
+            self.latency_smoothing * latency + (1 - self.latency_smoothing) * self.tool_call_latency
+
+
+    def record_saving(self, mode: str, saved: float = None) -> None:
+        """
+        Record the latency saved by a turn.
+
+        Args:
+            mode (str): The routing mode ('router' or 'speculative').
+            saved (float, optional): The latency saved, in seconds. Defaults to the estimated tool-selection call latency.
+        """
+        if saved is None:
+            saved = self.tool_call_latency
+        if saved is None:
+            return
+
+        if mode == 'speculative':
+            self.speculated += 1
+        self.saved_total += saved
+        telemetry.tool_routing_saved.observe(saved, mode=mode)
+
+
+    def get_stats(self) -> dict:
+        """
+        Get the routing counters.
+
+        Returns:
+            dict: The routed, sampled and speculative turns, the discarded speculative searches, the turns with and without retrieval, and the latency saved in milliseconds.
+        """
+        return {
+            'mode': self.mode,
+            'routed': self.routed,
+            'sampled': self.sampled,
+            'retrieved': self.retrieved,
+            'skipped': self.skipped,
+            'speculated': self.speculated,
+            'speculation_misses': self.speculation_misses,
+            'tool_call_latency_ms': round(1000 * self.tool_call_latency, 2) if self.tool_call_latency is not None else None,
+            'saved_total_ms': round(1000 * self.saved_total, 2)
+        }
@@ -1,61 +1,193 @@
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.models import VectorizedQuery
 from azure.core.credentials import AzureKeyCredential
-from backend.services.gpt import GptModel
+from backend.services.gpt import GptModel, AsyncGptModel
 from backend.config.models import SearchRequest
 from backend.config import environment
+from backend.services.clients import ClientRegistry
+from backend.services.searchbackend import AzureSearchBackend
+from backend.services.telemetry import telemetry
 
 
-class CognitiveSearch():
+class CognitiveSearchBase():
     """
-    Provides search functionality using Azure AI Cognitive Search.
+    Base class with the query definition shared by the synchronous and asyncio search services.
     """
 
-    def __init__(self):
-        
-        self.client = SearchClient(
-            endpoint = environment.AZURE_SEARCH_ENDPOINT,
-            api_version = environment.AZURE_SEARCH_API_VERSION,
-            index_name = environment.AZURE_SEARCH_INDEX_NAME,
-            credential = AzureKeyCredential(environment.AZURE_SEARCH_API_KEY)
-        )
-        self.gpt_model = GptModel()
+    select_fields = ["id", "title", "content", "url"]
+    search_fields = ["title", "content", "keyphrases"]
 
+    # Semantic captions are only requested when they replace the content sent to the GPT model
+    query_caption = "extractive" if environment.TOOL_PAYLOAD_COMPACTION_ENABLED and environment.TOOL_PAYLOAD_USE_CAPTIONS else None
 
-    def search_index(self, request: SearchRequest):
+    def get_search_args(self, request: SearchRequest, embedding: list) -> dict:
         """
-        Performs a hybrid + semantic search in the Azure AI Cognitive Search index database.
+        Builds the arguments of a hybrid + semantic search query.
 
         Args:
             request (SearchRequest): The search request object containing the search query and optional filters.
+            embedding (list): The embeddings of the search query.
 
         Returns:
-            azure.search.documents.SearchResults: The search results from the Azure Cognitive Search service.
+            dict: The search query arguments.
         """
-        embedding = self.gpt_model.generate_embeddings(request.search_query)
-
         vector_queries = [VectorizedQuery(
             vector = embedding,
             k_nearest_neighbors = 10,
             fields = "content_vector"
         )]
 
-        results = self.client.search(
+        return dict(
             session_id = request.session_id,
             include_total_count = True,
             top = request.max_results,
             filter = "",
             order_by = None,
-            select = ["id", "title", "content", "url"],
-            search_fields = ["title", "content", "keyphrases"],
+            select = self.select_fields,
+            search_fields = self.search_fields,
             search_text = request.search_query,
             query_type = "semantic",
             search_mode = "any",
             scoring_statistics = "global",
             scoring_profile = "scoring-profile",
             semantic_configuration_name = "semantic-config",
+            query_caption = self.query_caption,
             vector_filter_mode = "preFilter",
             vector_queries = vector_queries
         )
 
+
+class CognitiveSearch(CognitiveSearchBase):
+    """
+    Provides search functionality using Azure AI Cognitive Search.
+    """
+
+    def __init__(self, clients: ClientRegistry = None, gpt_model: GptModel = None):
+
+        if clients:
+            self.client = clients.search_client
+        else:
+            self.client = SearchClient(
+                endpoint = environment.AZURE_SEARCH_ENDPOINT,
+                api_version = environment.AZURE_SEARCH_API_VERSION,
+                index_name = environment.AZURE_SEARCH_INDEX_NAME,
+                credential = AzureKeyCredential(environment.AZURE_SEARCH_API_KEY)
+            )
+        self.gpt_model = gpt_model if gpt_model else GptModel(clients = clients)
+
+
+    def search_index(self, request: SearchRequest, embedding: list = None):
+        """
+        Performs a hybrid + semantic search in the Azure AI Cognitive Search index database.
+
+        Args:
+            request (SearchRequest): The search request object containing the search query and optional filters.
+            embedding (list, optional): The precomputed embeddings of the search query. Generated if not provided.
+
+        Returns:
+            azure.search.documents.SearchResults: The search results from the Azure Cognitive Search service.
+        """
+        if embedding is None:
+            embedding = self.gpt_model.generate_embeddings(request.search_query)
+
+        results = self.client.search(**self.get_search_args(request, embedding))
+
         return results
+
+
+class AsyncCognitiveSearch(CognitiveSearchBase):
+    """
+    Provides search functionality using Azure AI Cognitive Search, using the asyncio search client.
+    """
+
+    def __init__(self, clients: ClientRegistry = None, gpt_model: AsyncGptModel = None):
+
+        if clients:
+            self.client = clients.async_search_client
+        else:
+            self.client = AzureSearchBackend(AsyncSearchClient(
+                endpoint = environment.AZURE_SEARCH_ENDPOINT,
+                api_version = environment.AZURE_SEARCH_API_VERSION,
+                index_name = environment.AZURE_SEARCH_INDEX_NAME,
+                credential = AzureKeyCredential(environment.AZURE_SEARCH_API_KEY)
+            ))
+        self.gpt_model = gpt_model if gpt_model else AsyncGptModel(clients = clients)
+        self.search_cache = clients.search_cache if clients else None
+        self.index_version = clients.index_version if clients else None
+
+
+    async def search_index(self, request: SearchRequest, embedding: list = None) -> list:
+        """
+        Performs a hybrid + semantic search in the Azure AI Cognitive Search index database.
+
+        Results are served from the search result cache when enabled, and concurrent identical
+        queries are sent to the search service only once.
+
+        Args:
+            request (SearchRequest): The search request object containing the search query and optional filters.
+            embedding (list, optional): The precomputed embeddings of the search query. Generated if not provided.
+
+        Returns:
+            list: The search results (documents) from the Azure Cognitive Search service.
+        """
+        if not self.search_cache:
+            return await self.query_index(request, embedding)
+
+        await self.index_version.get()
+
+        return await self.search_cache.get_or_create(
+            self.get_cache_key(request),
+            lambda: self.query_index(request, embedding)
+        )
+
+
+    def is_cached(self, request: SearchRequest) -> bool:
+        """
+        Check whether the results of a search request are in the search result cache.
+
+        Args:
+            request (SearchRequest): The search request object containing the search query and optional filters.
+
+        Returns:
+            bool: True if the results are cached.
+        """
+        return self.search_cache is not None and self.search_cache.contains(self.get_cache_key(request))
+
+
+    def get_cache_key(self, request: SearchRequest) -> str:
+        """
+        Get the search result cache key of a search request.
+
+        Args:
+            request (SearchRequest): The search request object containing the search query and optional filters.
+
+        Returns:
+            str: The cache key.
+        """
+        return self.search_cache.get_key(
+            request.search_query,
+            max_results = request.max_results,
+            select = self.select_fields,
+            search_fields = self.search_fields,
+            query_caption = self.query_caption
+        )
+
+
+    async def query_index(self, request: SearchRequest, embedding: list = None) -> list:
+        """
+        Sends a hybrid + semantic search query to the Azure AI Cognitive Search service.
+
+        Args:
+            request (SearchRequest): The search request object containing the search query and optional filters.
+            embedding (list, optional): The precomputed embeddings of the search query. Generated if not provided.
+
+        Returns:
+            list: The search results (documents) from the Azure Cognitive Search service.
+        """
+        if embedding is None:
+            embedding = await self.gpt_model.generate_embeddings(request.search_query)
+
+        with telemetry.span('search_query'):
+            results = await self.client.search(**self.get_search_args(request, embedding))
+            return [record async for record in results]
@@ -0,0 +1,131 @@
+from abc import ABC, abstractmethod
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
+
+
+class SearchBackend(ABC):
+    """
+    Interface of a search index backend, with the query and document operations of the asyncio Azure AI
+    Search client used by the application (search, ingestion and startup checks).
+    """
+
+    @abstractmethod
+    async def search(self, search_text: str = None, **kwargs):
+        """
+        Search the index, with the query arguments of the Azure AI Search client.
+
+        Args:
+            search_text (str, optional): The text query ('*' matches all the documents).
+
+        Returns:
+            AsyncIterator: The results (documents with their '@search.*' fields), with their count (get_count()).
+        """
+
+
+    @abstractmethod
+    async def upload_documents(self, documents: list, **kwargs) -> list:
+        """
+        Add or replace documents.
+
+        Args:
+            documents (list): The documents.
+
+        Returns:
+            list: The IndexingResult of each document.
+        """
+
+
+    @abstractmethod
+    async def merge_or_upload_documents(self, documents: list, **kwargs) -> list:
+        """
+        Update the fields of documents, or add the documents that do not exist.
+
+        Args:
+            documents (list): The documents.
+
+        Returns:
+            list: The IndexingResult of each document.
+        """
+
+
+    @abstractmethod
+    async def delete_documents(self, documents: list, **kwargs) -> list:
+        """
+        Delete documents.
+
+        Args:
+            documents (list): The documents (only their key is used).
+
+        Returns:
+            list: The IndexingResult of each document.
+        """
+
+
+    @abstractmethod
+    async def get_document(self, key: str, selected_fields: list = None, **kwargs) -> dict:
+        """
+        Get a document.
+
+        Args:
+            key (str): The key of the document.
+            selected_fields (list, optional): The fields returned. Defaults to all the fields.
+
+        Returns:
+            dict: The document.
+        """
+
+
+    @abstractmethod
+    async def get_document_count(self, **kwargs) -> int:
+        """
+        Count the documents of the index.
+
+        Returns:
+            int: The number of documents.
+        """
+
+
+    async def save(self) -> None:
+        """
+        Persist the index content, for backends that are not persisted as they change.
+        """
+
+
+    async def close(self) -> None:
+        pass
+
+
+class AzureSearchBackend(SearchBackend):
+    """
+    The Azure AI Search backend: the asyncio Azure AI Search client, behind the search backend interface.
+    """
+
+    def __init__(self, client: AsyncSearchClient):
+        self.client = client
+
+
+    async def search(self, search_text: str = None, **kwargs):
+        return await self.client.search(search_text=search_text, **kwargs)
+
+
+    async def upload_documents(self, documents: list, **kwargs) -> list:
+        return await self.client.upload_documents(documents=documents, **kwargs)
+
+
+    async def merge_or_upload_documents(self, documents: list, **kwargs) -> list:
+        return await self.client.merge_or_upload_documents(documents=documents, **kwargs)
+
+
+    async def delete_documents(self, documents: list, **kwargs) -> list:
+        return await self.client.delete_documents(documents=documents, **kwargs)
+
+
+    async def get_document(self, key: str, selected_fields: list = None, **kwargs) -> dict:
+        return await self.client.get_document(key=key, selected_fields=selected_fields, **kwargs)
+
+
+    async def get_document_count(self, **kwargs) -> int:
+        return await self.client.get_document_count(**kwargs)
+
+
+    async def close(self) -> None:
+        await self.client.close()
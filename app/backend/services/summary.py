@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+
+class SummaryScheduler():
+    """
+    Runs the updates of the conversation summaries in the background, one at a time per session.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+
+    def schedule(self, session_id: str, coroutine_factory) -> bool:
+        """
+        Schedule the update of the conversation summary of a session, unless an update is already running.
+
+        Args:
+            session_id (str): The ID of the session.
+            coroutine_factory (Callable): A function returning the coroutine that updates the summary.
+
+        Returns:
+            bool: True if the update was scheduled.
+        """
+        task = self.tasks.get(session_id)
+        if task and not task.done():
+            return False
+
+        task = asyncio.create_task(coroutine_factory())
+        task.add_done_callback(self.log_task_error)
+        task.add_done_callback(lambda _: self.tasks.pop(session_id, None))
+        self.tasks[session_id] = task
+
+        return True
+
+
+    def close(self) -> None:
+        """
+        Cancel all running summary updates.
+        """
+        for task in self.tasks.values():
+            task.cancel()
+        self.tasks.clear()
+
+
+    def log_task_error(self, task: asyncio.Task) -> None:
+        """
+        Log the error of a failed summary update.
+
+        Args:
+            task (asyncio.Task): The completed task.
+        """
+        if not task.cancelled() and task.exception():
+            logging.error(f"Error updating the conversation summary: {task.exception()}")
@@ -0,0 +1,243 @@
+import logging
+import time
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from backend.config import environment
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+
+# Stage durations of the current request, in seconds (set by the HTTP middleware)
+request_timings: ContextVar[dict] = ContextVar('request_timings', default=None)
+
+
+class Histogram():
+    """
+    A Prometheus-style histogram with labels.
+    """
+
+    def __init__(self, name: str, description: str, buckets: list, labels: list):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        Record a value.
+
+        Args:
+            value (float): The value.
+            **labels: The label values of the series.
+        """
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * len(self.buckets) + [0, 0]
+
+        for index, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+
+    def render(self) -> list:
+        """
+        Render the histogram in the Prometheus text exposition format.
+
+        Returns:
+            list: The lines of the histogram.
+        """
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+
+        for key, series in self.series.items():
+            labels = [f'{label}="{value}"' for label, value in zip(self.labels, key)]
+            for bucket, count in zip(self.buckets + ['+Inf'], series[:-2] + [series[-1]]):
+                bucket_labels = ','.join(labels + [f'le="{bucket}"'])
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {count}")
+            lines.append(f"{self.name}_sum{{{','.join(labels)}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{','.join(labels)}}} {series[-1]}")
+
+        return lines
+
+
+class Telemetry():
+    """
+    Spans and metrics of the chat pipeline.
+
+    Each span measures a stage of a request or a service call. Spans are exported through the
+    OpenTelemetry API when it is installed (the exporter is configured by the deployment), their
+    durations are recorded in Prometheus-style histograms, and the stage durations of the current
+    request are collected for the Server-Timing response header.
+    """
+
+    def __init__(self):
+        self.tracer = trace.get_tracer('azure-ai-assistant') if trace and environment.TELEMETRY_TRACING_ENABLED else None
+        self.stage_duration = Histogram(
+            'assistant_stage_duration_seconds', 'Duration of the chat pipeline stages and service calls.',
+            [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30], ['stage']
+        )
+        self.request_duration = Histogram(
+            'assistant_request_duration_seconds', 'Duration of the HTTP requests.',
+            [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60], ['method', 'route', 'status']
+        )
+        self.tokens = Histogram(
+            'assistant_model_tokens', 'Number of tokens of the GPT model calls.',
+            [10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000], ['model', 'type']
+        )
+        self.request_charge = Histogram(
+            'assistant_cosmos_request_charge', 'Request units consumed by the Cosmos DB operations.',
+            [1, 2, 5, 10, 20, 50, 100, 200, 500], ['operation']
+        )
+        self.openai_queue_wait = Histogram(
+            'assistant_openai_queue_wait_seconds', 'Time the GPT model requests waited for the deployment quota.',
+            [0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60], ['model', 'priority']
+        )
+        self.openai_backend_duration = Histogram(
+            'assistant_openai_backend_duration_seconds', 'Duration of the requests to each Azure OpenAI backend, by outcome.',
+            [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60], ['backend', 'outcome']
+        )
+        self.tool_routing_saved = Histogram(
+            'assistant_tool_routing_saved_seconds', 'Latency saved per chat turn by the tool routing fast path.',
+            [0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10], ['mode']
+        )
+
+
+    @contextmanager
+    def span(self, name: str, current: bool = True, **attributes):
+        """
+        Measure a stage or a service call.
+
+        Args:
+            name (str): The name of the stage (a Server-Timing metric name: letters, digits and underscores).
+            current (bool, optional): Whether the span is the parent of the spans started inside it. Must be False
+                for spans around the yield statements of async generators. Defaults to True.
+            **attributes: The attributes of the OpenTelemetry span.
+        """
+        start_time = time.perf_counter()
+        otel_span = self.tracer.start_span(name, attributes={
+            key: str(value) for key, value in attributes.items() if value is not None
+        }) if self.tracer else None
+
+        try:
+            if otel_span and current:
+                with trace.use_span(otel_span, end_on_exit=True):
+                    yield
+            else:
+                yield
+
+        finally:
+            if otel_span and not current:
+                otel_span.end()
+
+            duration = time.perf_counter() - start_time
+            self.stage_duration.observe(duration, stage=name)
+
+            timings = request_timings.get()
+            if timings is not None:
+                timings[name] = timings.get(name, 0) + duration
+
+
+    def record_tokens(self, model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> None:
+        """
+        Record the token usage of a GPT model call.
+
+        Args:
+            model (str): The model deployment.
+            prompt_tokens (int): The number of prompt tokens.
+            completion_tokens (int): The number of completion tokens.
+            cached_tokens (int, optional): The number of prompt tokens served from the prompt cache. Defaults to 0.
+        """
+        self.tokens.observe(prompt_tokens, model=model, type='prompt')
+        self.tokens.observe(completion_tokens, model=model, type='completion')
+        self.tokens.observe(cached_tokens, model=model, type='cached')
+
+
+    def get_request_charge_hook(self, operation: str):
+        """
+        Get a Cosmos DB response hook recording the request charge of an operation.
+
+        Args:
+            operation (str): The name of the operation.
+
+        Returns:
+            Callable: The response hook.
+        """
+        def response_hook(headers, *_):
+            try:
+                charge = headers.get('x-ms-request-charge')
+                if charge is not None:
+                    self.request_charge.observe(float(charge), operation=operation)
+            except Exception as e:
+                logging.debug(f"Error recording the Cosmos DB request charge: {e}")
+
+        return response_hook
+
+
+    def get_server_timing(self, timings: dict) -> str:
+        """
+        Format stage durations as a Server-Timing header.
+
+        Args:
+            timings (dict): The stage durations, in seconds.
+
+        Returns:
+            str: The Server-Timing header value (durations in milliseconds).
+        """
+        return ', '.join(f"{name};dur={1000 * duration:.1f}" for name, duration in timings.items())
+
+
+    def render_metrics(self, stats: dict = None) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format.
+
+        Args:
+            stats (dict, optional): The counters of the caches, rendered as cache hit and miss counters.
+
+        Returns:
+            str: The metrics.
+        """
+        lines = []
+        for histogram in [self.request_duration, self.stage_duration, self.tokens, self.request_charge, self.openai_queue_wait,
+                          self.openai_backend_duration, self.tool_routing_saved]:
+            lines += histogram.render()
+
+        caches = self.get_cache_counters(stats or {})
+        for result in ['hits', 'misses']:
+            lines += [f"# HELP assistant_cache_{result}_total Number of cache {result}.", f"# TYPE assistant_cache_{result}_total counter"]
+            lines += [f'assistant_cache_{result}_total{{cache="{name}"}} {counters[result]}' for name, counters in caches.items()]
+
+        return '\n'.join(lines) + '\n'
+
+
+    def get_cache_counters(self, stats: dict, prefix: str = '') -> dict:
+        """
+        Get the hit and miss counters of the caches from the registry statistics.
+
+        Args:
+            stats (dict): The statistics, possibly nested (for instance the tiers of a cache).
+            prefix (str, optional): The name prefix of the nested caches.
+
+        Returns:
+            dict: The hit and miss counters, by cache name.
+        """
+        caches = {}
+        for name, counters in stats.items():
+            if not isinstance(counters, dict):
+                continue
+            if 'hits' in counters and 'misses' in counters:
+                caches[f"{prefix}{name}"] = counters
+            else:
+                caches.update(self.get_cache_counters(counters, f"{prefix}{name}_"))
+        return caches
+
+
+# Process-wide telemetry
+telemetry = Telemetry()
@@ -0,0 +1,318 @@
+"""
+In-process stand-ins for the Azure OpenAI, Azure AI Search and Cosmos DB clients, with configurable
+latency and token distributions, used by the benchmark harness.
+"""
+import asyncio
+import hashlib
+import json
+import math
+import random
+import uuid
+
+from types import SimpleNamespace
+from backend.services.persistence import LocalChatHistoryContainer
+
+
+class Distribution():
+    """
+    A log-normal distribution, defined by its median and the spread (sigma) of its logarithm.
+    """
+
+    def __init__(self, median: float, sigma: float = 0.5, rng: random.Random = None):
+        self.median = median
+        self.sigma = sigma
+        self.rng = rng or random.Random()
+
+
+    def sample(self) -> float:
+        """
+        Draw a value from the distribution.
+
+        Returns:
+            float: The value (the median if the sigma is 0).
+        """
+        if self.median <= 0:
+            return 0
+        return self.median * math.exp(self.rng.gauss(0, self.sigma)) if self.sigma > 0 else self.median
+
+
+class FakeChatCompletions():
+    """
+    Stand-in for the chat completions API. The model calls the search tool once when tools are
+    offered, answers with a random number of tokens, and returns follow-up questions as JSON.
+
+    Prompt caching is emulated like the service does it: the longest prefix (tools and messages)
+    of a previous request of the deployment is cached, from 1024 tokens and in steps of 128 tokens.
+    """
+
+    min_cached_tokens = 1024
+    cached_tokens_step = 128
+
+    def __init__(self, latency: Distribution, completion_tokens: Distribution, token_latency: Distribution):
+        self.latency = latency
+        self.completion_tokens = completion_tokens
+        self.token_latency = token_latency
+        self.calls = 0
+        self.prefixes = set()
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+
+    def count_tokens(self, value) -> int:
+        return len(str(value or '')) // 4
+
+
+    def get_cached_tokens(self, messages: list, tools: list, model: str) -> int:
+        """
+        Get the number of cached prompt tokens of a request, and add its prefixes to the cache.
+
+        Args:
+            messages (list): The messages of the request.
+            tools (list): The tools functions of the request.
+            model (str): The model deployment.
+
+        Returns:
+            int: The number of cached tokens.
+        """
+        digest = hashlib.sha256(f"{model}{json.dumps(tools or [], sort_keys=True)}".encode('utf-8'))
+        tokens = self.count_tokens(json.dumps(tools)) if tools else 0
+        cached_tokens = 0
+
+        for message in messages:
+            digest.update(json.dumps(message, sort_keys=True, default=str).encode('utf-8'))
+            tokens += self.count_tokens(message.get('content')) + 4
+            prefix = digest.copy().hexdigest()
+            if prefix in self.prefixes:
+                cached_tokens = tokens
+            else:
+                self.prefixes.add(prefix)
+
+        if cached_tokens < self.min_cached_tokens:
+            return 0
+        return cached_tokens - cached_tokens % self.cached_tokens_step
+
+
+    async def create(self, messages: list, tools: list = None, stream: bool = False, model: str = None, tool_choice: str = None, **kwargs):
+        self.calls += 1
+        prompt_tokens = sum(self.count_tokens(message.get('content')) for message in messages) + 4 * len(messages)
+        if tools:
+            prompt_tokens += self.count_tokens(json.dumps(tools))
+        cached_tokens = self.get_cached_tokens(messages, tools, model)
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        completion_tokens = max(1, int(self.completion_tokens.sample()))
+
+        tool_calls = None
+        if tools and tool_choice != 'none' and not any(message.get('role') == 'tool' for message in messages):
+            query = str(messages[-1].get('content') or '')[:100]
+            tool_calls = [SimpleNamespace(
+                id = f"call_{uuid.uuid4().hex[:12]}",
+                type = 'function',
+                function = SimpleNamespace(name = 'sample_search', arguments = json.dumps({'search_query': query}))
+            )]
+            completion_tokens = 20
+
+        if any('JSON object' in str(message.get('content')) for message in messages if message.get('role') == 'system'):
+            content = json.dumps({'q1': 'What else should I know?', 'q2': 'Can you give an example?', 'q3': 'Where can I learn more?'})
+        else:
+            content = ' '.join(['lorem'] * completion_tokens)
+
+        usage = SimpleNamespace(
+            prompt_tokens = prompt_tokens,
+            completion_tokens = completion_tokens,
+            total_tokens = prompt_tokens + completion_tokens,
+            prompt_tokens_details = SimpleNamespace(cached_tokens = cached_tokens)
+        )
+        response_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        if stream:
+            return self.stream(response_id, model, content, tool_calls, usage)
+
+        await asyncio.sleep(self.latency.sample() + completion_tokens * self.token_latency.sample())
+
+        return SimpleNamespace(
+            id = response_id,
+            model = model,
+            choices = [SimpleNamespace(message = SimpleNamespace(
+                content = None if tool_calls else content,
+                tool_calls = tool_calls
+            ))],
+            usage = usage
+        )
+
+
+    async def stream(self, response_id: str, model: str, content: str, tool_calls: list, usage: SimpleNamespace):
+        await asyncio.sleep(self.latency.sample())
+
+        def chunk(content = None, tool_calls = None, usage = None):
+            return SimpleNamespace(
+                id = response_id,
+                model = model,
+                choices = [] if usage else [SimpleNamespace(delta = SimpleNamespace(content = content, tool_calls = tool_calls))],
+                usage = usage
+            )
+
+        if tool_calls:
+            yield chunk(tool_calls = [
+                SimpleNamespace(index = index, id = tool_call.id, function = tool_call.function)
+                for index, tool_call in enumerate(tool_calls)
+            ])
+        else:
+            for word in content.split(' '):
+                await asyncio.sleep(self.token_latency.sample())
+                yield chunk(content = word + ' ')
+
+        yield chunk(usage = usage)
+
+
+class FakeEmbeddings():
+    """
+    Stand-in for the embeddings API, returning deterministic unit vectors derived from the input texts.
+    """
+
+    def __init__(self, latency: Distribution, dimensions: int = 1536):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.calls = 0
+
+
+    async def create(self, model: str, input, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+
+        texts = input if isinstance(input, list) else [input]
+        return SimpleNamespace(data = [
+            SimpleNamespace(index = index, embedding = self.get_embedding(text))
+            for index, text in enumerate(texts)
+        ])
+
+
+    def get_embedding(self, text: str) -> list:
+        rng = random.Random(hashlib.sha256(text.encode('utf-8')).digest())
+        vector = [rng.gauss(0, 1) for _ in range(self.dimensions)]
+        norm = math.sqrt(sum(value * value for value in vector))
+        return [value / norm for value in vector]
+
+
+class FakeAsyncOpenAI():
+    """
+    Stand-in for the asyncio Azure OpenAI client.
+    """
+
+    def __init__(self, chat_latency: Distribution, completion_tokens: Distribution, token_latency: Distribution, embedding_latency: Distribution):
+        self.chat = SimpleNamespace(completions = FakeChatCompletions(chat_latency, completion_tokens, token_latency))
+        self.embeddings = FakeEmbeddings(embedding_latency)
+
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeAsyncSearchClient():
+    """
+    Stand-in for the asyncio Azure AI Search client, returning documents of a synthetic corpus.
+    """
+
+    vocabulary = [
+        'policy', 'employee', 'request', 'approval', 'manager', 'portal', 'benefit', 'leave', 'days', 'year',
+        'submit', 'form', 'account', 'password', 'device', 'office', 'travel', 'expense', 'receipt', 'plan',
+        'the', 'a', 'of', 'to', 'and', 'in', 'for', 'is', 'with', 'on'
+    ]
+
+    def __init__(self, latency: Distribution, document_tokens: int = 400, corpus_size: int = 1000):
+        self.latency = latency
+        self.document_tokens = document_tokens
+        self.corpus_size = corpus_size
+        self.calls = 0
+
+
+    async def search(self, search_text: str = None, top: int = 5, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency.sample())
+
+        seed = int(hashlib.sha256((search_text or '').encode('utf-8')).hexdigest(), 16)
+        documents = [
+            dict(self.get_document((seed + index) % self.corpus_size), **{
+                '@search.score': 1.0 / (index + 1),
+                '@search.reranker_score': 3.0 - index * 0.1,
+                '@search.captions': None
+            })
+            for index in range(top or 5)
+        ]
+
+        async def iterate():
+            for document in documents:
+                yield document
+
+        return iterate()
+
+
+    def get_document(self, number: int) -> dict:
+        rng = random.Random(number)
+        return {
+            'id': f"doc-{number}",
+            'title': f"Document {number}",
+            'content': ' '.join(rng.choice(self.vocabulary) for _ in range(self.document_tokens)),
+            'url': f"https://example.com/documents/{number}"
+        }
+
+
+    async def get_document_count(self) -> int:
+        return self.corpus_size
+
+
+    async def close(self) -> None:
+        pass
+
+
+class FakeCosmosContainer(LocalChatHistoryContainer):
+    """
+    Stand-in for the asyncio Cosmos DB container client: the in-memory chat history container,
+    with latency and request charges.
+    """
+
+    def __init__(self, latency: Distribution, request_charge: float = 5.0):
+        super().__init__()
+        self.latency = latency
+        self.request_charge = request_charge
+
+
+    def query_items(self, *args, response_hook = None, **kwargs):
+        items = super().query_items(*args, **kwargs)
+
+        async def iterate():
+            await asyncio.sleep(self.latency.sample())
+            self.charge(response_hook, 2.5 + self.request_charge / 2)
+            async for item in items:
+                yield item
+
+        return iterate()
+
+
+    async def upsert_item(self, body: dict, response_hook = None, **kwargs) -> dict:
+        await asyncio.sleep(self.latency.sample())
+        self.charge(response_hook, self.request_charge)
+        return await super().upsert_item(body)
+
+
+    async def read_item(self, item: str, partition_key: str, response_hook = None, **kwargs) -> dict:
+        await asyncio.sleep(self.latency.sample())
+        self.charge(response_hook, 1)
+        return await super().read_item(item, partition_key)
+
+
+    async def patch_item(self, item: str, partition_key: str, patch_operations: list, response_hook = None, **kwargs) -> dict:
+        await asyncio.sleep(self.latency.sample())
+        self.charge(response_hook, self.request_charge)
+        return await super().patch_item(item, partition_key, patch_operations, **kwargs)
+
+
+    async def execute_item_batch(self, batch_operations: list, partition_key: str, response_hook = None, **kwargs) -> list:
+        await asyncio.sleep(self.latency.sample())
+        self.charge(response_hook, self.request_charge * len(batch_operations))
+        return [await LocalChatHistoryContainer.upsert_item(self, arguments[0]) for _, arguments, *_ in batch_operations]
+
+
+    def charge(self, response_hook, request_charge: float) -> None:
+        if response_hook:
+            response_hook({'x-ms-request-charge': str(request_charge)}, None)
@@ -0,0 +1,326 @@
+"""
+Benchmark of the chat API, run in process against stand-ins for Azure OpenAI, Azure AI Search and
+Cosmos DB (no Azure resources are needed).
+
+Virtual users hold multi-turn conversations through /api/chat at a target concurrency, and rate a
+share of the responses through /api/feedback. The report (JSON) includes the latency percentiles
+and throughput of each endpoint, the event loop lag, the stage timings of the Server-Timing header
+and the statistics of the client registry (caches, tool payload compaction, history writes).
+
+The service settings are read from the environment as usual, for instance:
+
+    cd app
+    HISTORY_WRITE_BEHIND_ENABLED=true python -m benchmarks.run --concurrency 50 --requests 1000 --output results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+
+# Placeholder service settings, so that the Azure clients can be created (they are replaced by the stand-ins)
+for name, value in {
+    'AZURE_OPENAI_ENDPOINT': 'https://benchmark.openai.azure.com/',
+    'AZURE_OPENAI_API_KEY': 'benchmark',
+    'AZURE_OPENAI_API_VERSION': '2024-06-01',
+    'AZURE_OPENAI_API_MODEL_CHAT': 'gpt-4o',
+    'AZURE_OPENAI_API_MODEL_EMBEDDING': 'text-embedding-3-small',
+    'AZURE_SEARCH_ENDPOINT': 'https://benchmark.search.windows.net/',
+    'AZURE_SEARCH_API_KEY': 'benchmark',
+    'AZURE_SEARCH_API_VERSION': '2024-07-01',
+    'AZURE_SEARCH_INDEX_NAME': 'benchmark',
+    'CHAT_HISTORY_STORE': 'local'
+}.items():
+    os.environ.setdefault(name, value)
+
+import httpx
+import main
+
+from backend.services.clients import ClientRegistry
+from backend.services.localsearch import LocalSearchClient
+from benchmarks.fakes import Distribution, FakeAsyncOpenAI, FakeAsyncSearchClient, FakeCosmosContainer
+
+
+QUESTIONS = [
+    "What is the vacation policy?",
+    "How do I reset my password?",
+    "Which health plans are available?",
+    "How do I submit an expense report?",
+    "What are the office opening hours?",
+    "How do I request a new laptop?",
+    "What is the parental leave policy?",
+    "How do I book a meeting room?"
+]
+
+
+def get_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+
+    Args:
+        args (list, optional): The arguments. Defaults to the command line arguments.
+
+    Returns:
+        argparse.Namespace: The benchmark settings.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark of the chat API against in-process service stand-ins.")
+    parser.add_argument('--requests', type=int, default=200, help="number of chat requests (default: 200)")
+    parser.add_argument('--concurrency', type=int, default=10, help="number of concurrent virtual users (default: 10)")
+    parser.add_argument('--turns', type=int, default=4, help="number of chat turns per session (default: 4)")
+    parser.add_argument('--feedback-ratio', type=float, default=0.3, help="share of the responses rated through /api/feedback (default: 0.3)")
+    parser.add_argument('--questions', type=int, default=len(QUESTIONS), help="number of distinct questions asked, the lower the more cache hits (default: all)")
+    parser.add_argument('--chat-latency-ms', type=float, default=300, help="median latency of a chat completion before the first token (default: 300)")
+    parser.add_argument('--token-latency-ms', type=float, default=5, help="median latency of each completion token (default: 5)")
+    parser.add_argument('--completion-tokens', type=float, default=150, help="median number of completion tokens (default: 150)")
+    parser.add_argument('--embedding-latency-ms', type=float, default=30, help="median latency of an embeddings call (default: 30)")
+    parser.add_argument('--search-latency-ms', type=float, default=80, help="median latency of a search query (default: 80)")
+    parser.add_argument('--local-index', help="directory of a saved local search index, queried in process instead of the search stand-in")
+    parser.add_argument('--document-tokens', type=int, default=400, help="number of tokens of each search result (default: 400)")
+    parser.add_argument('--cosmos-latency-ms', type=float, default=10, help="median latency of a Cosmos DB operation (default: 10)")
+    parser.add_argument('--sigma', type=float, default=0.5, help="spread of the log-normal latency and token distributions (default: 0.5)")
+    parser.add_argument('--lag-interval-ms', type=float, default=10, help="sampling interval of the event loop lag (default: 10)")
+    parser.add_argument('--seed', type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument('--output', help="path of the JSON report (default: standard output)")
+    return parser.parse_args(args)
+
+
+def get_percentiles(values: list) -> dict:
+    """
+    Get the percentiles of a list of durations.
+
+    Args:
+        values (list): The durations, in seconds.
+
+    Returns:
+        dict: The count, mean, p50, p95, p99 and max, in milliseconds.
+    """
+    if not values:
+        return {'count': 0}
+
+    values = sorted(values)
+
+    def percentile(p):
+        return round(1000 * values[min(len(values) - 1, int(p / 100 * len(values)))], 2)
+
+    return {
+        'count': len(values),
+        'mean': round(1000 * sum(values) / len(values), 2),
+        'p50': percentile(50),
+        'p95': percentile(95),
+        'p99': percentile(99),
+        'max': round(1000 * values[-1], 2)
+    }
+
+
+def parse_server_timing(header: str) -> dict:
+    """
+    Parse a Server-Timing header.
+
+    Args:
+        header (str): The header value.
+
+    Returns:
+        dict: The stage durations, in seconds.
+    """
+    timings = {}
+    for metric in (header or '').split(','):
+        name, _, duration = metric.strip().partition(';dur=')
+        if name and duration:
+            timings[name] = float(duration) / 1000
+    return timings
+
+
+def create_clients(args: argparse.Namespace) -> ClientRegistry:
+    """
+    Create the client registry of the application, with the service stand-ins.
+
+    Args:
+        args (argparse.Namespace): The benchmark settings.
+
+    Returns:
+        ClientRegistry: The client registry.
+    """
+    rng = random.Random(args.seed)
+
+    def distribution(median):
+        return Distribution(median, args.sigma, rng)
+
+    clients = ClientRegistry()
+    clients.async_openai_client = FakeAsyncOpenAI(
+        chat_latency = distribution(args.chat_latency_ms / 1000),
+        completion_tokens = distribution(args.completion_tokens),
+        token_latency = distribution(args.token_latency_ms / 1000),
+        embedding_latency = distribution(args.embedding_latency_ms / 1000)
+    )
+    if args.local_index:
+        clients.async_search_client = LocalSearchClient(path = args.local_index)
+    else:
+        clients.async_search_client = FakeAsyncSearchClient(distribution(args.search_latency_ms / 1000), args.document_tokens)
+    clients.async_cosmos_container = FakeCosmosContainer(distribution(args.cosmos_latency_ms / 1000))
+    if clients.history_writer:
+        clients.history_writer.container = clients.async_cosmos_container
+
+    return clients
+
+
+async def monitor_event_loop(interval: float, lags: list) -> None:
+    """
+    Sample the event loop lag (the delay of a timer beyond its due time), until cancelled.
+
+    Args:
+        interval (float): The sampling interval, in seconds.
+        lags (list): The list the lags are appended to, in seconds.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        due_time = loop.time() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0, loop.time() - due_time))
+
+
+async def run_user(client: httpx.AsyncClient, args: argparse.Namespace, rng: random.Random, counter: list, results: dict) -> None:
+    """
+    Run a virtual user, holding conversations until all the chat requests are sent.
+
+    Args:
+        client (httpx.AsyncClient): The HTTP client of the application.
+        args (argparse.Namespace): The benchmark settings.
+        rng (random.Random): The random generator.
+        counter (list): The number of chat requests left to send (shared by the virtual users).
+        results (dict): The results, by endpoint.
+    """
+    user_id = str(uuid.uuid4())
+
+    while counter[0] > 0:
+        session_id = str(uuid.uuid4())
+
+        for _ in range(args.turns):
+            if counter[0] <= 0:
+                return
+            counter[0] -= 1
+
+            response = await send(client, results['chat'], '/api/chat', {
+                'session_id': session_id,
+                'user_id': user_id,
+                'user_prompt': rng.choice(QUESTIONS[:max(1, args.questions)])
+            })
+
+            if response is not None and rng.random() < args.feedback_ratio:
+                await send(client, results['feedback'], '/api/feedback', {
+                    'id': response['response_id'],
+                    'session_id': session_id,
+                    'feedback_rating': rng.random() < 0.8
+                })
+
+
+async def send(client: httpx.AsyncClient, result: dict, path: str, body: dict) -> dict:
+    """
+    Send a request to the application and record its latency, status and stage timings.
+
+    Args:
+        client (httpx.AsyncClient): The HTTP client of the application.
+        result (dict): The results of the endpoint.
+        path (str): The path of the endpoint.
+        body (dict): The request body.
+
+    Returns:
+        dict: The response body, or None if the request failed.
+    """
+    start_time = time.perf_counter()
+    response = await client.post(path, json=body)
+    result['latencies'].append(time.perf_counter() - start_time)
+
+    status = str(response.status_code)
+    result['status'][status] = result['status'].get(status, 0) + 1
+
+    for name, duration in parse_server_timing(response.headers.get('Server-Timing')).items():
+        result['stages'].setdefault(name, []).append(duration)
+
+    return response.json() if response.status_code == 200 else None
+
+
+async def run_benchmark(args: argparse.Namespace) -> dict:
+    """
+    Run the benchmark.
+
+    Args:
+        args (argparse.Namespace): The benchmark settings.
+
+    Returns:
+        dict: The report.
+    """
+    rng = random.Random(args.seed)
+    clients = create_clients(args)
+    main.app.state.clients = clients
+
+    results = {endpoint: {'latencies': [], 'status': {}, 'stages': {}} for endpoint in ['chat', 'feedback']}
+    lags = []
+    counter = [args.requests]
+
+    monitor = asyncio.create_task(monitor_event_loop(args.lag_interval_ms / 1000, lags))
+    start_time = time.perf_counter()
+
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark', timeout=None) as client:
+            await asyncio.gather(*[
+                run_user(client, args, random.Random(rng.random()), counter, results)
+                for _ in range(args.concurrency)
+            ])
+        duration = time.perf_counter() - start_time
+
+        # Write the queued chat history before reading the statistics
+        await clients.drain()
+        stats = clients.get_stats()
+
+    finally:
+        monitor.cancel()
+        await clients.aclose()
+
+    return {
+        'settings': vars(args),
+        'duration_s': round(duration, 3),
+        'endpoints': {
+            endpoint: {
+                'requests': len(result['latencies']),
+                'requests_per_second': round(len(result['latencies']) / duration, 2),
+                'status': result['status'],
+                'latency_ms': get_percentiles(result['latencies']),
+                'stages_ms': {name: get_percentiles(durations) for name, durations in result['stages'].items()}
+            }
+            for endpoint, result in results.items()
+        },
+        'event_loop_lag_ms': get_percentiles(lags),
+        'service_calls': {
+            'chat_completions': clients.async_openai_client.chat.completions.calls,
+            'prompt_cache_hit_rate': round(clients.async_openai_client.chat.completions.cached_tokens / max(clients.async_openai_client.chat.completions.prompt_tokens, 1), 3),
+            'embeddings': clients.async_openai_client.embeddings.calls,
+            'search_queries': clients.async_search_client.calls if not args.local_index else None
+        },
+        'stats': stats
+    }
+
+
+def main_cli(args: list = None) -> None:
+    """
+    Run the benchmark from the command line and write the report.
+
+    Args:
+        args (list, optional): The arguments. Defaults to the command line arguments.
+    """
+    arguments = get_arguments(args)
+    report = asyncio.run(run_benchmark(arguments))
+    text = json.dumps(report, indent=2)
+
+    if arguments.output:
+        with open(arguments.output, 'w') as file:
+            file.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main_cli()
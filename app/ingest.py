@@ -0,0 +1,125 @@
+"""
+Loads documents into the search index, from a local folder or an Azure Storage blob container.
+
+New and changed chunks are embedded and uploaded; unchanged chunks are skipped, using the state file
+of the previous runs (which also lets an interrupted run resume). For instance:
+
+    cd app
+    python ingest.py --path ../docs --base-url https://contoso.com/docs
+    python ingest.py --container documents --prefix hr/ --delete-missing
+    SEARCH_BACKEND=local LOCAL_SEARCH_INDEX_PATH=../index python ingest.py --path ../docs
+
+When the index content changes, the search results and answers cached by the application are
+invalidated: the index version is bumped in the redis shared cache tier, or in the chat history
+Cosmos DB container, read by all the application instances. Without either (local development), call
+the cache invalidation endpoint of the application (--invalidate-url, with the ADMIN_API_KEY admin key).
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import httpx
+
+from backend.config import environment
+from backend.config import startup
+from backend.services.clients import ClientRegistry
+from backend.services.gpt import AsyncGptModel
+from backend.services.ingestion import BlobDocumentSource, DocumentIngestor, IngestionState, LocalDocumentSource
+
+
+def get_arguments(args: list = None) -> argparse.Namespace:
+    """
+    Parse the command line arguments.
+
+    Args:
+        args (list, optional): The arguments. Defaults to the command line arguments.
+
+    Returns:
+        argparse.Namespace: The ingestion settings.
+    """
+    parser = argparse.ArgumentParser(description="Load documents into the search index.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--path', help="local folder of the documents")
+    source.add_argument('--container', help="blob container of the documents (AZURE_STORAGE_CONNECTION_STRING)")
+    parser.add_argument('--prefix', help="name prefix of the blobs")
+    parser.add_argument('--base-url', help="base URL of the local documents (default: file URLs)")
+    parser.add_argument('--state', default='.ingestion-state.json', help="state file of the incremental ingestion (default: .ingestion-state.json)")
+    parser.add_argument('--delete-missing', action='store_true', help="delete the documents of previous runs no longer in the source")
+    parser.add_argument('--chunk-tokens', type=int, default=environment.INGESTION_CHUNK_TOKENS, help="size of the chunks, in tokens")
+    parser.add_argument('--max-concurrency', type=int, default=environment.INGESTION_MAX_CONCURRENCY, help="number of batches embedded and uploaded at a time")
+    parser.add_argument('--invalidate-url', help="cache invalidation endpoint of the application, called when the index content changed (e.g. https://contoso.com/api/cache/invalidate)")
+    return parser.parse_args(args)
+
+
+async def ingest(arguments: argparse.Namespace) -> dict:
+    """
+    Load the documents into the search index, creating the Azure AI Search index if it does not exist,
+    or saving the local index.
+
+    Args:
+        arguments (argparse.Namespace): The ingestion settings.
+
+    Returns:
+        dict: The ingestion counters.
+    """
+    if environment.SEARCH_BACKEND == 'azure':
+        await asyncio.to_thread(startup.init_search_index)
+
+    clients = ClientRegistry()
+    try:
+        # The embeddings of the documents are not cached, they are only generated once
+        gpt_model = AsyncGptModel(clients = clients)
+        gpt_model.embedding_cache = None
+
+        source = LocalDocumentSource(arguments.path, arguments.base_url) if arguments.path \
+            else BlobDocumentSource(arguments.container, arguments.prefix)
+
+        ingestor = DocumentIngestor(
+            gpt_model,
+            clients.async_search_client,
+            IngestionState(arguments.state),
+            chunk_tokens = arguments.chunk_tokens,
+            max_concurrency = arguments.max_concurrency
+        )
+        stats = await ingestor.ingest(source, arguments.delete_missing)
+
+        # The local index is saved once all the documents are loaded (Azure AI Search needs no save)
+        await clients.async_search_client.save()
+
+        if stats['uploaded'] or stats['deleted']:
+            await invalidate_caches(clients, arguments.invalidate_url)
+
+        return stats
+
+    finally:
+        await clients.aclose()
+
+
+async def invalidate_caches(clients: ClientRegistry, invalidate_url: str = None) -> None:
+    """
+    Invalidate the search results and answers cached by the application instances, after the index content changed.
+
+    Args:
+        clients (ClientRegistry): The client registry.
+        invalidate_url (str, optional): The cache invalidation endpoint of the application.
+    """
+    # The index version is propagated to the application instances through the redis shared tier, or the chat history container
+    version = await clients.index_version.bump()
+    logging.info(f"Index version bumped to {version}")
+
+    if invalidate_url:
+        async with httpx.AsyncClient(timeout=environment.HTTP_TIMEOUT) as client:
+            response = await client.post(invalidate_url, headers={'X-Admin-Key': environment.ADMIN_API_KEY or ''})
+            response.raise_for_status()
+        logging.info(f"Application caches invalidated: {response.text}")
+
+    elif environment.CACHE_SHARED_TIER != 'redis' and environment.CHAT_HISTORY_STORE == 'local':
+        logging.warning("The application caches are not invalidated: without the redis shared tier or Cosmos DB, use --invalidate-url")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    for logger in ['azure', 'httpx']:
+        logging.getLogger(logger).setLevel(logging.WARNING)
+    stats = asyncio.run(ingest(get_arguments()))
+    sys.stdout.write(json.dumps(stats, indent=2) + '\n')
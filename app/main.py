@@ -1,5 +1,7 @@
 import os
 import sys
+import asyncio
+import hmac
 import logging
 import time
 import uvicorn
@@ -9,19 +11,32 @@ from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi import APIRouter
 from fastapi import Request
+from fastapi import Depends
+from fastapi import HTTPException
+from fastapi import Response
+from fastapi import Header
 from fastapi.responses import PlainTextResponse
 from fastapi.responses import JSONResponse
 from fastapi.responses import HTMLResponse
+from fastapi.responses import StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
 from backend.api import chat
+from backend.api import batch
 from backend.api import feedback
+from backend.api import followup
+from backend.config import environment
 from backend.config import startup
 from backend.config.models import ChatRequest
 from backend.config.models import FeedbackRequest
 from backend.config.models import ChatResponse
 from backend.config.models import FeedbackResponse
+from backend.config.models import FeedbackBulkRequest
+from backend.config.models import FeedbackBulkResponse
+from backend.config.models import FollowupResponse
+from backend.services.clients import ClientRegistry
+from backend.services.telemetry import telemetry, request_timings
 
 
 # Configure logging
@@ -42,11 +57,17 @@ router = APIRouter()
 # Define the lifespan context manager
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup code
+    # Startup code (the warm-up runs in the background, the application is ready when it finishes)
     logging.info("Application startup: Initializing resources")
-    startup.init_search_index()
+    app.state.clients = ClientRegistry()
+    app.state.readiness = startup.Readiness()
+    warm_up = asyncio.create_task(app.state.readiness.warm_up(app.state.clients))
     yield
     # Shutdown code
+    logging.info("Application shutdown: Writing queued chat history and releasing resources")
+    warm_up.cancel()
+    await app.state.clients.drain()
+    await app.state.clients.aclose()
 
 # Set the lifespan context manager
 app.router.lifespan_context = lifespan
@@ -66,6 +87,19 @@ static_directory = os.path.join(app_directory, "frontend/static")
 app.mount("/static", StaticFiles(directory=static_directory), name="static")
 
 
+# Get the process-wide client registry created by the lifespan context manager
+def get_clients(request: Request) -> ClientRegistry:
+    return request.app.state.clients
+
+
+# Check the admin key of the admin endpoints (not found when no admin key is configured)
+def require_admin_key(admin_key: str = Header(default=None, alias="X-Admin-Key")) -> None:
+    if not environment.ADMIN_API_KEY:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not admin_key or not hmac.compare_digest(admin_key.encode('utf-8'), environment.ADMIN_API_KEY.encode('utf-8')):
+        raise HTTPException(status_code=401, detail="Invalid admin key")
+
+
 # Set up assistant index page
 @app.get("/", tags=["index"], response_class=HTMLResponse)
 def index(request: Request):
@@ -79,25 +113,105 @@ async def ping():
     return f"Azure AI Assistant API Backend Services running on Python v{version.major}.{version.minor}"
 
 
-# Set up API route for chat endpoint
+# Set up readiness check endpoint (ready once the startup warm-up has finished)
+@app.get("/ready", tags=["health_check"])
+async def ready(request: Request):
+    readiness = request.app.state.readiness
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.get_status())
+
+
+# Set up statistics endpoint (caches and tool payload compaction)
+@app.get("/stats", tags=["health_check"])
+async def stats(clients: ClientRegistry = Depends(get_clients)):
+    return clients.get_stats()
+
+
+# Set up metrics endpoint (Prometheus text exposition format)
+@app.get("/metrics", tags=["health_check"], response_class=PlainTextResponse)
+async def metrics(clients: ClientRegistry = Depends(get_clients)):
+    return PlainTextResponse(telemetry.render_metrics(clients.get_stats()), media_type="text/plain; version=0.0.4")
+
+
+# Set up cache invalidation endpoint, to be called when the search index content changes (admin key required)
+@router.post("/cache/invalidate", tags=["cache_api_endpoint"], dependencies=[Depends(require_admin_key)])
+async def cache_invalidate_endpoint(clients: ClientRegistry = Depends(get_clients)):
+    """
+    Bump the index version, invalidating the cached search results and answers. The version reaches the
+    other application instances through the redis shared cache tier, or the chat history Cosmos DB
+    container, within INDEX_VERSION_REFRESH_INTERVAL seconds. With neither (CHAT_HISTORY_STORE=local
+    without redis), only the instance receiving the call is invalidated.
+    """
+    return {"index_version": await clients.index_version.bump()}
+
+
+# Set up API route for chat endpoint (a request retried with the same Idempotency-Key header gets the stored response)
 @router.post("/chat", tags=["chat_api_endpoint"], response_model=ChatResponse)
-async def chat_endpoint(request: ChatRequest):
-    return chat.run(request)
+async def chat_endpoint(request: ChatRequest, response: Response, clients: ClientRegistry = Depends(get_clients),
+                        idempotency_key: str = Header(default=None, alias="Idempotency-Key")):
+    chat_response = await chat.run(request, clients, idempotency_key)
+    response.headers["X-Cache"] = "HIT" if chat_response.cache_hit else "MISS"
+    return chat_response
+
+
+# Set up API route for streaming chat endpoint (server-sent events)
+@router.post("/chat/stream", tags=["chat_api_endpoint"], response_class=StreamingResponse)
+async def chat_stream_endpoint(request: ChatRequest, clients: ClientRegistry = Depends(get_clients)):
+    return StreamingResponse(
+        chat.stream(request, clients),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# Set up API route for batch chat endpoint (JSON Lines of chat requests in, JSON Lines of results out, in completion order)
+@router.post("/chat/batch", tags=["chat_api_endpoint"], response_class=StreamingResponse)
+async def chat_batch_endpoint(request: Request, max_concurrency: int = None, include_followups: bool = True,
+                              persist_history: bool = True, clients: ClientRegistry = Depends(get_clients)):
+    # The requests are answered as the body is received, up to CHAT_BATCH_MAX_BYTES
+    if int(request.headers.get("content-length") or 0) > environment.CHAT_BATCH_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"The batch exceeds the maximum size of {environment.CHAT_BATCH_MAX_BYTES} bytes")
+    body_read = asyncio.Event()
+    return batch.ChatBatchResponse(
+        batch.run(request.stream(), clients, max_concurrency, include_followups, persist_history, body_read),
+        body_read,
+        media_type="application/x-ndjson"
+    )
+
+
+# Set up API route for follow-up questions endpoint
+@router.get("/followups/{response_id}", tags=["followup_api_endpoint"], response_model=FollowupResponse)
+async def followup_endpoint(response_id: str, wait: bool = False, clients: ClientRegistry = Depends(get_clients)):
+    response = await followup.run(response_id, clients, wait)
+    if response is None:
+        raise HTTPException(status_code=404, detail=f"Follow-up questions not found for response {response_id}")
+    return response
 
 
 # Set up API route for feedback endpoint
 @router.post("/feedback", tags=["feedback_api_endpoint"], response_model=FeedbackResponse)
-async def feedback_endpoint(request: FeedbackRequest):
-    return feedback.run(request)
+async def feedback_endpoint(request: FeedbackRequest, clients: ClientRegistry = Depends(get_clients)):
+    return await feedback.run(request, clients)
+
+
+# Set up API route for bulk feedback endpoint
+@router.post("/feedback/bulk", tags=["feedback_api_endpoint"], response_model=FeedbackBulkResponse)
+async def feedback_bulk_endpoint(request: FeedbackBulkRequest, clients: ClientRegistry = Depends(get_clients)):
+    return await feedback.run_bulk(request, clients)
 
 
-# Set middleware to intercept requests and include process time in response header 
+# Set middleware to intercept requests and include process time and stage timings in response headers
 @app.middleware("http")
 async def add_process_time_header(request, call_next):
     start_time = time.time()
+    timings = {}
+    request_timings.set(timings)
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = str(f'{process_time:0.4f} sec')
+    # Streaming responses only include the stages completed before the response headers are sent
+    response.headers["Server-Timing"] = telemetry.get_server_timing(dict(timings, total=process_time))
+    route = getattr(request.scope.get("route"), "path", "other")
+    telemetry.request_duration.observe(process_time, method=request.method, route=route, status=response.status_code)
     return response
 
 